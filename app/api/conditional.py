@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Any, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+# headers of validators are stored with cached body, see pack_response
+VALIDATORS_HEADERS = ("ETag", "Last-Modified")
+
+
+def get_validators_headers(
+    version: Any, last_modified: Optional[datetime]
+) -> dict[str, str]:
+    """
+    Version must be read before data of response,
+    so response can be newer than its ETag, but not older
+    """
+    headers = {"ETag": f'"{version}"'}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True
+        )
+    return headers
+
+
+def is_not_modified(request: Request, headers: dict[str, str]) -> bool:
+    """
+    Only If-None-Match is checked: dates of items come from imports and can go back,
+    and they aren't changed by deletes, so If-Modified-Since can't be trusted
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    return headers["ETag"] in etags
+
+
+def not_modified_response(headers: dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def pack_response(headers: dict[str, str], body: bytes) -> bytes:
+    """
+    body is stored with its validators, so they can't be newer than it
+    """
+    lines = (f"{headers.get(name, '')}\n" for name in VALIDATORS_HEADERS)
+    return "".join(lines).encode() + body
+
+
+def unpack_response(value: bytes) -> tuple[dict[str, str], bytes]:
+    parts = value.split(b"\n", len(VALIDATORS_HEADERS))
+    headers = {
+        name: part.decode() for name, part in zip(VALIDATORS_HEADERS, parts[:-1]) if part
+    }
+    return headers, parts[-1]
@@ -2,6 +2,35 @@ get_nodes = """
 Получить информацию об элементе по идентификатору.
 При получении информации о категории также предоставляется
 информация о её дочерних элементах.
+С параметром depth возвращается только depth уровней дочерних элементов,
+у категорий последнего уровня children = null.
+С параметром limit у каждой категории возвращается не больше limit дочерних
+элементов в порядке идентификаторов; если их больше, у категории есть поле
+childrenCursor. Следующую страницу дочерних элементов категории можно получить
+по её идентификатору с cursor = childrenCursor.
+Цена категорий всегда считается по всем товарам, а не по возвращенной части дерева.
+Ответ содержит заголовки ETag (версия поддерева, меняется при любом его изменении)
+и Last-Modified (дата элемента). Если ETag совпадает с If-None-Match,
+возвращается 304 без тела.
+"""
+
+get_nodes_batch = """
+Получить информацию о нескольких элементах по списку идентификаторов одним запросом.
+Для каждого идентификатора возвращается элемент со всеми дочерними элементами,
+как в /nodes/{id}, либо ошибка, если элемент не найден.
+Поддеревья элементов, вложенных в другие запрошенные элементы, читаются один раз.
+Количество идентификаторов ограничено настройкой NODES_BATCH_MAX_IDS.
+"""
+
+get_nodes_changes = """
+Получить элемент и его дочерние элементы, дата которых позже since,
+в порядке даты, без дочерних элементов (children = null).
+Вместе с ними возвращаются их родительские категории внутри поддерева
+с текущими ценами (ancestors), если сами они не изменились.
+Возвращается не больше limit элементов; если есть ещё, в ответе есть nextCursor,
+следующую часть можно получить с cursor = nextCursor и тем же since.
+Дата элемента -- дата импорта, в котором он обновлен.
+Удаленные элементы не возвращаются.
 """
 
 delete_node = """
@@ -14,6 +43,62 @@ imports = """
 Импортирует новые товары и/или категории.
 Товары/категории импортированные повторно обновляют текущие.
 Изменение типа элемента с товара на категорию или с категории на товар не допускается.
+Возвращает количество добавленных, обновленных и неизмененных элементов.
+Если включена настройка SKIP_UNCHANGED_ITEMS, элементы, у которых не изменились
+название, цена и родитель, не перезаписываются: их дата остается прежней,
+они не попадают в статистику и не обновляют дату родительских категорий.
+Глубина дерева ограничена 64 уровнями: импорт, после которого элемент
+оказывается глубже, отклоняется с кодом 400.
+"""
+
+imports_stream = """
+Потоковый импорт товаров и/или категорий в формате NDJSON:
+каждая строка тела запроса -- один элемент, дата обновления передается в параметре.
+Элементы сохраняются частями по chunkSize штук, каждая часть -- в своей транзакции.
+Элементы, родитель которых ещё не встретился, откладываются до следующих частей.
+Отложить можно не более chunkSize элементов: родители должны идти раньше детей.
+Строка длиннее STREAM_IMPORT_MAX_LINE_SIZE байт отклоняется с кодом 400.
+Возвращает количество импортированных элементов по частям.
+При ошибке уже сохраненные части не откатываются,
+их количество возвращается вместе с сообщением об ошибке.
+"""
+
+imports_async = """
+При async=true импорт не выполняется сразу, а ставится в очередь:
+возвращается 202 и идентификатор задачи, статус которой можно получить в /imports/{id}.
+Задачи применяются по одной в порядке отправки,
+так же как те же импорты, отправленные последовательно без async.
+Синхронные импорты и удаления, отправленные после задачи, ждут её применения
+не дольше IMPORT_JOBS_WAIT_TIMEOUT секунд, иначе возвращают 503.
+Элементы проверяются на корректность формата до постановки в очередь.
+"""
+
+import_job = """
+Статус задачи асинхронного импорта: PENDING, RUNNING, DONE или FAILED.
+Для FAILED в поле error указана причина ошибки.
+"""
+
+cache_stats = """
+Счетчики попаданий и промахов кэша ответов `/nodes/{id}`,
+число и суммарный размер закэшированных ответов.
+Кэш включается настройками NODES_CACHE_MAX_ITEMS и NODES_CACHE_MAX_BYTES,
+при импорте или удалении сбрасываются ответы только измененных элементов и их родителей.
+"""
+
+pool_stats = """
+Состояние пулов соединений с базой (`read_database` при READ_DATABASE_URL):
+число соединений, занятых и свободных, ожидающих запросов и таймаутов,
+гистограммы ожидания соединения и времени его удержания в секундах.
+С DB_POOL_ADAPTIVE лимит пула меняется между MIN_CONNECTION_COUNT и MAX_CONNECTION_COUNT
+по времени ожидания, `/imports` занимают не больше IMPORTS_MAX_CONNECTIONS соединений.
+"""
+
+metrics = """
+Метрики процесса в текстовом формате Prometheus: гистограммы времени запросов
+по шаблонам путей (`/nodes/{id}`, `/imports`, ...) и функций `app/models/*/queries.py`,
+число строк, возвращенных функциями запросов, размеры тел запросов и ответов,
+число обрабатываемых запросов и состояние пулов соединений.
+У каждого процесса-воркера свои метрики.
 """
 
 sales = """
@@ -22,6 +107,8 @@ sales = """
 Обновление цены не означает её изменение. Обновления цен удаленных товаров недоступны.
 При обновлении цены товара, средняя цена категории, которая содержит этот товар, тоже
 обновляется.
+Ответ содержит заголовки ETag и Last-Modified (дата последнего обновления в окне).
+Если ETag совпадает с If-None-Match, возвращается 304 без тела.
 """
 
 
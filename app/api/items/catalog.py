@@ -0,0 +1,280 @@
+import asyncio
+import logging
+from array import array
+from datetime import datetime
+from typing import Optional
+
+from app.core.changes import committed_items_changes_handlers
+from app.models.items.queries import (
+    get_items_and_ancestors_tree_rows,
+    iterate_all_items_tree_rows,
+)
+from app.types import DbItemsTreeRow, DbItemVersion, ItemsOut, ItemType
+
+logger = logging.getLogger(__name__)
+
+NO_INDEX = -1
+NO_PRICE = -1
+
+
+class CatalogOverflow(Exception):
+    pass
+
+
+class ItemsCatalog:
+    """
+    Whole items tree kept in memory of worker, answers /nodes without database.
+
+    Item is interned to index of slot in arrays: parent index, price,
+    aggregates, version, index of date in interned dates and adjacency array
+    of children indexes for categories. Slots of deleted items are reused.
+
+    About 280 bytes per item, mostly id and name strings and dict of ids:
+    ~280 MB per million items, see benchmarks/catalog_memory.py.
+    Number of items is bounded by max_items, CatalogOverflow is raised above it.
+
+    Catalog is changed only by committed rows read from database,
+    changes must be applied one by one in order they are read,
+    see items_catalog_apply_changes.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._index_by_id: dict[str, int] = {}
+        self._ids: list[Optional[str]] = []
+        self._names: list[Optional[str]] = []
+        self._parents = array("i")
+        self._is_category = bytearray()
+        self._prices = array("q")
+        self._total_prices = array("q")
+        self._total_offer_counts = array("q")
+        self._dates = array("i")
+        self._versions = array("q")
+        self._children: list[Optional[array]] = []  # type: ignore
+        self._free_indexes: list[int] = []
+        self._date_values: list[str] = []
+        self._date_index_by_value: dict[str, int] = {}
+        self.is_loaded = False
+
+    def __len__(self) -> int:
+        return len(self._index_by_id)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._index_by_id
+
+    async def load(self) -> None:
+        async for row in iterate_all_items_tree_rows():
+            self._upsert(row)
+        self.is_loaded = True
+
+    async def apply_changes(self, item_ids: list[str]) -> None:
+        """
+        Read changed items and their ancestors from database.
+        Changed items which are not found are deleted with their subtrees.
+        """
+        rows = await get_items_and_ancestors_tree_rows(item_ids)
+        found_ids = set()
+        for row in rows:
+            self._upsert(row)
+            found_ids.add(row[0])
+        for item_id in item_ids:
+            if item_id not in found_ids and item_id in self._index_by_id:
+                self._delete(self._index_by_id[item_id])
+
+    def get_tree(self, item_id: str) -> Optional[ItemsOut]:
+        index = self._index_by_id.get(item_id)
+        if index is None:
+            return None
+        return self._get_tree(index)
+
+    def get_version(self, item_id: str) -> Optional[DbItemVersion]:
+        index = self._index_by_id.get(item_id)
+        if index is None:
+            return None
+        date = self._date_values[self._dates[index]].replace(".000Z", "+00:00")
+        return self._versions[index], datetime.fromisoformat(date)
+
+    def _get_tree(self, index: int) -> ItemsOut:
+        parent_index = self._parents[index]
+        node: ItemsOut = {
+            "id": self._ids[index],  # type: ignore
+            "name": self._names[index],  # type: ignore
+            "type": ItemType.offer.value,
+            "parentId": self._ids[parent_index] if parent_index != NO_INDEX else None,
+            "date": self._date_values[self._dates[index]],
+            "price": self._prices[index],
+            "children": None,
+        }
+        if self._is_category[index]:
+            total_offer_count = self._total_offer_counts[index]
+            node["type"] = ItemType.category.value
+            node["price"] = (
+                self._total_prices[index] // total_offer_count
+                if total_offer_count
+                else None
+            )
+            node["children"] = [
+                self._get_tree(child_index)
+                for child_index in self._children[index]  # type: ignore
+            ]
+        return node
+
+    def _get_date_index(self, date: str) -> int:
+        # items of one import share date
+        date_index = self._date_index_by_value.get(date)
+        if date_index is None:
+            date_index = len(self._date_values)
+            self._date_values.append(date)
+            self._date_index_by_value[date] = date_index
+        return date_index
+
+    def _upsert(self, row: DbItemsTreeRow) -> None:
+        """
+        parent of item must be already in catalog
+        """
+        (
+            item_id,
+            parent_id,
+            item_type,
+            price,
+            name,
+            date,
+            total_price,
+            total_offer_count,
+            version,
+        ) = row
+        parent_index = self._index_by_id[parent_id] if parent_id is not None else NO_INDEX
+        is_category = item_type == ItemType.category.value
+
+        index = self._index_by_id.get(item_id)
+        if index is None:
+            if len(self._index_by_id) >= self.max_items:
+                raise CatalogOverflow(f"Catalog can't keep more than {self.max_items}")
+            index = self._allocate(item_id)
+            self._add_child(parent_index, index)
+        elif self._parents[index] != parent_index:
+            self._remove_child(self._parents[index], index)
+            self._add_child(parent_index, index)
+
+        self._names[index] = name
+        self._parents[index] = parent_index
+        self._is_category[index] = is_category
+        self._prices[index] = price if price is not None else NO_PRICE
+        self._total_prices[index] = total_price
+        self._total_offer_counts[index] = total_offer_count
+        self._versions[index] = version
+        self._dates[index] = self._get_date_index(
+            date.isoformat().replace("+00:00", ".000Z")
+        )
+        if is_category and self._children[index] is None:
+            self._children[index] = array("i")
+
+    def _allocate(self, item_id: str) -> int:
+        if self._free_indexes:
+            index = self._free_indexes.pop()
+            self._ids[index] = item_id
+        else:
+            index = len(self._ids)
+            self._ids.append(item_id)
+            self._names.append(None)
+            self._parents.append(NO_INDEX)
+            self._is_category.append(0)
+            self._prices.append(NO_PRICE)
+            self._total_prices.append(0)
+            self._total_offer_counts.append(0)
+            self._dates.append(0)
+            self._versions.append(0)
+            self._children.append(None)
+        self._index_by_id[item_id] = index
+        return index
+
+    def _add_child(self, parent_index: int, index: int) -> None:
+        if parent_index != NO_INDEX:
+            self._children[parent_index].append(index)  # type: ignore
+
+    def _remove_child(self, parent_index: int, index: int) -> None:
+        if parent_index != NO_INDEX:
+            self._children[parent_index].remove(index)  # type: ignore
+
+    def _delete(self, index: int) -> None:
+        self._remove_child(self._parents[index], index)
+        indexes = [index]
+        while indexes:
+            index = indexes.pop()
+            if (children := self._children[index]) is not None:
+                indexes.extend(children)
+            del self._index_by_id[self._ids[index]]  # type: ignore
+            self._ids[index] = None
+            self._names[index] = None
+            self._children[index] = None
+            self._free_indexes.append(index)
+
+
+items_catalog: Optional[ItemsCatalog] = None
+# catalog is loaded and changed by one at a time
+_items_catalog_lock = asyncio.Lock()
+
+
+def get_items_catalog() -> Optional[ItemsCatalog]:
+    """
+    returns catalog only if it's loaded
+    """
+    if items_catalog is None or not items_catalog.is_loaded:
+        return None
+    return items_catalog
+
+
+async def _load_items_catalog(max_items: int) -> None:
+    """
+    new catalog replaces the current one only when it's loaded,
+    must be called under _items_catalog_lock
+    """
+    global items_catalog
+    catalog = ItemsCatalog(max_items=max_items)
+    try:
+        await catalog.load()
+    except CatalogOverflow:
+        logger.exception("Items catalog is disabled, /nodes is read from database")
+        items_catalog = None
+    else:
+        items_catalog = catalog
+
+
+async def items_catalog_init(max_items: int, load: bool = True) -> None:
+    """
+    Without load catalog is loaded by the first call of items_catalog_apply_changes,
+    which ItemsChangesListener makes after it's connected
+    """
+    global items_catalog
+    committed_items_changes_handlers.append(items_catalog_apply_changes)
+    items_catalog = ItemsCatalog(max_items=max_items)
+    if load:
+        async with _items_catalog_lock:
+            await _load_items_catalog(max_items=max_items)
+
+
+async def items_catalog_apply_changes(item_ids: Optional[list[str]]) -> None:
+    """
+    handler of changes of items, see ItemsChangesHandler
+    """
+    global items_catalog
+    async with _items_catalog_lock:
+        if items_catalog is None:
+            return
+        if item_ids is None:
+            await _load_items_catalog(max_items=items_catalog.max_items)
+        elif items_catalog.is_loaded:
+            try:
+                await items_catalog.apply_changes(item_ids)
+            except CatalogOverflow:
+                logger.exception(
+                    "Items catalog is disabled, /nodes is read from database"
+                )
+                items_catalog = None
+
+
+async def items_catalog_close() -> None:
+    global items_catalog
+    if items_catalog_apply_changes in committed_items_changes_handlers:
+        committed_items_changes_handlers.remove(items_catalog_apply_changes)
+    items_catalog = None
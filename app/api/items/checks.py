@@ -1,21 +1,25 @@
-import asyncio
 from collections import defaultdict
 from typing import DefaultDict, Optional
 
 from fastapi import HTTPException
 
-from app.models.items.queries import (
-    count_elements_with_ids,
-    get_items,
-    get_items_by_ids_and_type,
-)
+from app.models.items.queries import get_items
 from app.schemas import ImportItem
-from app.types import ItemType
+from app.types import DbItem, ItemType
 
 
 class AsyncChecks:
+    """
+    Checks of import against database.
+
+    Import items and their parents are fetched with one query,
+    all checks are made on fetched items, which are then reused
+    by ImportItemsManager, see items_in_db.
+    """
+
     def __init__(self, items: list[ImportItem]):
         self.items = items
+        self.items_in_db: Optional[dict[str, DbItem]] = None
         self._request_item_ids: Optional[list[str]] = None
         self._request_parent_ids: Optional[list[str]] = None
         self._not_null_parent_ids_must_be_in_db: Optional[list[str]] = None
@@ -37,41 +41,49 @@ class AsyncChecks:
             {
                 parentId
                 for parentId in self._request_parent_ids
-                if parentId and parentId not in self._request_item_ids
+                if parentId and parentId not in self._item_type_by_id
             }
         )
 
-    async def _check_all_parents_are_exist(self) -> None:
+    async def _fetch_items_in_db(self) -> None:
+        assert self._request_item_ids is not None
         assert self._not_null_parent_ids_must_be_in_db is not None
 
-        parent_items_count = await count_elements_with_ids(
-            self._not_null_parent_ids_must_be_in_db
-        )
-
-        if len(self._not_null_parent_ids_must_be_in_db) != parent_items_count:
-            err = "Not all parents exist for items: neither in request nor in database"  # noqa
-            raise HTTPException(status_code=400, detail=err)
+        item_ids = self._request_item_ids + self._not_null_parent_ids_must_be_in_db
+        self.items_in_db = {str(item.id): item for item in await get_items(item_ids)}
 
-    async def _check_all_parents_are_actually_parents(self) -> None:
+    def _check_all_parents_are_exist(self) -> None:
         assert self._not_null_parent_ids_must_be_in_db is not None
+        assert self.items_in_db is not None
 
-        offer_parents = await get_items_by_ids_and_type(
-            item_ids=self._not_null_parent_ids_must_be_in_db,
-            item_type=ItemType.offer.value,
-        )
-        if offer_parents:
-            detail = f"Some of parents are actually {ItemType.offer.value}, not {ItemType.category.value}"  # noqa
-            raise HTTPException(status_code=400, detail=detail)
+        for parent_id in self._not_null_parent_ids_must_be_in_db:
+            if parent_id not in self.items_in_db:
+                err = "Not all parents exist for items: neither in request nor in database"  # noqa
+                raise HTTPException(status_code=400, detail=err)
 
-    async def _check_category_is_not_changed(self) -> None:
+    def _check_all_parents_are_actually_parents(self) -> None:
+        assert self._request_parent_ids is not None
+        assert self._item_type_by_id is not None
+        assert self.items_in_db is not None
+
+        for parent_id in self._request_parent_ids:
+            if parent_id in self._item_type_by_id:
+                parent_type = self._item_type_by_id[parent_id]
+            else:
+                parent_type = self.items_in_db[parent_id].type
+            if parent_type == ItemType.offer.value:
+                detail = f"Some of parents are actually {ItemType.offer.value}, not {ItemType.category.value}"  # noqa
+                raise HTTPException(status_code=400, detail=detail)
+
+    def _check_category_is_not_changed(self) -> None:
         assert self._request_item_ids is not None
         assert self._item_type_by_id is not None
+        assert self.items_in_db is not None
 
-        items_already_in_db = await get_items(item_ids=self._request_item_ids)
         errs = []
-        for item in items_already_in_db:
-            item_id = str(item.id)
-            if item.type != self._item_type_by_id[item_id]:
+        for item_id in self._request_item_ids:
+            item = self.items_in_db.get(item_id)
+            if item is not None and item.type != self._item_type_by_id[item_id]:
                 errs.append(item_id)
 
         if errs:
@@ -80,10 +92,7 @@ class AsyncChecks:
             raise HTTPException(status_code=400, detail=detail)
 
     async def check(self) -> None:
-        await asyncio.gather(
-            *[
-                self._check_all_parents_are_exist(),
-                self._check_all_parents_are_actually_parents(),
-                self._check_category_is_not_changed(),
-            ]
-        )
+        await self._fetch_items_in_db()
+        self._check_all_parents_are_exist()
+        self._check_all_parents_are_actually_parents()
+        self._check_category_is_not_changed()
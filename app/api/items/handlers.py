@@ -1,28 +1,75 @@
+import base64
+import json
+import logging
 import uuid
+from collections import defaultdict
 from datetime import datetime
-from typing import Optional, Tuple, cast
+from typing import AsyncGenerator, AsyncIterator, Optional, Tuple, cast
+
+from fastapi import HTTPException
 
 from app.api.items.checks import AsyncChecks
+from app.core.cache import nodes_cache
+from app.core.changes import writing_items
+from app.core.config import get_app_settings
+from app.core.executor import run_cpu_bound
 from app.db.base import database
-from app.errors import NodeNotFound
+from app.db.routing import get_database
+from app.errors import LineTooLong, NodeNotFound, TreeTooDeep
+from app.models.import_jobs.queries import (
+    finish_import_job,
+    get_next_import_job,
+    start_import_job,
+)
 from app.models.items.queries import (
+    add_to_aggregates,
+    bulk_upsert_items,
     check_if_item_exists,
     filter_ids_in_db,
-    get_all_parent_ids_by_item_id,
-    get_items_tree_with_additional_info,
+    get_changed_items_tree_rows,
+    get_children_tree_rows,
+    get_deepest_descendant_path,
+    get_item_tree_row,
+    get_items_tree_json,
+    get_items_tree_rows,
+    get_items_tree_rows_by_ids,
+    get_items_trees_rows,
+    iterate_items_tree_rows,
+    lock_items_tree,
+    notify_items_changed,
+    set_new_items_version,
     update_date,
+    update_descendants_paths,
     upsert_items,
 )
-from app.models.items_statistic.queries import save_import_items_to_statistic
-from app.schemas import ImportItem
+from app.models.items.table_schema import MAX_PATH_DEPTH, PATH_SEPARATOR
+from app.models.items_statistic.queries import (
+    bulk_save_import_items_to_statistic,
+    save_import_items_to_statistic,
+)
+from app.schemas import (
+    ImportChunkOut,
+    ImportItem,
+    ImportItemsIn,
+    ImportOut,
+    StreamImportOut,
+)
 from app.types import (
+    DbImportJob,
+    DbItem,
+    DbItemsTreeRow,
     DbItemWithAddInfo,
     ImportItemToDb,
+    ImportJobStatus,
     ImportStatsItemToDb,
+    ItemsChangesOut,
     ItemsOut,
     ItemType,
+    PagedItemsOut,
 )
 
+logger = logging.getLogger(__name__)
+
 
 class RecursiveSQLOnlyItems:
     def __init__(self, start_item_id: str):
@@ -38,7 +85,14 @@ class RecursiveSQLOnlyItems:
         cls, dictionary: DbItemWithAddInfo, keys: Optional[list[str]] = None
     ) -> None:
         if not keys:
-            keys = ["total_price", "total_offer_count", "lvl", "parent_id"]
+            keys = [
+                "total_price",
+                "total_offer_count",
+                "lvl",
+                "parent_id",
+                "path",
+                "version",
+            ]
 
         for key in keys:
             cls.__del_if_exists(dictionary, key)
@@ -50,7 +104,9 @@ class RecursiveSQLOnlyItems:
         curr_tree["parentId"] = curr_tree["parent_id"]
         curr_tree["date"] = curr_tree["date"].replace("+00:00", ".000Z")
         if curr_tree["type"] == ItemType.offer.value:
-            # offer already has price
+            # offer already has price, offers above the deepest level get
+            # empty children from query
+            curr_tree["children"] = None
             cls.__delete_keys_values(curr_tree)
             return cast(ItemsOut, curr_tree)
 
@@ -61,9 +117,13 @@ class RecursiveSQLOnlyItems:
             curr_tree["price"] = None
             return cast(ItemsOut, curr_tree)
 
-        curr_tree["price"] = int(
-            curr_tree["total_price"] / curr_tree["total_offer_count"]
-        )
+        if curr_tree["total_offer_count"]:
+            curr_tree["price"] = (
+                curr_tree["total_price"] // curr_tree["total_offer_count"]
+            )
+        else:
+            # only empty categories inside
+            curr_tree["price"] = None
         cls.__delete_keys_values(curr_tree)
 
         new_children = []
@@ -74,176 +134,877 @@ class RecursiveSQLOnlyItems:
         curr_tree["children"] = new_children
         return cast(ItemsOut, curr_tree)
 
+    @classmethod
+    def _parse_tree(cls, json_tree: str) -> ItemsOut:
+        _db_tree: DbItemWithAddInfo = json.loads(json_tree)
+        db_tree: ItemsOut = cls._set_price_and_del_ambiguous_values(_db_tree)
+        return db_tree
+
     async def get(self) -> ItemsOut:
         if not (await check_if_item_exists(self.start_item_id)):
             raise NodeNotFound(node_id=self.start_item_id)
 
-        _db_tree: Optional[DbItemWithAddInfo] = await get_items_tree_with_additional_info(
-            self.start_item_id
+        json_tree = await get_items_tree_json(self.start_item_id)
+        assert json_tree is not None
+        # big trees are parsed in executor, see run_cpu_bound
+        return await run_cpu_bound(
+            self._parse_tree,
+            json_tree,
+            size=len(json_tree),
+            min_size=get_app_settings().cpu_executor_min_tree_bytes,
         )
-        assert _db_tree is not None
-        db_tree: ItemsOut = self._set_price_and_del_ambiguous_values(_db_tree)
-        return db_tree
+
+
+class FlatSQLWithPythonItems:
+    """
+    Start item and its descendants are fetched as flat rows
+    and tree is built in one pass, so Postgres doesn't spend time building JSON.
+    Prices of categories come from stored aggregates, see items.total_price.
+    """
+
+    def __init__(self, start_item_id: str):
+        self.start_item_id = start_item_id
+
+    @staticmethod
+    def _get_node(row: DbItemsTreeRow) -> ItemsOut:
+        """
+        category gets empty list of children
+        """
+        (
+            item_id,
+            parent_id,
+            item_type,
+            price,
+            name,
+            date,
+            total_price,
+            total_offer_count,
+            _,
+        ) = row
+        node: ItemsOut = {
+            "id": item_id,
+            "name": name,
+            "type": item_type,
+            "parentId": parent_id,
+            "date": date.isoformat().replace("+00:00", ".000Z"),
+            "price": price,
+            "children": None,
+        }
+        if item_type == ItemType.category.value:
+            node["children"] = []
+            node["price"] = (
+                total_price // total_offer_count if total_offer_count else None
+            )
+        return node
+
+    @classmethod
+    def _build_nodes(cls, rows: list[DbItemsTreeRow]) -> dict[str, ItemsOut]:
+        """
+        rows are ordered by path, so parent of every item is already built
+        """
+        nodes_by_id: dict[str, ItemsOut] = {}
+        for row in rows:
+            node = cls._get_node(row)
+            nodes_by_id[node["id"]] = node
+
+            # parent of start item is not fetched
+            parent_id = node["parentId"]
+            parent = nodes_by_id.get(parent_id) if parent_id is not None else None
+            if parent is not None:
+                parent["children"].append(node)  # type: ignore
+
+        return nodes_by_id
+
+    @classmethod
+    def _build_tree(cls, rows: list[DbItemsTreeRow]) -> ItemsOut:
+        return cls._build_nodes(rows)[rows[0][0]]
+
+    async def get(self) -> ItemsOut:
+        rows = await get_items_tree_rows(self.start_item_id)
+        if not rows:
+            raise NodeNotFound(node_id=self.start_item_id)
+
+        return await run_cpu_bound(
+            self._build_tree,
+            rows,
+            size=len(rows),
+            min_size=get_app_settings().cpu_executor_min_tree_items,
+        )
+
+
+class BatchFlatSQLWithPythonItems:
+    """
+    Trees of several items read by one query and built like FlatSQLWithPythonItems.
+    Items inside subtrees of other requested items are read and built once,
+    their trees are shared.
+    """
+
+    def __init__(self, item_ids: list[str]):
+        self.item_ids = item_ids
+
+    @classmethod
+    def _build_trees(
+        cls, rows: list[DbItemsTreeRow], item_ids: list[str]
+    ) -> dict[str, Optional[ItemsOut]]:
+        nodes_by_id = FlatSQLWithPythonItems._build_nodes(rows)
+        return {item_id: nodes_by_id.get(item_id) for item_id in item_ids}
+
+    async def get(self) -> dict[str, Optional[ItemsOut]]:
+        """
+        missing items get None
+        """
+        rows = await get_items_trees_rows(self.item_ids)
+        return await run_cpu_bound(
+            self._build_trees,
+            rows,
+            self.item_ids,
+            size=len(rows),
+            min_size=get_app_settings().cpu_executor_min_tree_items,
+        )
+
+
+class PagedSQLItems:
+    """
+    Start item and its descendants down to depth levels below it, every category
+    has at most limit children ordered by id, children of start item go after cursor.
+    Tree is read level by level by query which reads only returned rows,
+    see get_children_tree_rows. Category with more children gets childrenCursor
+    to read the next page of them, categories of the last level get null children.
+    Prices come from stored aggregates, so they don't depend on returned part of tree.
+    """
+
+    def __init__(
+        self,
+        start_item_id: str,
+        depth: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ):
+        self.start_item_id = start_item_id
+        self.depth = depth
+        self.limit = limit
+        self.cursor = cursor
+
+    async def get(self) -> PagedItemsOut:
+        # all levels are read from the same snapshot
+        async with get_database().transaction(isolation="repeatable_read", readonly=True):
+            start_row = await get_item_tree_row(self.start_item_id)
+            if start_row is None:
+                raise NodeNotFound(node_id=self.start_item_id)
+            start_node = cast(PagedItemsOut, FlatSQLWithPythonItems._get_node(start_row))
+
+            level = [start_node] if start_node["children"] is not None else []
+            level_number = 0
+            while level and (self.depth is None or level_number < self.depth):
+                nodes_by_id = {node["id"]: node for node in level}
+                # extra child shows that there is the next page
+                rows = await get_children_tree_rows(
+                    list(nodes_by_id),
+                    limit=self.limit + 1 if self.limit is not None else None,
+                    after_id=self.cursor if level_number == 0 else None,
+                )
+                level = []
+                for row in rows:
+                    node = cast(PagedItemsOut, FlatSQLWithPythonItems._get_node(row))
+                    parent = nodes_by_id[node["parentId"]]  # type: ignore
+                    children = parent["children"]
+                    assert children is not None
+                    if len(children) == self.limit:
+                        parent["childrenCursor"] = children[-1]["id"]
+                        continue
+                    children.append(node)
+                    if node["children"] is not None:
+                        level.append(node)
+                level_number += 1
+
+        for node in level:
+            node["children"] = None
+        return start_node
+
+
+class ItemsChanges:
+    """
+    Start item and its descendants with date later than since ordered by (date, path)
+    by pages of limit items, with their ancestors inside subtree and current prices.
+    Cursor of page is (date, path) of its last item, the next page goes after it.
+    Items are read by index on (date, path), so cost depends on number of changes
+    rather than on size of subtree, see get_changed_items_tree_rows.
+    """
+
+    def __init__(
+        self,
+        start_item_id: str,
+        since: datetime,
+        limit: int,
+        cursor: Optional[str] = None,
+    ):
+        self.start_item_id = start_item_id
+        self.since = since
+        self.limit = limit
+        self.cursor = cursor
+
+    @staticmethod
+    def _encode_cursor(date: datetime, path: str) -> str:
+        return base64.urlsafe_b64encode(
+            json.dumps([date.isoformat(), path]).encode()
+        ).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+        try:
+            date, path = json.loads(base64.urlsafe_b64decode(cursor))
+            return datetime.fromisoformat(date), str(path)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor}")
+
+    @staticmethod
+    def _get_flat_node(row: DbItemsTreeRow) -> ItemsOut:
+        node = FlatSQLWithPythonItems._get_node(row)
+        node["children"] = None
+        return node
+
+    async def get(self) -> ItemsChangesOut:
+        after = self._decode_cursor(self.cursor) if self.cursor is not None else None
+        # changed items and ancestors are read from the same snapshot
+        async with get_database().transaction(isolation="repeatable_read", readonly=True):
+            if not await check_if_item_exists(self.start_item_id):
+                raise NodeNotFound(node_id=self.start_item_id)
+
+            # extra item shows that there is the next page
+            rows = await get_changed_items_tree_rows(
+                self.start_item_id, since=self.since, limit=self.limit + 1, after=after
+            )
+            has_next_page = len(rows) > self.limit
+            rows = rows[: self.limit]
+
+            changed_ids = {row[0] for row, _ in rows}
+            ancestor_ids: set[str] = set()
+            for _, path in rows:
+                path_ids = path.split(PATH_SEPARATOR)
+                ancestor_ids.update(path_ids[path_ids.index(self.start_item_id) : -1])
+            ancestor_ids.difference_update(changed_ids)
+            ancestor_rows = (
+                await get_items_tree_rows_by_ids(list(ancestor_ids))
+                if ancestor_ids
+                else []
+            )
+
+        next_cursor = None
+        if has_next_page:
+            last_row, last_path = rows[-1]
+            next_cursor = self._encode_cursor(last_row[5], last_path)
+        return {
+            "items": [self._get_flat_node(row) for row, _ in rows],
+            "ancestors": [self._get_flat_node(row) for row in ancestor_rows],
+            "nextCursor": next_cursor,
+        }
+
+
+class StreamedSQLItems:
+    """
+    Rows of start item and its descendants are read by cursor in order of path,
+    which is depth-first order, and tree is written as JSON while they are read.
+    Neither rows nor nodes of the whole tree are kept in memory,
+    written JSON is sent in chunks. Output is the same as of FlatSQLWithPythonItems.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, start_item_id: str):
+        self.start_item_id = start_item_id
+
+    @staticmethod
+    def _dumps(node: ItemsOut) -> str:
+        # the same format as JSONResponse
+        return json.dumps(
+            node, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        )
+
+    async def _iter_chunks(
+        self, row: DbItemsTreeRow, rows: AsyncGenerator[DbItemsTreeRow, None]
+    ) -> AsyncIterator[bytes]:
+        # categories whose children are being written, the innermost is the last
+        open_ids: list[str] = []
+        needs_comma = False
+        parts: list[str] = []
+        size = 0
+        try:
+            while True:
+                node = FlatSQLWithPythonItems._get_node(row)
+                while open_ids and open_ids[-1] != node["parentId"]:
+                    open_ids.pop()
+                    parts.append("]}")
+                    needs_comma = True
+                if needs_comma:
+                    parts.append(",")
+
+                if node["children"] is None:
+                    part = self._dumps(node)
+                    needs_comma = True
+                else:
+                    # children are written after "children": of node
+                    node["children"] = None
+                    part = self._dumps(node)[: -len("null}")] + "["
+                    open_ids.append(node["id"])
+                    needs_comma = False
+                parts.append(part)
+                size += len(part)
+
+                if size >= self.chunk_size:
+                    yield "".join(parts).encode()
+                    parts.clear()
+                    size = 0
+                try:
+                    row = await rows.__anext__()
+                except StopAsyncIteration:
+                    break
+        finally:
+            # connection is released also when client is gone
+            await rows.aclose()
+
+        parts.append("]}" * len(open_ids))
+        yield "".join(parts).encode()
+
+    async def get(self) -> AsyncIterator[bytes]:
+        """
+        start item is read before response is started, so NodeNotFound can be raised
+        """
+        rows = iterate_items_tree_rows(self.start_item_id)
+        try:
+            start_row = await rows.__anext__()
+        except StopAsyncIteration:
+            raise NodeNotFound(node_id=self.start_item_id)
+        return self._iter_chunks(start_row, rows)
 
 
 class ImportItemsManager:
-    def __init__(self, items_to_import: list[ImportItem], update_date: datetime):
+    def __init__(
+        self,
+        items_to_import: list[ImportItem],
+        update_date: datetime,
+    ):
         self.items_to_import = items_to_import
         self.update_date = update_date
         self._all_import_items_by_id: Optional[dict[str, ImportItem]] = None
-        self._ids_already_in_db: Optional[list[str]] = None
-
-    async def __prepare_data(self) -> None:
-        self._all_import_items_by_id = {}
-        all_ids = set()
-        for item in self.items_to_import:
-            self._all_import_items_by_id[str(item.id)] = item
-            if item.parentId:
-                _all_ids = {str(item.id), str(item.parentId)}
-            else:
-                _all_ids = {str(item.id)}
-            all_ids.update(_all_ids)
-        self._ids_already_in_db = await filter_ids_in_db(all_ids)
-
-    def _get_item_to_upload(self, item: ImportItem) -> ImportItemToDb:
-        item_dict = item.dict()
-        res: ImportItemToDb = ImportItemToDb(  # type:ignore
-            date=self.update_date, parent_id=item_dict.pop("parentId"), **item_dict
+        self._items_in_db: Optional[dict[str, DbItem]] = None
+        self._paths_in_db: Optional[dict[str, str]] = None
+        self._new_paths: Optional[dict[str, str]] = None
+
+    def __prepare_data(self, items_in_db: dict[str, DbItem]) -> None:
+        """
+        items_in_db are import items and their parents fetched by AsyncChecks
+        """
+        self._all_import_items_by_id = {
+            str(item.id): item for item in self.items_to_import
+        }
+        self._items_in_db = items_in_db
+        self._paths_in_db = {
+            item_id: item.path for item_id, item in self._items_in_db.items()
+        }
+        self._new_paths = self._get_new_paths()
+
+    def _get_new_paths(self) -> dict[str, str]:
+        """
+        returns materialized paths of import items and their parents
+        as they will be after import, see items.path
+
+        Path of import item depends on path of its parent.
+        Path of item from database depends on path of its deepest ancestor
+        from import: if ancestor is moved, the item is moved with it.
+        """
+        assert self._all_import_items_by_id is not None
+        assert self._paths_in_db is not None
+
+        def get_dependency(item_id: str) -> Tuple[Optional[str], str]:
+            # (item whose path is prefix, rest of the path)
+            assert self._all_import_items_by_id is not None
+            assert self._paths_in_db is not None
+
+            if import_item := self._all_import_items_by_id.get(item_id):
+                if import_item.parentId is None:
+                    return None, item_id
+                return str(import_item.parentId), item_id
+
+            path_ids = self._paths_in_db[item_id].split(PATH_SEPARATOR)
+            for i in range(len(path_ids) - 2, -1, -1):
+                if path_ids[i] in self._all_import_items_by_id:
+                    return path_ids[i], PATH_SEPARATOR.join(path_ids[i + 1 :])
+            return None, self._paths_in_db[item_id]
+
+        new_paths: dict[str, str] = {}
+        ids_in_progress: set[str] = set()
+        for item_id in self._all_import_items_by_id:
+            stack = [item_id]
+            while stack:
+                curr_id = stack[-1]
+                if curr_id in new_paths:
+                    stack.pop()
+                    continue
+
+                dependency_id, rest_path = get_dependency(curr_id)
+                if dependency_id is None:
+                    new_paths[curr_id] = rest_path
+                elif dependency_id in new_paths:
+                    new_paths[curr_id] = PATH_SEPARATOR.join(
+                        [new_paths[dependency_id], rest_path]
+                    )
+                elif dependency_id in ids_in_progress:
+                    detail = f"Import makes cycle in items tree with {curr_id}"
+                    raise HTTPException(status_code=400, detail=detail)
+                else:
+                    ids_in_progress.add(curr_id)
+                    stack.append(dependency_id)
+                    continue
+
+                ids_in_progress.discard(curr_id)
+                stack.pop()
+
+        return new_paths
+
+    async def _check_depth(self, moved_paths: list[Tuple[str, str]]) -> None:
+        """
+        Rejects import which makes items deeper than MAX_PATH_DEPTH,
+        moved items take their descendants from database with them
+        """
+        assert self._new_paths is not None
+
+        for item_id, path in self._new_paths.items():
+            if path.count(PATH_SEPARATOR) >= MAX_PATH_DEPTH:
+                raise TreeTooDeep(max_depth=MAX_PATH_DEPTH, item_id=item_id)
+        for old_path, new_path in moved_paths:
+            if len(new_path) <= len(old_path):
+                continue
+            deepest_path = await get_deepest_descendant_path(old_path)
+            if deepest_path is None:
+                continue
+            depth = new_path.count(PATH_SEPARATOR) + deepest_path[len(old_path) :].count(
+                PATH_SEPARATOR
+            )
+            if depth >= MAX_PATH_DEPTH:
+                item_id = deepest_path.rsplit(PATH_SEPARATOR, 1)[-1]
+                raise TreeTooDeep(max_depth=MAX_PATH_DEPTH, item_id=item_id)
+
+    def _get_item_to_upload(self, item_id: str, item: ImportItem) -> ImportItemToDb:
+        assert self._new_paths is not None
+
+        is_offer = item.type == ItemType.offer.value
+        return ImportItemToDb(
+            id=item_id,
+            name=item.name,
+            type=item.type.value,
+            parent_id=str(item.parentId) if item.parentId else None,
+            price=item.price,
+            date=self.update_date,
+            path=self._new_paths[item_id],
+            total_price=item.price if is_offer and item.price else 0,
+            total_offer_count=1 if is_offer else 0,
         )
-        return res
 
-    def _get_stat_item_to_upload(self, item: ImportItem) -> ImportStatsItemToDb:
-        item_dict = item.dict()
-        res: ImportStatsItemToDb = ImportStatsItemToDb(  # type:ignore
+    @classmethod
+    def _get_stat_item_to_upload(cls, item: ImportItemToDb) -> ImportStatsItemToDb:
+        assert item["price"] is not None
+
+        return ImportStatsItemToDb(
             stat_id=str(uuid.uuid4()),
-            date=self.update_date,
-            parent_id=item_dict.pop("parentId"),
-            **item_dict,
+            id=item["id"],
+            name=item["name"],
+            price=item["price"],
+            parent_id=item["parent_id"],
+            type=item["type"],
+            date=item["date"],
         )
-        return res
 
-    async def _get_items_to_upload(
+    def _get_all_parent_ids_of_offers(self, written_ids: set[str]) -> list[str]:
+        """
+        returns ancestors of written import offers without extra queries:
+        they are taken from materialized paths of offers after import
+        (so ancestors created by this import are included)
+        and before import, if offer is moved to another category.
+        Written import items are skipped, they get new date anyway.
+        """
+        assert self._all_import_items_by_id is not None
+        assert self._paths_in_db is not None
+        assert self._new_paths is not None
+
+        parent_ids: set[str] = set()
+        for item_id, item in self._all_import_items_by_id.items():
+            if item.type != ItemType.offer.value or item_id not in written_ids:
+                continue
+
+            parent_ids.update(self._new_paths[item_id].split(PATH_SEPARATOR)[:-1])
+            if old_path := self._paths_in_db.get(item_id):
+                parent_ids.update(old_path.split(PATH_SEPARATOR)[:-1])
+
+        parent_ids.difference_update(written_ids)
+        return list(parent_ids)
+
+    def _get_aggregates_deltas(self) -> dict[str, Tuple[int, int]]:
+        """
+        returns changes of total_price and total_offer_count of categories
+        made by import, so stored aggregates are updated incrementally
+        instead of summing up all children again.
+
+        Import offer takes its old price out of ancestors by old path
+        and adds new price to ancestors by new path. Import category does the same
+        with the part of its subtree which is not imported: its stored totals
+        without totals of the closest import items under it.
+        """
+        assert self._all_import_items_by_id is not None
+        assert self._items_in_db is not None
+        assert self._new_paths is not None
+
+        deltas: defaultdict[str, Tuple[int, int]] = defaultdict(lambda: (0, 0))
+
+        def add_to_ancestors(path: str, total_price: int, total_offer_count: int) -> None:
+            for ancestor_id in path.split(PATH_SEPARATOR)[:-1]:
+                price, offer_count = deltas[ancestor_id]
+                deltas[ancestor_id] = (
+                    price + total_price,
+                    offer_count + total_offer_count,
+                )
+
+        not_imported_totals: dict[str, Tuple[int, int]] = {}
+        for item_id, item in self._all_import_items_by_id.items():
+            if item.type == ItemType.category.value:
+                db_item = self._items_in_db.get(item_id)
+                not_imported_totals[item_id] = (
+                    (db_item.total_price, db_item.total_offer_count)
+                    if db_item
+                    else (0, 0)
+                )
+
+        for item_id in self._all_import_items_by_id:
+            if (db_item := self._items_in_db.get(item_id)) is None:
+                continue
+            for ancestor_id in reversed(db_item.path.split(PATH_SEPARATOR)[:-1]):
+                if ancestor_id in not_imported_totals:
+                    price, offer_count = not_imported_totals[ancestor_id]
+                    not_imported_totals[ancestor_id] = (
+                        price - db_item.total_price,
+                        offer_count - db_item.total_offer_count,
+                    )
+                    break
+
+        for item_id, item in self._all_import_items_by_id.items():
+            db_item = self._items_in_db.get(item_id)
+            if item.type == ItemType.offer.value:
+                assert item.price is not None
+                if db_item:
+                    add_to_ancestors(
+                        db_item.path, -db_item.total_price, -db_item.total_offer_count
+                    )
+                add_to_ancestors(self._new_paths[item_id], item.price, 1)
+            else:
+                price, offer_count = not_imported_totals[item_id]
+                if db_item:
+                    add_to_ancestors(db_item.path, -price, -offer_count)
+                add_to_ancestors(self._new_paths[item_id], price, offer_count)
+
+        return dict(deltas)
+
+    def _get_items_to_upload(
         self,
-    ) -> Tuple[list[ImportItemToDb], list[ImportStatsItemToDb], list[str]]:
+    ) -> Tuple[list[ImportItemToDb], list[ImportStatsItemToDb]]:
         """
-        returns data_to_upload -- list of dictionaries
+        returns items in order which is safe for parent_id foreign key
+        and offers to save to statistic table
 
-        Go through all import items
-        If parent not in database, but in list of imports,
-           then upload parent and then initial item
-        elif in database, then
+        Parent is always closer to the root than its children,
+        so items are grouped by depth of their new materialized paths
+        and uploaded from the top level to the bottom.
+        Batch of any depth is ordered in O(n), cycles are already
+        rejected while paths are built, see _get_new_paths.
         """
-        assert self._ids_already_in_db is not None
         assert self._all_import_items_by_id is not None
+        assert self._new_paths is not None
 
-        data_to_upload: list[ImportItemToDb] = []
+        items_by_depth: defaultdict[int, list[ImportItemToDb]] = defaultdict(list)
         stats_data_to_upload: list[ImportStatsItemToDb] = []
-        all_parent_ids_of_offers: list[str] = []
-        ids_uploaded: list[str] = []
-        for import_item in self.items_to_import:
-            item_id = str(import_item.id)
-            if item_id in ids_uploaded:
-                continue
+        for item_id, import_item in self._all_import_items_by_id.items():
+            item_to_upload = self._get_item_to_upload(item_id, import_item)
+            depth = self._new_paths[item_id].count(PATH_SEPARATOR)
+            items_by_depth[depth].append(item_to_upload)
 
             if import_item.type == ItemType.offer.value:
                 # save to statistic table
-                all_parent_ids_of_offers.extend(
-                    await get_all_parent_ids_by_item_id(item_id)
+                stats_data_to_upload.append(self._get_stat_item_to_upload(item_to_upload))
+
+        data_to_upload = [
+            item for depth in sorted(items_by_depth) for item in items_by_depth[depth]
+        ]
+        return data_to_upload, stats_data_to_upload
+
+    def _get_changed_ids(self, written_ids: set[str]) -> set[str]:
+        """
+        written items and their ancestors before and after import
+        """
+        assert self._paths_in_db is not None
+        assert self._new_paths is not None
+
+        changed_ids: set[str] = set()
+        for item_id in written_ids:
+            changed_ids.update(self._new_paths[item_id].split(PATH_SEPARATOR))
+            if (old_path := self._paths_in_db.get(item_id)) is not None:
+                changed_ids.update(old_path.split(PATH_SEPARATOR))
+        return changed_ids
+
+    async def import_to_db(self) -> ImportOut:
+        """
+        With skip_unchanged_items setting items equal to stored ones
+        are not written: they keep their dates, are not saved to statistic
+        and don't update dates of their ancestors.
+        """
+        settings = get_app_settings()
+        async with writing_items():
+            async with database.transaction():
+                # everything is read after lock is taken, so paths computed from
+                # the tree can't be outdated by concurrent import when they're saved
+                await lock_items_tree()
+
+                async_checks = AsyncChecks(items=self.items_to_import)
+                await async_checks.check()
+                assert async_checks.items_in_db is not None
+
+                self.__prepare_data(items_in_db=async_checks.items_in_db)
+
+                items_to_upload, stats_items_to_upload = self._get_items_to_upload()
+                aggregates_deltas = self._get_aggregates_deltas()
+                assert self._all_import_items_by_id is not None
+                assert self._paths_in_db is not None
+                assert self._new_paths is not None
+
+                moved_paths: list[Tuple[str, str]] = []
+                for item_id in self._all_import_items_by_id:
+                    old_path = self._paths_in_db.get(item_id)
+                    if old_path is not None and old_path != self._new_paths[item_id]:
+                        moved_paths.append((old_path, self._new_paths[item_id]))
+
+                # the deepest items are moved first, so their descendants
+                # are not moved twice by their moved ancestors
+                moved_paths.sort(key=lambda paths: len(paths[0]), reverse=True)
+                await self._check_depth(moved_paths)
+
+                is_bulk = len(items_to_upload) >= settings.bulk_import_min_items
+                if is_bulk:
+                    written = await bulk_upsert_items(
+                        items=items_to_upload, only_changed=settings.skip_unchanged_items
+                    )
+                else:
+                    written = await upsert_items(
+                        items=items_to_upload, only_changed=settings.skip_unchanged_items
+                    )
+                written_ids = set(written)
+                stats_items_to_upload = [
+                    item for item in stats_items_to_upload if item["id"] in written_ids
+                ]
+                all_parent_ids_of_offers = self._get_all_parent_ids_of_offers(written_ids)
+
+                for old_path, new_path in moved_paths:
+                    await update_descendants_paths(old_path=old_path, new_path=new_path)
+                if is_bulk:
+                    await bulk_save_import_items_to_statistic(items=stats_items_to_upload)
+                else:
+                    await save_import_items_to_statistic(items=stats_items_to_upload)
+                await update_date(
+                    item_ids=all_parent_ids_of_offers, new_update_date=self.update_date
                 )
-                stats_data_to_upload.append(self._get_stat_item_to_upload(import_item))
-
-            if import_item.parentId is not None and (
-                parent_id := str(import_item.parentId)
-            ):
-                if parent_id in self._ids_already_in_db:
-                    data_to_upload.append(self._get_item_to_upload(import_item))
-                    ids_uploaded.append(item_id)
-                else:  # parent in batch of imports
-                    if (
-                        parent_id not in ids_uploaded
-                    ):  # if not added parent to data to upload yet
-                        parent_item = self._all_import_items_by_id[parent_id]
-                        data_to_upload.append(self._get_item_to_upload(parent_item))
-                        ids_uploaded.append(parent_id)
-                    data_to_upload.append(self._get_item_to_upload(import_item))
-                    ids_uploaded.append(item_id)
-            else:
-                data_to_upload.append(self._get_item_to_upload(import_item))
-                ids_uploaded.append(item_id)
+                await add_to_aggregates(aggregates_deltas)
+                changed_ids = self._get_changed_ids(written_ids)
+                await set_new_items_version(changed_ids)
+                nodes_cache.invalidate(changed_ids)
+                await notify_items_changed(changed_ids)
+
+        inserted = sum(written.values())
+        return ImportOut(
+            inserted=inserted,
+            updated=len(written) - inserted,
+            unchanged=len(items_to_upload) - len(written),
+        )
 
-        del ids_uploaded
-        return data_to_upload, stats_data_to_upload, all_parent_ids_of_offers
 
-    async def import_to_db(self) -> None:
-        async_checks = AsyncChecks(items=self.items_to_import)
-        await async_checks.check()
+class StreamImportItemsManager:
+    """
+    Import of NDJSON stream: items are parsed line by line
+    and committed by chunks, so the whole stream is never kept in memory.
 
-        await self.__prepare_data()
+    Every chunk goes through ImportItemsManager, so checks are made
+    against everything committed before. Items whose parents are neither
+    in the chunk nor in database are deferred to the next chunks,
+    but not more than chunk_size of them: parents are expected to go before
+    children, deferring is only for parents from the next few lines.
+    """
 
-        (
-            items_to_upload,
-            stats_items_to_upload,
-            all_parent_ids_of_offers,
-        ) = await self._get_items_to_upload()
-        async with database.transaction():
-            await upsert_items(items=items_to_upload)
-            await save_import_items_to_statistic(items=stats_items_to_upload)
-            await update_date(
-                item_ids=all_parent_ids_of_offers, new_update_date=self.update_date
+    def __init__(
+        self, lines: AsyncIterator[bytes], update_date: datetime, chunk_size: int
+    ):
+        self.lines = lines
+        self.update_date = update_date
+        self.chunk_size = chunk_size
+        self._deferred_items: list[ImportItem] = []
+        self._chunks: list[ImportChunkOut] = []
+
+    async def _iter_items(self) -> AsyncIterator[ImportItem]:
+        line_number = 0
+        try:
+            async for line in self.lines:
+                line_number += 1
+                if not line.strip():
+                    continue
+                try:
+                    yield ImportItem.parse_raw(line)
+                except ValueError as e:
+                    detail = f"Invalid item on line {line_number}: {e}"
+                    raise HTTPException(status_code=400, detail=detail)
+        except LineTooLong as e:
+            raise HTTPException(
+                status_code=400, detail=f"{e.detail}, line {line_number + 1}"
+            )
+
+    async def _get_deferred_ids(self, items_by_id: dict[str, ImportItem]) -> set[str]:
+        """
+        returns ids of items with unknown parents and all their descendants
+        """
+        children_ids_by_parent_id: defaultdict[str, list[str]] = defaultdict(list)
+        parent_ids_not_in_chunk: set[str] = set()
+        for item_id, item in items_by_id.items():
+            if item.parentId is None:
+                continue
+            parent_id = str(item.parentId)
+            children_ids_by_parent_id[parent_id].append(item_id)
+            if parent_id not in items_by_id:
+                parent_ids_not_in_chunk.add(parent_id)
+
+        if not parent_ids_not_in_chunk:
+            return set()
+
+        unknown_parent_ids = parent_ids_not_in_chunk.difference(
+            await filter_ids_in_db(parent_ids_not_in_chunk)
+        )
+        stack = [
+            child_id
+            for parent_id in unknown_parent_ids
+            for child_id in children_ids_by_parent_id[parent_id]
+        ]
+        deferred_ids = set(stack)
+        while stack:
+            for child_id in children_ids_by_parent_id[stack.pop()]:
+                if child_id not in deferred_ids:
+                    deferred_ids.add(child_id)
+                    stack.append(child_id)
+        return deferred_ids
+
+    async def _import_chunk(self, items: list[ImportItem]) -> None:
+        items_by_id = {str(item.id): item for item in items}
+        if len(items_by_id) != len(items):
+            detail = f"All ids must be unique, chunk {len(self._chunks) + 1}"
+            raise HTTPException(status_code=400, detail=detail)
+
+        deferred_ids = await self._get_deferred_ids(items_by_id)
+        if len(deferred_ids) > self.chunk_size:
+            detail = (
+                f"More than {self.chunk_size} items wait for their parents, "
+                "parents must go before their children"
             )
+            raise HTTPException(status_code=400, detail=detail)
+        self._deferred_items = [items_by_id[item_id] for item_id in deferred_ids]
+        items_to_import = [
+            item for item_id, item in items_by_id.items() if item_id not in deferred_ids
+        ]
+        if items_to_import:
+            # checks of the whole request are made in ImportItemsIn validators
+            validated = ImportItemsIn(items=items_to_import, updateDate=self.update_date)
+            try:
+                await ImportItemsManager(
+                    items_to_import=validated.items, update_date=validated.updateDate
+                ).import_to_db()
+            except HTTPException as e:
+                detail = f"Chunk {len(self._chunks) + 1} is not imported: {e.detail}"
+                raise HTTPException(status_code=e.status_code, detail=detail)
 
+        chunk = ImportChunkOut(
+            chunk=len(self._chunks) + 1,
+            imported=len(items_to_import),
+            deferred=len(deferred_ids),
+        )
+        self._chunks.append(chunk)
+        logger.info(f"Stream import: {chunk}")
+
+    def _get_progress(self) -> StreamImportOut:
+        return StreamImportOut(
+            imported=sum(chunk.imported for chunk in self._chunks), chunks=self._chunks
+        )
+
+    async def import_to_db(self) -> StreamImportOut:
+        """
+        Chunks committed before error are kept,
+        so error detail tells what is already imported.
+        """
+        try:
+            await self._import_chunks()
+        except HTTPException as e:
+            detail = {"message": e.detail, **self._get_progress().dict()}
+            raise HTTPException(status_code=e.status_code, detail=detail)
+        return self._get_progress()
 
-# class RecursiveSQLWithPythonItems:
-#     def __init__(self, item_id: str):
-#         self.item_id: str = item_id
-#         self.prices_or_child_cats_by_item_id: dict[
-#             str, list[Union[int, str]]
-#         ] = defaultdict(list)
-#
-#     def _get_recursive_items_for_item(self, item: Item):
-#         if item.type == "OFFER":
-#             self.prices_or_child_cats_by_item_id[str(item.parent_id)].append(
-#                 item.price)
-#             return serialize_offer(item)
-#
-#         if item.parent_id:
-#             self.prices_or_child_cats_by_item_id[str(item.parent_id)].append(
-#                 str(item.id))
-#
-#         item_children: QuerySet[Item]
-#         if not (item_children := item.children.all()):
-#             return serialize_category(item)
-#
-#         if item_children[0].type == "OFFER":
-#             children = []
-#             for child_cat in item_children:
-#                 self.prices_or_child_cats_by_item_id[str(item.id)].append(
-#                     child_cat.price)
-#                 children.append(serialize_offer(child_cat))
-#         else:
-#             children = []
-#             for child_cat in item_children:
-#                 self.prices_or_child_cats_by_item_id[str(item.id)].append(
-#                     str(child_cat.id)
-#                 )
-#                 children.append(
-#                     serialize_category(
-#                         category=child_cat,
-#                         children=[
-#                             self._get_recursive_items_for_item(
-#                                 child_child,
-#                             )
-#                             for child_child in child_cat.children.all()
-#                         ],
-#                     )
-#                 )
-#         return serialize_category(category=item, children=children)
-#
-#     def get(self):
-#         if not (item := Item.objects.filter(id=self.item_id).first()):
-#             return None
-#
-#         if item.type == "OFFER":
-#             return serialize_offer(offer=item)
-#
-#         return self._get_recursive_items_for_item(item)
+    async def _import_chunks(self) -> None:
+        items: list[ImportItem] = []
+        async for item in self._iter_items():
+            items.append(item)
+            if len(items) >= self.chunk_size:
+                await self._import_chunk(self._deferred_items + items)
+                items = []
+
+        if items or self._deferred_items:
+            await self._import_chunk(self._deferred_items + items)
+
+        if self._deferred_items:
+            ids = "\n".join(str(item.id) for item in self._deferred_items)
+            detail = f"Not all parents exist for items:\n{ids}"
+            raise HTTPException(status_code=400, detail=detail)
+
+
+class ImportJobsManager:
+    """
+    Import jobs are applied one by one in order of submission by background workers
+    holding lock of items tree, see ImportJobsWorkers. Synchronous imports and deletes
+    wait till jobs queued before them are applied, see wait_for_queued_import_jobs,
+    so any write keeps the order in which it was sent.
+    """
+
+    @classmethod
+    async def _apply(cls, job: DbImportJob) -> None:
+        try:
+            await start_import_job(job.id)
+            validated = await run_cpu_bound(
+                ImportItemsIn.parse_obj,
+                job.payload,
+                size=len(job.payload["items"]),
+                min_size=get_app_settings().cpu_executor_min_import_items,
+            )
+            # job is marked as done in the same transaction with import,
+            # so it's never applied twice
+            async with writing_items():
+                async with database.transaction():
+                    await ImportItemsManager(
+                        items_to_import=validated.items,
+                        update_date=validated.updateDate,
+                    ).import_to_db()
+                    await finish_import_job(job.id, status=ImportJobStatus.done)
+        except HTTPException as e:
+            await finish_import_job(job.id, status=ImportJobStatus.failed, error=e.detail)
+        except Exception as e:
+            logger.exception(f"Import job {job.id} failed")
+            await finish_import_job(job.id, status=ImportJobStatus.failed, error=str(e))
+        logger.info(f"Import job {job.id} is finished")
+
+    @classmethod
+    async def apply_next(cls) -> bool:
+        """
+        Must be called with lock of items tree, see lock_items_tree;
+        returns whether there was a job to apply
+        """
+        job = await get_next_import_job()
+        if job is None:
+            return False
+        await cls._apply(job)
+        return True
@@ -0,0 +1,140 @@
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Optional
+
+from app.api.items.handlers import ImportJobsManager
+from app.core.config import get_app_settings
+from app.db.base import database
+from app.errors import ImportJobsNotApplied
+from app.models.import_jobs.queries import get_unfinished_import_jobs_ids
+from app.models.items.queries import ITEMS_TREE_LOCK_KEY
+
+logger = logging.getLogger(__name__)
+
+# set every time job is applied by worker of this process, see wait_for_queued_import_jobs
+_import_job_applied = asyncio.Event()
+
+
+class ImportJobsWorkers:
+    """
+    Pool of background tasks which apply queued imports.
+
+    Jobs are applied one by one in order of submission, see ImportJobsManager.
+    Every job is applied under lock of items tree taken for it alone, so only one job
+    is applied at a time whatever the pool size is, and synchronous writes waiting
+    for the queue get the lock between jobs.
+    """
+
+    def __init__(self, workers_count: int, poll_interval: float):
+        self._workers_count = workers_count
+        self._poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []  # type: ignore
+
+    def start(self) -> None:
+        # databases keeps current connection in context variable, tasks are started
+        # in empty context so every worker gets its own connection
+        self._tasks = [
+            contextvars.Context().run(
+                asyncio.create_task, self._run(), name=f"import-jobs-worker-{i}"
+            )
+            for i in range(self._workers_count)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """
+        wake up workers right after new job is submitted instead of waiting for poll
+        """
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Import jobs worker failed, retrying")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _drain(self) -> None:
+        while await self._apply_next():
+            _import_job_applied.set()
+            _import_job_applied.clear()
+
+    async def _apply_next(self) -> bool:
+        # lock is held by session, so the connection is kept till it's released
+        async with database.connection():
+            await database.execute(
+                "SELECT pg_advisory_lock(:key)", values={"key": ITEMS_TREE_LOCK_KEY}
+            )
+            try:
+                return await ImportJobsManager.apply_next()
+            finally:
+                await database.execute(
+                    "SELECT pg_advisory_unlock(:key)", values={"key": ITEMS_TREE_LOCK_KEY}
+                )
+
+
+import_jobs_workers: Optional[ImportJobsWorkers] = None
+
+
+async def import_jobs_workers_start(workers_count: int, poll_interval: float) -> None:
+    global import_jobs_workers
+    if workers_count <= 0:
+        return
+    import_jobs_workers = ImportJobsWorkers(
+        workers_count=workers_count, poll_interval=poll_interval
+    )
+    import_jobs_workers.start()
+
+
+def import_jobs_workers_notify() -> None:
+    if import_jobs_workers is not None:
+        import_jobs_workers.notify()
+
+
+async def import_jobs_workers_stop() -> None:
+    global import_jobs_workers
+    if import_jobs_workers is not None:
+        await import_jobs_workers.stop()
+        import_jobs_workers = None
+
+
+async def wait_for_queued_import_jobs() -> None:
+    """
+    Wait till jobs submitted before the call are applied by workers,
+    so synchronous write is applied after them; last queued job is the ticket,
+    jobs submitted later don't make it wait
+    """
+    settings = get_app_settings()
+    first_id, ticket = await get_unfinished_import_jobs_ids()
+    if ticket is None:
+        return
+    deadline = time.monotonic() + settings.import_jobs_wait_timeout
+    while first_id is not None and first_id <= ticket:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ImportJobsNotApplied(timeout=settings.import_jobs_wait_timeout)
+        import_jobs_workers_notify()
+        # jobs could be applied by workers of other processes, so the queue is polled
+        try:
+            await asyncio.wait_for(
+                _import_job_applied.wait(),
+                timeout=min(settings.import_jobs_poll_interval, remaining),
+            )
+        except asyncio.TimeoutError:
+            pass
+        first_id, _ = await get_unfinished_import_jobs_ids()
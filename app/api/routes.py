@@ -1,25 +1,73 @@
+import json
 from dataclasses import asdict
 from datetime import datetime
-from typing import cast
+from typing import Any, Optional, Union, cast
 from uuid import UUID
 
-from fastapi import APIRouter, Body, HTTPException, Query
-from starlette.responses import RedirectResponse
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from starlette.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 
 from app.api import descriptions
-from app.api.items.handlers import ImportItemsManager, RecursiveSQLOnlyItems
-from app.errors import InvalidUUID, NodeNotFound
-from app.models.items.queries import cascade_delete_item_by_id, check_if_item_exists
-from app.models.items_statistic.queries import get_offer_stats_for_n_hours_and_date
+from app.api.conditional import (
+    get_validators_headers,
+    is_not_modified,
+    not_modified_response,
+    pack_response,
+    unpack_response,
+)
+from app.api.items.catalog import get_items_catalog
+from app.api.items.handlers import (
+    BatchFlatSQLWithPythonItems,
+    FlatSQLWithPythonItems,
+    ImportItemsManager,
+    ItemsChanges,
+    PagedSQLItems,
+    RecursiveSQLOnlyItems,
+    StreamedSQLItems,
+    StreamImportItemsManager,
+)
+from app.api.items.jobs import import_jobs_workers_notify, wait_for_queued_import_jobs
+from app.core.cache import nodes_cache
+from app.core.changes import writing_items
+from app.core.config import get_app_settings
+from app.core.executor import run_cpu_bound
+from app.core.metrics import render_metrics
+from app.core.settings.api import NodesEngines
+from app.core.shared_cache import SALES_VERSION_KEY, get_shared_cache
+from app.db.base import database
+from app.db.pool import get_pools_stats, use_imports_connections
+from app.db.routing import can_cache_reads, pin_to_database, use_read_database
+from app.errors import ImportJobNotFound, InvalidUUID, NodeNotFound
+from app.models.import_jobs.queries import create_import_job, get_import_job
+from app.models.items.queries import (
+    cascade_delete_item_by_id,
+    check_if_item_exists,
+    get_item_version,
+    lock_items_tree,
+)
+from app.models.items_statistic.queries import (
+    get_offer_stats_for_n_hours_and_date,
+    get_offer_stats_version,
+)
 from app.schemas import (
+    CachesStats,
     DictExampleImportItem,
     ImportItem,
     ImportItemsIn,
+    ImportJobOut,
+    ImportOut,
+    PoolsStats,
     SaleStatsDateIn,
     StatsItems,
+    StreamImportOut,
 )
-from app.types import ItemsOut
-from app.utils import is_valid_uuid
+from app.types import ItemsOut, NodesBatchEntryOut
+from app.utils import is_valid_uuid, iter_lines
 
 api_router = APIRouter(tags=["Default items endpoints"])
 statistic_api_router = APIRouter(tags=["Additional endpoints with statistics"])
@@ -33,27 +81,185 @@ async def docs_redirect() -> RedirectResponse:
 @api_router.get(
     "/nodes/{id}",
     description=descriptions.get_nodes,
+    dependencies=[Depends(use_read_database)],
 )
 async def get_nodes_with_children_by_id(
+    request: Request,
     id: UUID = Query(
         ...,
         example="3fa85f64-5717-4562-b3fc-2c963f66a333",
         description="Идентификатор элемента",
     ),
-) -> ItemsOut:
+    depth: Optional[int] = Query(
+        None, ge=0, description="Сколько уровней дочерних элементов вернуть"
+    ),
+    limit: Optional[int] = Query(
+        None, ge=1, description="Сколько дочерних элементов вернуть у каждой категории"
+    ),
+    cursor: Optional[UUID] = Query(
+        None, description="childrenCursor элемента из предыдущего ответа"
+    ),
+) -> Response:
     str_id = str(id)
     if not is_valid_uuid(str_id):
         raise InvalidUUID(uuid=str_id)
 
-    recursive_nodes = RecursiveSQLOnlyItems(start_item_id=str_id)
+    is_paged = depth is not None or limit is not None or cursor is not None
+    if not is_paged and nodes_cache.is_enabled:
+        if (value := nodes_cache.get(str_id)) is not None:
+            headers, body = unpack_response(value)
+            if is_not_modified(request, headers):
+                return not_modified_response(headers)
+            return Response(content=body, media_type="application/json", headers=headers)
+    # taken before tree is read, so tree changed meanwhile is not cached
+    cache_generation = nodes_cache.generation
+
+    nodes_engine = get_app_settings().nodes_engine
+    items_catalog = get_items_catalog() if nodes_engine == NodesEngines.catalog else None
+    if not is_paged and items_catalog is not None:
+        item_version = items_catalog.get_version(str_id)
+        if item_version is None:
+            raise NodeNotFound(node_id=str_id)
+        headers = get_validators_headers(*item_version)
+        if is_not_modified(request, headers):
+            return not_modified_response(headers)
+        response = JSONResponse(items_catalog.get_tree(str_id), headers=headers)
+        # catalog is kept by every worker, so shared cache is not used
+        if nodes_cache.is_enabled:
+            nodes_cache.put(
+                str_id, pack_response(headers, response.body), generation=cache_generation
+            )
+        return response
+
+    shared_cache = get_shared_cache() if not is_paged else None
+    shared_key = f"nodes:{str_id}"
+    if shared_cache is not None:
+        value, shared_version = await shared_cache.get(shared_key)
+        if value is not None:
+            if nodes_cache.is_enabled:
+                nodes_cache.put(str_id, value, generation=cache_generation)
+            headers, body = unpack_response(value)
+            if is_not_modified(request, headers):
+                return not_modified_response(headers)
+            return Response(content=body, media_type="application/json", headers=headers)
+
+    # tree is read after version, so it's not older than its ETag
+    item_version = await get_item_version(str_id)
+    if item_version is None:
+        raise NodeNotFound(node_id=str_id)
+    headers = get_validators_headers(*item_version)
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+
+    if is_paged:
+        # only part of tree is read, it's not cached
+        paged_nodes = PagedSQLItems(
+            start_item_id=str_id,
+            depth=depth,
+            limit=limit,
+            cursor=str(cursor) if cursor is not None else None,
+        )
+        return JSONResponse(await paged_nodes.get(), headers=headers)
+
+    if nodes_engine == NodesEngines.stream:
+        # tree isn't kept in memory, so it's not cached
+        chunks = await StreamedSQLItems(start_item_id=str_id).get()
+        return StreamingResponse(chunks, media_type="application/json", headers=headers)
+
+    recursive_nodes: Union[RecursiveSQLOnlyItems, FlatSQLWithPythonItems]
+    if nodes_engine != NodesEngines.sql:
+        # also while catalog is not loaded
+        recursive_nodes = FlatSQLWithPythonItems(start_item_id=str_id)
+    else:
+        recursive_nodes = RecursiveSQLOnlyItems(start_item_id=str_id)
     nodes = await recursive_nodes.get()
 
-    return nodes
+    response = JSONResponse(nodes, headers=headers)
+    if not can_cache_reads():
+        return response
+    value = pack_response(headers, response.body)
+    if nodes_cache.is_enabled:
+        nodes_cache.put(str_id, value, generation=cache_generation)
+    if shared_cache is not None:
+        await shared_cache.put(shared_key, value, version=shared_version)
+    return response
+
+
+@api_router.get(
+    "/nodes/{id}/changes",
+    description=descriptions.get_nodes_changes,
+    dependencies=[Depends(use_read_database)],
+)
+async def get_nodes_changes(
+    id: UUID = Query(
+        ...,
+        example="3fa85f64-5717-4562-b3fc-2c963f66a333",
+        description="Идентификатор элемента",
+    ),
+    since: datetime = Query(
+        ...,
+        example="2022-02-01T12:00:00.000Z",
+        description="Вернуть элементы, обновленные позже этой даты",
+    ),
+    cursor: Optional[str] = Query(None, description="nextCursor из предыдущего ответа"),
+    limit: int = Query(1000, ge=1, le=10_000, description="Сколько элементов вернуть"),
+) -> JSONResponse:
+    str_id = str(id)
+    if not is_valid_uuid(str_id):
+        raise InvalidUUID(uuid=str_id)
+
+    items_changes = ItemsChanges(
+        start_item_id=str_id, since=since, limit=limit, cursor=cursor
+    )
+    return JSONResponse(await items_changes.get())
+
+
+@api_router.post(
+    "/nodes",
+    description=descriptions.get_nodes_batch,
+    dependencies=[Depends(use_read_database)],
+)
+async def get_nodes_batch(
+    ids: list[UUID] = Body(
+        ...,
+        embed=True,
+        example=["3fa85f64-5717-4562-b3fc-2c963f66a333"],
+        description="Идентификаторы элементов",
+    ),
+) -> JSONResponse:
+    settings = get_app_settings()
+    if len(ids) > settings.nodes_batch_max_ids:
+        raise HTTPException(
+            status_code=400,
+            detail=f"No more than {settings.nodes_batch_max_ids} ids are allowed",
+        )
+    # repeated ids get one entry
+    str_ids = list(dict.fromkeys(str(item_id) for item_id in ids))
+
+    nodes_by_id: dict[str, Optional[ItemsOut]]
+    items_catalog = (
+        get_items_catalog() if settings.nodes_engine == NodesEngines.catalog else None
+    )
+    if items_catalog is not None:
+        nodes_by_id = {item_id: items_catalog.get_tree(item_id) for item_id in str_ids}
+    else:
+        nodes_by_id = await BatchFlatSQLWithPythonItems(item_ids=str_ids).get()
+
+    entries: list[NodesBatchEntryOut] = [
+        {
+            "id": item_id,
+            "node": node,
+            "error": NodeNotFound(node_id=item_id).detail if node is None else None,
+        }
+        for item_id, node in nodes_by_id.items()
+    ]
+    return JSONResponse({"items": entries})
 
 
 @api_router.delete(
     "/delete/{id}",
     description=descriptions.delete_node,
+    dependencies=[Depends(pin_to_database)],
 )
 async def delete_item_by_id(
     id: UUID = Query(
@@ -67,24 +273,47 @@ async def delete_item_by_id(
     if not is_valid_uuid(str_id):
         raise InvalidUUID(uuid=str_id)
 
-    if not await check_if_item_exists(str_id):
-        raise NodeNotFound(node_id=str_id)
+    # item could be created by import queued before
+    await wait_for_queued_import_jobs()
+    async with writing_items():
+        async with database.transaction():
+            await lock_items_tree()
+            if not await check_if_item_exists(str_id):
+                raise NodeNotFound(node_id=str_id)
 
-    await cascade_delete_item_by_id(str_id)
+            await cascade_delete_item_by_id(str_id)
+
+
+def _validate_import_items(
+    items: list[DictExampleImportItem], update_date: datetime
+) -> ImportItemsIn:
+    return ImportItemsIn(
+        items=[ImportItem(**asdict(item)) for item in items],
+        updateDate=update_date,
+    )
+
+
+def _get_import_job_payload(validated: ImportItemsIn) -> dict[str, Any]:
+    payload: dict[str, Any] = json.loads(validated.json())
+    return payload
 
 
 @api_router.post(
     "/imports",
-    description=descriptions.imports,
+    description=descriptions.imports + descriptions.imports_async,
+    dependencies=[Depends(pin_to_database), Depends(use_imports_connections)],
 )
 async def import_items(
+    response: Response,
     updateDate: datetime = Body(...),
     items: list[DictExampleImportItem] = Body(...),
-) -> None:
+    asyncMode: bool = Query(False, alias="async", description="Поставить в очередь"),
+) -> Union[ImportOut, ImportJobOut]:
+    # big imports are validated in executor, see run_cpu_bound
+    min_size = get_app_settings().cpu_executor_min_import_items
     try:
-        validated = ImportItemsIn(
-            items=[ImportItem(**asdict(item)) for item in items],
-            updateDate=updateDate,
+        validated = await run_cpu_bound(
+            _validate_import_items, items, updateDate, size=len(items), min_size=min_size
         )
     except HTTPException as e:
         raise HTTPException(status_code=e.status_code, detail=e.detail)
@@ -92,24 +321,86 @@ async def import_items(
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    else:
-        items_to_import = ImportItemsManager(
-            items_to_import=validated.items,
-            update_date=validated.updateDate,
+    if asyncMode:
+        payload = await run_cpu_bound(
+            _get_import_job_payload, validated, size=len(items), min_size=min_size
+        )
+        job = await create_import_job(payload=payload)
+        import_jobs_workers_notify()
+        response.status_code = 202
+        return ImportJobOut(
+            id=job.id,
+            status=job.status,
+            createdAt=job.created_at,
         )
-        await items_to_import.import_to_db()
+
+    await wait_for_queued_import_jobs()
+    items_to_import = ImportItemsManager(
+        items_to_import=validated.items,
+        update_date=validated.updateDate,
+    )
+    return await items_to_import.import_to_db()
+
+
+@api_router.get(
+    "/imports/{job_id}",
+    description=descriptions.import_job,
+    response_model=ImportJobOut,
+)
+async def get_import_job_status(
+    job_id: int = Query(..., description="Идентификатор задачи импорта"),
+) -> ImportJobOut:
+    job = await get_import_job(job_id)
+    if job is None:
+        raise ImportJobNotFound(job_id=job_id)
+    return ImportJobOut(
+        id=job.id,
+        status=job.status,
+        error=job.error,
+        createdAt=job.created_at,
+        startedAt=job.started_at,
+        finishedAt=job.finished_at,
+    )
+
+
+@api_router.post(
+    "/imports/stream",
+    description=descriptions.imports_stream,
+    response_model=StreamImportOut,
+    dependencies=[Depends(pin_to_database), Depends(use_imports_connections)],
+)
+async def import_items_stream(
+    request: Request,
+    updateDate: datetime = Query(..., example="2022-02-01T12:00:00.000Z"),
+    chunkSize: Optional[int] = Query(None, ge=1, description="Размер части импорта"),
+) -> StreamImportOut:
+    settings = get_app_settings()
+    await wait_for_queued_import_jobs()
+    stream_import = StreamImportItemsManager(
+        lines=iter_lines(
+            request.stream(), max_line_size=settings.stream_import_max_line_size
+        ),
+        update_date=updateDate,
+        chunk_size=chunkSize or settings.stream_import_chunk_size,
+    )
+    return await stream_import.import_to_db()
 
 
 @statistic_api_router.get(
-    "/sales", description=descriptions.sales, response_model=StatsItems
+    "/sales",
+    description=descriptions.sales,
+    response_model=StatsItems,
+    dependencies=[Depends(use_read_database)],
 )
 async def get_sales(
+    request: Request,
+    response: Response,
     date: str = Query(
         ...,
         example="2022-02-03T12:00:00.000Z",
         description="Дата и время запроса.",
     ),
-) -> StatsItems:
+) -> Union[StatsItems, Response]:
 
     try:
         validated = SaleStatsDateIn(date=date)
@@ -118,5 +409,57 @@ async def get_sales(
     else:
         validated_date: datetime = cast(datetime, validated.date)
 
+    # stats are read after version, so they are not older than ETag
+    headers = get_validators_headers(*await get_offer_stats_version(date=validated_date))
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+
+    shared_cache = get_shared_cache()
+    shared_key = f"sales:{validated_date.isoformat()}"
+    if shared_cache is not None:
+        value, shared_version = await shared_cache.get(
+            shared_key, version_key=SALES_VERSION_KEY
+        )
+        if value is not None:
+            cached_headers, body = unpack_response(value)
+            return Response(
+                content=body, media_type="application/json", headers=cached_headers
+            )
+
     res = await get_offer_stats_for_n_hours_and_date(date=validated_date)
-    return res
+    if shared_cache is None or not can_cache_reads():
+        response.headers.update(headers)
+        return res
+
+    res_body = res.json().encode()
+    await shared_cache.put(
+        shared_key, pack_response(headers, res_body), version=shared_version
+    )
+    return Response(content=res_body, media_type="application/json", headers=headers)
+
+
+@statistic_api_router.get(
+    "/cache/stats", description=descriptions.cache_stats, response_model=CachesStats
+)
+async def get_cache_stats() -> CachesStats:
+    shared_cache = get_shared_cache()
+    return CachesStats(
+        nodes=nodes_cache.get_stats(),
+        shared=shared_cache.get_stats() if shared_cache is not None else None,
+    )
+
+
+@statistic_api_router.get(
+    "/db/pool/stats", description=descriptions.pool_stats, response_model=PoolsStats
+)
+async def get_pool_stats() -> PoolsStats:
+    return get_pools_stats()
+
+
+@statistic_api_router.get(
+    "/metrics", description=descriptions.metrics, response_class=PlainTextResponse
+)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,150 @@
+import contextvars
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+from app.schemas import CacheStats
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses bounded by count and total size.
+
+    Entries of changed items are invalidated inside transaction of change,
+    see writing, and can't be stored again until it's finished.
+    Response read before the end of change is never stored,
+    since it can be read from database before commit.
+    """
+
+    def __init__(self, max_items: int, max_bytes: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._changing_keys: Counter[str] = Counter()
+        self._writer_keys: contextvars.ContextVar[
+            Optional[set[str]]
+        ] = contextvars.ContextVar("writer_keys", default=None)
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.max_items > 0 and self.max_bytes > 0
+
+    @property
+    def generation(self) -> int:
+        """
+        must be taken before response is read from database, see put
+        """
+        return self._generation
+
+    def configure(self, max_items: int, max_bytes: int) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: str, body: bytes, generation: int) -> None:
+        if (
+            generation != self._generation
+            or key in self._changing_keys
+            or len(body) > self.max_bytes
+        ):
+            return
+        self._pop(key)
+        self._entries[key] = body
+        self._bytes += len(body)
+        self._evict()
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        """
+        Called inside writing, keys are also locked till the end of it
+        """
+        writer_keys = self._writer_keys.get()
+        for key in keys:
+            self._pop(key)
+            if writer_keys is not None and key not in writer_keys:
+                writer_keys.add(key)
+                self._changing_keys[key] += 1
+        self._generation += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self._generation += 1
+
+    def get_stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            items=len(self._entries),
+            bytes=self._bytes,
+        )
+
+    @contextmanager
+    def writing(self) -> Iterator[Optional[set[str]]]:
+        """
+        Must wrap transaction which changes cached data.
+        Nested calls in the same context are joined with the outer one,
+        which yields keys invalidated by all of them and the others yield None.
+        """
+        if self._writer_keys.get() is not None:
+            yield None
+            return
+
+        writer_keys: set[str] = set()
+        token = self._writer_keys.set(writer_keys)
+        try:
+            yield writer_keys
+        finally:
+            self._writer_keys.reset(token)
+            for key in writer_keys:
+                self._pop(key)
+                self._changing_keys[key] -= 1
+                if not self._changing_keys[key]:
+                    del self._changing_keys[key]
+            self._generation += 1
+
+    def _pop(self, key: str) -> None:
+        body = self._entries.pop(key, None)
+        if body is not None:
+            self._bytes -= len(body)
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_items or self._bytes > self.max_bytes
+        ):
+            _, body = self._entries.popitem(last=False)
+            self._bytes -= len(body)
+
+
+# bodies of /nodes keyed by node id, disabled till nodes_cache_init
+nodes_cache = ResponseCache(max_items=0, max_bytes=0)
+
+
+async def nodes_cache_init(max_items: int, max_bytes: int) -> None:
+    nodes_cache.configure(max_items=max_items, max_bytes=max_bytes)
+
+
+async def nodes_cache_close() -> None:
+    nodes_cache.configure(max_items=0, max_bytes=0)
+
+
+async def nodes_cache_invalidate(item_ids: Optional[list[str]]) -> None:
+    """
+    handler of changes made by other workers, None means that anything could change
+    """
+    if item_ids is None:
+        nodes_cache.clear()
+    else:
+        nodes_cache.invalidate(item_ids)
@@ -0,0 +1,31 @@
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from app.core.cache import nodes_cache
+
+logger = logging.getLogger(__name__)
+
+# gets ids of changed items and their ancestors, None means that anything could change
+ItemsChangesHandler = Callable[[Optional[list[str]]], Awaitable[None]]
+
+# called after commit of changes made by this worker,
+# while their entries of nodes_cache are still locked, see writing_items
+committed_items_changes_handlers: list[ItemsChangesHandler] = []
+
+
+@asynccontextmanager
+async def writing_items() -> AsyncIterator[None]:
+    """
+    Must wrap transaction which changes items,
+    handlers are called after commit of the outermost one
+    """
+    with nodes_cache.writing() as changed_ids:
+        yield
+        if changed_ids:
+            for handler in committed_items_changes_handlers:
+                try:
+                    await handler(list(changed_ids))
+                except Exception:
+                    # change is committed anyway
+                    logger.exception("Handler of committed items changes failed")
@@ -1,19 +1,76 @@
 from typing import Callable
 
+from app.api.items.catalog import (
+    items_catalog_apply_changes,
+    items_catalog_close,
+    items_catalog_init,
+)
+from app.api.items.jobs import import_jobs_workers_start, import_jobs_workers_stop
+from app.core.cache import nodes_cache_close, nodes_cache_init, nodes_cache_invalidate
+from app.core.changes import ItemsChangesHandler
+from app.core.config import get_app_settings
+from app.core.executor import cpu_executor_close, cpu_executor_init
 from app.core.http import http_cli_close, http_cli_init
+from app.core.settings.api import NodesEngines
+from app.core.shared_cache import shared_cache_close, shared_cache_init
 from app.db.events import close_db_connection, connect_to_db
+from app.db.listener import items_changes_listener_start, items_changes_listener_stop
+from app.db.routing import read_database_note_changes
 
 
 def create_start_app_handler() -> Callable:  # type: ignore
     async def start_app() -> None:
         await connect_to_db()
         await http_cli_init()
+        settings = get_app_settings()
+        await cpu_executor_init(
+            executor_type=settings.cpu_executor_type,
+            workers_count=settings.cpu_executor_workers_count,
+        )
+        await nodes_cache_init(
+            max_items=settings.nodes_cache_max_items,
+            max_bytes=settings.nodes_cache_max_bytes,
+        )
+        await shared_cache_init(
+            redis_url=settings.redis_url,
+            ttl=settings.shared_cache_ttl,
+            publish_changes=not settings.listen_items_changes,
+        )
+        changes_handlers: list[ItemsChangesHandler] = []
+        if settings.nodes_engine == NodesEngines.catalog:
+            # with listener catalog is loaded after it's connected
+            await items_catalog_init(
+                max_items=settings.items_catalog_max_items,
+                load=not settings.listen_items_changes,
+            )
+            changes_handlers.append(items_catalog_apply_changes)
+        # cache entries are dropped after catalog is changed, see ResponseCache
+        changes_handlers.append(nodes_cache_invalidate)
+        if settings.read_database_url:
+            # changes of other workers also delay caching of replica reads
+            changes_handlers.append(read_database_note_changes)
+        if settings.listen_items_changes:
+            await items_changes_listener_start(
+                dsn=str(settings.database_url),
+                handlers=changes_handlers,
+                check_interval=settings.items_changes_check_interval,
+            )
+        await import_jobs_workers_start(
+            workers_count=settings.import_jobs_workers_count,
+            poll_interval=settings.import_jobs_poll_interval,
+        )
 
     return start_app
 
 
 def create_stop_app_handler() -> Callable:  # type: ignore
     async def close_app() -> None:
+        await import_jobs_workers_stop()
+        await items_changes_listener_stop()
+        await items_catalog_close()
+        await cpu_executor_close()
+        await nodes_cache_close()
+        await shared_cache_close()
         await close_db_connection()
         await http_cli_close()
 
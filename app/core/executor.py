@@ -0,0 +1,47 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from app.core.settings.api import ExecutorTypes
+
+T = TypeVar("T")
+
+cpu_executor: Optional[Executor] = None
+
+
+async def cpu_executor_init(executor_type: ExecutorTypes, workers_count: int) -> None:
+    global cpu_executor
+    if executor_type == ExecutorTypes.thread:
+        cpu_executor = ThreadPoolExecutor(
+            max_workers=workers_count, thread_name_prefix="cpu-bound"
+        )
+    elif executor_type == ExecutorTypes.process:
+        # spawned processes don't inherit event loop and connections of the app
+        cpu_executor = ProcessPoolExecutor(
+            max_workers=workers_count, mp_context=multiprocessing.get_context("spawn")
+        )
+
+
+async def cpu_executor_close() -> None:
+    global cpu_executor
+    if cpu_executor is not None:
+        cpu_executor.shutdown(wait=False, cancel_futures=True)
+        cpu_executor = None
+
+
+async def run_cpu_bound(
+    func: Callable[..., T], *args: Any, size: int, min_size: int
+) -> T:
+    """
+    Run func in executor if size of its input is at least min_size,
+    so event loop keeps serving other requests meanwhile.
+    Small inputs are processed in place: passing them to executor costs more.
+    For process executor func, args and result must be picklable.
+    """
+    if cpu_executor is None or size < min_size:
+        return func(*args)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, functools.partial(func, *args))
@@ -0,0 +1,233 @@
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.schemas import HistogramStats
+
+# seconds, from fast queries to timeouts
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = tuple[str, ...]
+# lines of metrics in Prometheus text format, see render_metrics
+Collector = Callable[[], Iterable[str]]
+
+collectors: list[Collector] = []
+
+
+class Histogram:
+    """
+    Counts of observed values by buckets with upper bounds, the last bucket is +Inf.
+    Buckets are allocated once and updated in place: values are observed
+    by event loop only, so they need no locks.
+    """
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.bounds = tuple(bounds)
+        self.les = (*(f"{bound:g}" for bound in self.bounds), "+Inf")
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        # bucket of value is the first one with bound >= value
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_stats(self) -> HistogramStats:
+        """
+        buckets are cumulative, as Prometheus counts them
+        """
+        buckets = {}
+        total = 0
+        for le, count in zip(self.les, self.counts):
+            total += count
+            buckets[le] = total
+        return HistogramStats(buckets=buckets, count=self.count, sum=self.sum)
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def histogram_lines(
+    name: str, label_names: Labels, label_values: Labels, histogram: Histogram
+) -> Iterator[str]:
+    total = 0
+    for le, count in zip(histogram.les, histogram.counts):
+        total += count
+        labels = _format_labels(label_names, label_values, f'le="{le}"')
+        yield f"{name}_bucket{labels} {total}"
+    labels = _format_labels(label_names, label_values)
+    yield f"{name}_sum{labels} {histogram.sum}"
+    yield f"{name}_count{labels} {histogram.count}"
+
+
+def header_lines(name: str, documentation: str, metric_type: str) -> Iterator[str]:
+    yield f"# HELP {name} {documentation}"
+    yield f"# TYPE {name} {metric_type}"
+
+
+class HistogramFamily:
+    """
+    Histograms by values of labels, they are created by the first observation
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Labels) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.histograms: dict[Labels, Histogram] = {}
+        collectors.append(self.collect)
+
+    def labels(self, *values: str) -> Histogram:
+        histogram = self.histograms.get(values)
+        if histogram is None:
+            histogram = self.histograms[values] = Histogram()
+        return histogram
+
+    def collect(self) -> Iterator[str]:
+        yield from header_lines(self.name, self.documentation, "histogram")
+        for values, histogram in self.histograms.items():
+            yield from histogram_lines(self.name, self.label_names, values, histogram)
+
+
+class Counter:
+    """
+    Values by values of labels, counter only grows and gauge goes both ways
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Labels = (),
+        metric_type: str = "counter",
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.metric_type = metric_type
+        self.values: dict[Labels, float] = {}
+        collectors.append(self.collect)
+
+    def inc(self, labels: Labels = (), value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def collect(self) -> Iterator[str]:
+        yield from header_lines(self.name, self.documentation, self.metric_type)
+        for values, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.label_names, values)} {value}"
+
+
+def render_metrics() -> str:
+    """
+    Metrics of this worker process in Prometheus text format
+    """
+    return "".join(f"{line}\n" for collect in collectors for line in collect())
+
+
+REQUESTS_IN_FLIGHT = Counter(
+    "http_requests_in_flight", "Requests being handled", metric_type="gauge"
+)
+REQUEST_DURATION = HistogramFamily(
+    "http_request_duration_seconds",
+    "Time from request to the last byte of response",
+    ("method", "route"),
+)
+RESPONSES = Counter("http_responses_total", "Responses", ("method", "route", "status"))
+REQUEST_BYTES = Counter(
+    "http_request_bytes_total", "Bytes of request bodies", ("method", "route")
+)
+RESPONSE_BYTES = Counter(
+    "http_response_bytes_total", "Bytes of response bodies", ("method", "route")
+)
+
+
+class MetricsMiddleware:
+    """
+    Measures HTTP requests by route templates, like /nodes/{id},
+    requests which match no route are counted with route "other"
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._routes: dict[Any, str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        request_bytes = 0
+        response_bytes = 0
+
+        async def receive_counted() -> Message:
+            nonlocal request_bytes
+            message = await receive()
+            request_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message: Message) -> None:
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(value=1)
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            REQUESTS_IN_FLIGHT.inc(value=-1)
+            labels = (scope["method"], self._get_route(scope))
+            REQUEST_DURATION.labels(*labels).observe(time.perf_counter() - start)
+            RESPONSES.inc((*labels, str(status)))
+            REQUEST_BYTES.inc(labels, request_bytes)
+            RESPONSE_BYTES.inc(labels, response_bytes)
+
+    def _get_route(self, scope: Scope) -> str:
+        # router puts endpoint of matched route to scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "other"
+        route = self._routes.get(endpoint)
+        if route is None:
+            route = self._routes[endpoint] = next(
+                (
+                    getattr(route, "path", "other")
+                    for route in scope["app"].routes
+                    if getattr(route, "endpoint", None) is endpoint
+                ),
+                "other",
+            )
+        return route
@@ -1,11 +1,30 @@
 import logging
-from typing import Any, Dict, List, Tuple, Union
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from pydantic import PostgresDsn
+from pydantic import PostgresDsn, validator
 
 from app.core.settings.base import BaseAppSettings
 
 
+class ExecutorTypes(Enum):
+    none: str = "none"
+    thread: str = "thread"
+    process: str = "process"
+
+
+class NodesEngines(Enum):
+    sql: str = "sql"
+    python: str = "python"
+    catalog: str = "catalog"
+    stream: str = "stream"
+
+
+class DbBackends(Enum):
+    databases: str = "databases"
+    asyncpg: str = "asyncpg"
+
+
 class AppSettings(BaseAppSettings):
 
     docs_url: str = "/docs"
@@ -17,12 +36,100 @@ class AppSettings(BaseAppSettings):
     database_url: Union[str, PostgresDsn]
     max_connection_count: int = 10
     min_connection_count: int = 10
+    # queries of app/models are sent by databases or straight to asyncpg connections
+    # of the same pool, which skips building of SQLAlchemy query and wrapping of rows
+    # on every call, see fetch_rows
+    db_backend: DbBackends = DbBackends.databases
+    # replica for /nodes and /sales, empty url sends them to database_url;
+    # client which changed items is pinned to database_url for the expected
+    # lag of replica (seconds) by cookie, see use_read_database
+    read_database_url: Optional[str] = None
+    read_your_writes_seconds: int = 5
+    # connections of pool are given in order of requests up to limit;
+    # adaptive limit starts at min_connection_count and grows up to max_connection_count
+    # while requests wait for connection longer than target (seconds) on average,
+    # it shrinks when nobody waits, asyncpg closes connections idle for 5 minutes
+    db_pool_adaptive: bool = False
+    db_pool_target_wait: float = 0.01
+    # seconds to wait for connection, then request fails with 503
+    db_pool_acquire_timeout: float = 30.0
+    # connections which /imports can take at once, so burst of imports waiting
+    # for lock of tree leaves the rest of pool to /nodes; 0 disables the cap
+    imports_max_connections: int = 4
+
+    # imports with at least this number of items are uploaded via COPY
+    bulk_import_min_items: int = 1000
+    # re-imported items equal to stored ones (name, price, parentId) are not rewritten:
+    # they keep their dates, are not saved to statistic and don't update ancestors
+    skip_unchanged_items: bool = False
+    # NDJSON imports are committed by chunks of this size
+    stream_import_chunk_size: int = 5000
+    # bytes, longer line of NDJSON import is rejected, it's buffered till its end
+    stream_import_max_line_size: int = 1024 * 1024
+    # background workers applying imports sent with async=true, 0 disables them
+    # in this process, then jobs are applied only by workers of other processes;
+    # jobs are applied one at a time in order of submission whatever the count is
+    import_jobs_workers_count: int = 1
+    # seconds between checks of import jobs queue
+    import_jobs_poll_interval: float = 1.0
+    # synchronous imports and deletes wait for jobs queued before them (seconds),
+    # then they fail with 503
+    import_jobs_wait_timeout: float = 60.0
+
+    # sql: tree of /nodes is built as JSON by Postgres,
+    # python: flat rows are fetched and tree is built by app, it's several times faster
+    # catalog: whole tree is kept in memory of every worker, see ItemsCatalog,
+    # it's kept in sync by listen_items_changes; python engine is used while it's loaded
+    # stream: rows are read by cursor and tree is sent in chunks as it's written,
+    # memory doesn't depend on size of tree, responses are not cached
+    nodes_engine: NodesEngines = NodesEngines.sql
+    # ~280 MB per million items, catalog is disabled above it
+    items_catalog_max_items: int = 1_000_000
+    # ids in one request of POST /nodes
+    nodes_batch_max_ids: int = 100
+
+    # responses of /nodes are cached in memory of process, 0 disables cache;
+    # cache is bounded by number of responses and their total size
+    nodes_cache_max_items: int = 10_000
+    nodes_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # workers listen notifications about committed changes of items from database
+    # and update their in-memory data, connection is checked every interval (seconds);
+    # every worker holds one more connection for it outside of the pool, so by default
+    # it's on only with catalog engine. Several workers caching /nodes in memory
+    # without it see changes of each other only via redis_url
+    listen_items_changes: Optional[bool] = None
+    items_changes_check_interval: float = 10.0
+
+    # responses of /nodes and /sales are shared by workers via redis,
+    # "memory://" keeps them in memory of process, empty url disables shared cache;
+    # without listen_items_changes changes are also sent to workers via redis
+    redis_url: Optional[str] = None
+    # seconds
+    shared_cache_ttl: int = 3600
+
+    # validation of big imports and shaping of big trees run in executor,
+    # so they don't block event loop for other requests
+    cpu_executor_type: ExecutorTypes = ExecutorTypes.thread
+    cpu_executor_workers_count: int = 2
+    # smaller inputs are processed in place, passing them to executor costs more
+    cpu_executor_min_import_items: int = 5000
+    cpu_executor_min_tree_bytes: int = 1_000_000
+    cpu_executor_min_tree_items: int = 10_000
 
     allowed_hosts: List[str] = ["*"]
 
     logging_level: int = logging.INFO
     loggers: Tuple[str, str] = ("uvicorn.asgi", "uvicorn.access")
 
+    @validator("listen_items_changes", always=True)
+    def listen_items_changes_for_catalog(
+        cls, value: Optional[bool], values: Dict[str, Any]
+    ) -> bool:
+        if value is None:
+            return values.get("nodes_engine") == NodesEngines.catalog
+        return value
+
     class Config:
         validate_assignment = True
 
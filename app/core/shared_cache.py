@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, AsyncIterator, Optional
+
+from app.core.cache import nodes_cache_invalidate
+from app.core.changes import committed_items_changes_handlers
+from app.schemas import SharedCacheStats
+
+logger = logging.getLogger(__name__)
+
+# url of in-process fake, for tests and single worker
+IN_MEMORY_URL = "memory://"
+CHANGES_CHANNEL = "items-changes"
+# bigger changes clear local caches of other workers instead of sending ids
+MAX_IDS_IN_MESSAGE = 1000
+RESUBSCRIBE_DELAY = 1.0
+# every entry has version of data it was built from, see SharedCache
+SALES_VERSION_KEY = "sales"
+
+
+class InMemoryRedis:
+    """
+    Subset of aioredis client used by SharedCache kept in memory of process
+    """
+
+    def __init__(self) -> None:
+        self._values: dict[str, tuple[bytes, Optional[float]]] = {}
+        self._subscribers: dict[str, list[asyncio.Queue]] = {}  # type: ignore
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    async def mget(self, keys: list[str]) -> list[Optional[bytes]]:
+        now = time.monotonic()
+        values = []
+        for key in keys:
+            value, expires_at = self._values.get(key, (None, None))
+            values.append(None if expires_at is not None and expires_at < now else value)
+        return values
+
+    async def set(self, name: str, value: Any, ex: Optional[int] = None) -> bool:
+        expires_at = time.monotonic() + ex if ex is not None else None
+        self._values[name] = (self._encode(value), expires_at)
+        return True
+
+    async def publish(self, channel: str, message: Any) -> int:
+        subscribers = self._subscribers.get(channel, [])
+        for queue in subscribers:
+            queue.put_nowait(
+                {"type": "message", "channel": channel, "data": self._encode(message)}
+            )
+        return len(subscribers)
+
+    def pipeline(self, transaction: bool = True) -> "_InMemoryPipeline":
+        return _InMemoryPipeline(self)
+
+    def pubsub(self) -> "_InMemoryPubSub":
+        return _InMemoryPubSub(self)
+
+    async def close(self) -> None:
+        self._values.clear()
+
+
+class _InMemoryPipeline:
+    def __init__(self, redis: InMemoryRedis):
+        self._redis = redis
+        self._commands: list[tuple[str, tuple[Any, ...], dict[str, Any]]] = []
+
+    def set(self, name: str, value: Any, ex: Optional[int] = None) -> "_InMemoryPipeline":
+        self._commands.append(("set", (name, value), {"ex": ex}))
+        return self
+
+    def publish(self, channel: str, message: Any) -> "_InMemoryPipeline":
+        self._commands.append(("publish", (channel, message), {}))
+        return self
+
+    async def execute(self) -> list[Any]:
+        commands, self._commands = self._commands, []
+        return [
+            await getattr(self._redis, name)(*args, **kwargs)
+            for name, args, kwargs in commands
+        ]
+
+
+class _InMemoryPubSub:
+    def __init__(self, redis: InMemoryRedis):
+        self._redis = redis
+        self._queue: asyncio.Queue = asyncio.Queue()  # type: ignore
+        self._channels: list[str] = []
+
+    async def subscribe(self, channel: str) -> None:
+        self._redis._subscribers.setdefault(channel, []).append(self._queue)
+        self._channels.append(channel)
+
+    async def listen(self) -> AsyncIterator[dict[str, Any]]:
+        while self._channels:
+            yield await self._queue.get()
+
+    async def close(self) -> None:
+        for channel in self._channels:
+            self._redis._subscribers[channel].remove(self._queue)
+        self._channels = []
+
+
+class SharedCache:
+    """
+    Cache of serialized responses shared by all workers.
+
+    Entry is stored with version of data it was built from and is served
+    only while the version is current. Version is changed after commit
+    of every change, so response read before commit is never served after it,
+    even if it's stored later. With publish_changes changes are also published
+    to other workers, which drop their local entries, see nodes_cache;
+    it's not needed when workers listen changes from database, see ItemsChangesListener.
+    """
+
+    def __init__(self, redis: Any, ttl: int, publish_changes: bool = True):
+        self.hits = 0
+        self.misses = 0
+        self._redis = redis
+        self._ttl = ttl
+        self.publish_changes = publish_changes
+        # messages of this worker are skipped by its listener
+        self._sender = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None  # type: ignore
+
+    async def get(
+        self, key: str, version_key: Optional[str] = None
+    ) -> tuple[Optional[bytes], bytes]:
+        """
+        returns body, if it's current, and version to store new body with, see put
+        """
+        version, value = await self._redis.mget(
+            [f"version:{version_key or key}", f"entry:{key}"]
+        )
+        version = version or b"0"
+        if value is not None:
+            entry_version, _, body = value.partition(b"\n")
+            if entry_version == version:
+                self.hits += 1
+                return body, version
+        self.misses += 1
+        return None, version
+
+    async def put(self, key: str, body: bytes, version: bytes) -> None:
+        await self._redis.set(f"entry:{key}", version + b"\n" + body, ex=self._ttl)
+
+    async def invalidate_items(self, item_ids: set[str]) -> None:
+        """
+        Must be called after commit of change of items:
+        /nodes of items and /sales are invalidated
+        """
+        # versions are unique, so version can't come back after its key expires;
+        # they live longer than entries, so expired version has no entries
+        version = uuid.uuid4().hex
+        pipe = self._redis.pipeline(transaction=False)
+        version_keys = [*(f"nodes:{item_id}" for item_id in item_ids), SALES_VERSION_KEY]
+        for version_key in version_keys:
+            pipe.set(f"version:{version_key}", version, ex=self._ttl * 2)
+        if self.publish_changes:
+            ids = list(item_ids) if len(item_ids) <= MAX_IDS_IN_MESSAGE else None
+            message = {"sender": self._sender, "ids": ids}
+            pipe.publish(CHANGES_CHANNEL, json.dumps(message))
+        await pipe.execute()
+
+    def get_stats(self) -> SharedCacheStats:
+        return SharedCacheStats(hits=self.hits, misses=self.misses)
+
+    def start_listener(self) -> None:
+        if not self.publish_changes:
+            return
+        self._listener = asyncio.create_task(self._listen(), name="shared-cache-listener")
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        await self._redis.close()
+
+    async def _on_message(self, data: bytes) -> None:
+        message = json.loads(data)
+        if message["sender"] != self._sender:
+            await nodes_cache_invalidate(message["ids"])
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(CHANGES_CHANNEL)
+                # messages sent while listener wasn't subscribed are lost
+                await nodes_cache_invalidate(None)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        await self._on_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Listener of shared cache failed, resubscribing")
+            finally:
+                await pubsub.close()
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+
+shared_cache: Optional[SharedCache] = None
+
+
+def get_shared_cache() -> Optional[SharedCache]:
+    return shared_cache
+
+
+async def shared_cache_init(
+    redis_url: Optional[str], ttl: int, publish_changes: bool = True
+) -> None:
+    global shared_cache
+    if not redis_url:
+        return
+
+    redis: Any
+    if redis_url == IN_MEMORY_URL:
+        redis = InMemoryRedis()
+    else:
+        # imported only when it's used: aioredis 2.0.1 can't be imported on python 3.11
+        import aioredis
+
+        redis = aioredis.from_url(redis_url)
+    shared_cache = SharedCache(redis=redis, ttl=ttl, publish_changes=publish_changes)
+    shared_cache.start_listener()
+    committed_items_changes_handlers.append(shared_cache_invalidate)
+
+
+async def shared_cache_close() -> None:
+    global shared_cache
+    if shared_cache is not None:
+        committed_items_changes_handlers.remove(shared_cache_invalidate)
+        await shared_cache.close()
+        shared_cache = None
+
+
+async def shared_cache_invalidate(item_ids: Optional[list[str]]) -> None:
+    """
+    handler of changes committed by this worker, see writing_items;
+    stale entries expire by ttl if it fails
+    """
+    if shared_cache is not None and item_ids is not None:
+        await shared_cache.invalidate_items(set(item_ids))
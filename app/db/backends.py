@@ -0,0 +1,196 @@
+import inspect
+import re
+import time
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+from typing import Any, AsyncIterator, Callable, Mapping, Optional, Sequence, TypeVar
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY, Insert, insert
+
+from app.core.config import get_app_settings
+from app.core.metrics import Counter, HistogramFamily
+from app.core.settings.api import DbBackends
+from app.db.routing import get_database
+
+# :name parameters of text query, the same as sqlalchemy.text finds
+PARAMETER = re.compile(r"(?<![:\w\x5c]):(\w+)(?!:)")
+_dialect = postgresql.dialect(paramstyle="named")
+
+Values = Optional[Mapping[str, Any]]
+QueryFunction = TypeVar("QueryFunction", bound=Callable[..., Any])
+
+QUERY_DURATION = HistogramFamily(
+    "db_query_duration_seconds", "Time of query functions", ("function",)
+)
+QUERY_ROWS = Counter(
+    "db_query_rows_total", "Rows returned to query functions", ("function",)
+)
+# query function which current context runs, rows of fetch_rows are counted for it
+_current_query: ContextVar[Optional[str]] = ContextVar("current_query", default=None)
+
+
+def timed_query(func: QueryFunction) -> QueryFunction:
+    """
+    Decorator of query functions of app/models: their time and rows are measured,
+    see render_metrics. Iteration of async generator is timed till it's finished,
+    with time of consumer, and its rows are counted as they are yielded.
+    """
+    name = func.__name__
+    histogram = QUERY_DURATION.labels(name)
+
+    if inspect.isasyncgenfunction(func):
+
+        @wraps(func)
+        async def iterate(*args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+            start = time.perf_counter()
+            rows = 0
+            try:
+                async for row in func(*args, **kwargs):
+                    rows += 1
+                    yield row
+            finally:
+                histogram.observe(time.perf_counter() - start)
+                QUERY_ROWS.inc((name,), rows)
+
+        return iterate  # type: ignore
+
+    @wraps(func)
+    async def call(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        token = _current_query.set(name)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _current_query.reset(token)
+            histogram.observe(time.perf_counter() - start)
+
+    return call  # type: ignore
+
+
+def _count_rows(rows: int) -> None:
+    name = _current_query.get()
+    if name is not None:
+        QUERY_ROWS.inc((name,), rows)
+
+
+def compile_query(query: sa.sql.ClauseElement) -> str:
+    """
+    Text of SQLAlchemy query with :name parameters, so it's compiled once at import
+    instead of every call. Values given to query, like constants, are rendered
+    as literals, parameters made by sa.bindparam are left to be passed with values.
+    """
+    compiled = query.compile(dialect=_dialect)
+    literals = {
+        name: compiled.render_literal_value(bind.value, bind.type)
+        for name, bind in compiled.binds.items()
+        if not bind.required
+    }
+    return PARAMETER.sub(lambda match: literals.get(match[1], match[0]), str(compiled))
+
+
+def insert_from_arrays(table: sa.Table, columns: Sequence[str]) -> Insert:
+    """
+    INSERT of rows given as arrays of values of every column with names of columns,
+    so any number of rows is inserted by one query of the same text
+    """
+    arrays = []
+    for column in columns:
+        column_type = table.c[column].type
+        # collation can't be cast to, values get collation of column anyway
+        if getattr(column_type, "collation", None):
+            column_type = sa.String()
+        arrays.append(sa.cast(sa.bindparam(column), ARRAY(column_type)))
+    rows = sa.func.unnest(*arrays).table_valued(*columns).render_derived(name="row")
+    return insert(table).from_select(columns, sa.select(rows))
+
+
+@lru_cache(maxsize=None)
+def _get_statement(query: str) -> tuple[str, tuple[str, ...]]:
+    """
+    query with $n parameters of asyncpg and names of parameters in their order
+    """
+    numbers: dict[str, str] = {}
+    statement = PARAMETER.sub(
+        lambda match: numbers.setdefault(match[1], f"${len(numbers) + 1}"), query
+    )
+    return statement, tuple(numbers)
+
+
+def _get_args(query: str, values: Values) -> tuple[str, list[Any]]:
+    statement, names = _get_statement(query)
+    return statement, [values[name] for name in names] if values else []
+
+
+def _is_asyncpg() -> bool:
+    return get_app_settings().db_backend == DbBackends.asyncpg
+
+
+async def fetch_rows(query: str, values: Values = None) -> list[tuple[Any, ...]]:
+    """
+    Rows of text query as plain tuples, sent by backend of db_backend setting.
+
+    databases builds and compiles SQLAlchemy query from text and values on every call
+    and wraps rows into its records. asyncpg sends query to connection directly:
+    text is converted to $n parameters once, asyncpg prepares it once per connection
+    and decodes values by its binary codecs, records are turned to tuples as they are.
+    Both take connection of current context, so queries of transaction go together;
+    database of current context is chosen by get_database.
+    """
+    if _is_asyncpg():
+        statement, args = _get_args(query, values)
+        async with get_database().connection() as connection:
+            records = await connection.raw_connection.fetch(statement, *args)
+        _count_rows(len(records))
+        return [tuple(record) for record in records]
+    rows = await get_database().fetch_all(query, values=values)
+    _count_rows(len(rows))
+    return [tuple(row._mapping.values()) for row in rows]
+
+
+async def fetch_row(query: str, values: Values = None) -> Optional[tuple[Any, ...]]:
+    if _is_asyncpg():
+        statement, args = _get_args(query, values)
+        async with get_database().connection() as connection:
+            record = await connection.raw_connection.fetchrow(statement, *args)
+        _count_rows(record is not None)
+        return tuple(record) if record is not None else None
+    row = await get_database().fetch_one(query, values=values)
+    _count_rows(row is not None)
+    return tuple(row._mapping.values()) if row is not None else None
+
+
+async def fetch_val(query: str, values: Values = None) -> Any:
+    if _is_asyncpg():
+        statement, args = _get_args(query, values)
+        async with get_database().connection() as connection:
+            return await connection.raw_connection.fetchval(statement, *args)
+    return await get_database().fetch_val(query, values=values)
+
+
+async def execute(query: str, values: Values = None) -> None:
+    if _is_asyncpg():
+        statement, args = _get_args(query, values)
+        async with get_database().connection() as connection:
+            await connection.raw_connection.execute(statement, *args)
+    else:
+        await get_database().execute(query, values=values)
+
+
+async def iterate_rows(
+    query: str, values: Values = None
+) -> AsyncIterator[tuple[Any, ...]]:
+    """
+    rows of fetch_rows read by cursor, connection and transaction are held
+    till iteration is finished
+    """
+    if _is_asyncpg():
+        statement, args = _get_args(query, values)
+        async with get_database().connection() as connection:
+            async with connection.transaction():
+                async for record in connection.raw_connection.cursor(statement, *args):
+                    yield tuple(record)
+    else:
+        async for row in get_database().iterate(query, values=values):
+            yield tuple(row._mapping.values())
@@ -0,0 +1,30 @@
+from typing import Any, Iterable, Sequence
+
+import sqlalchemy as sa
+
+from app.db.base import database
+
+
+async def copy_to_temp_table(
+    table_name: str,
+    like_table_name: str,
+    columns: Sequence[str],
+    records: Iterable[Sequence[Any]],
+) -> sa.sql.expression.TableClause:
+    """
+    Create temporary table with the same columns as like_table_name
+    and stream records to it via binary COPY protocol of asyncpg.
+
+    Must be called inside transaction: the table is dropped on commit.
+    Returns table to use in queries like INSERT ... SELECT.
+    """
+    async with database.connection() as connection:
+        raw_connection = connection.raw_connection
+        await raw_connection.execute(
+            f"CREATE TEMP TABLE {table_name} "
+            f"(LIKE {like_table_name} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        await raw_connection.copy_records_to_table(
+            table_name, records=records, columns=list(columns)
+        )
+    return sa.table(table_name, *[sa.column(column) for column in columns])
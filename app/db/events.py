@@ -1,7 +1,10 @@
 import logging
 import sys
 
+from app.core.config import get_app_settings
 from app.db.base import database
+from app.db.pool import IMPORTS_GROUP, monitor_pool, unmonitor_pool
+from app.db.routing import read_database_close, read_database_connect
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -10,7 +13,10 @@ logger = logging.getLogger(__name__)
 async def connect_to_db() -> None:
     logger.info("Connecting to Database")
 
+    settings = get_app_settings()
     await database.connect()
+    monitor_pool("database", database, {IMPORTS_GROUP: settings.imports_max_connections})
+    await read_database_connect(settings.read_database_url)
 
     logger.info("Connection established")
 
@@ -18,6 +24,8 @@ async def connect_to_db() -> None:
 async def close_db_connection() -> None:
     logger.info("Closing connection to database")
 
+    await read_database_close()
+    unmonitor_pool("database")
     await database.disconnect()
 
     logger.info("Connection closed")
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+
+import asyncpg
+
+from app.core.changes import ItemsChangesHandler
+from app.models.items.queries import ITEMS_CHANGES_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 1.0
+
+
+class ItemsChangesListener:
+    """
+    Listens notifications about committed changes of items, see notify_items_changed,
+    on dedicated connection and passes them to handlers in order of commits.
+
+    Connection is checked every check_interval and reopened after failure.
+    Notifications sent while it's closed are lost, so handlers are told
+    that anything could change after every (re)connect.
+    """
+
+    def __init__(
+        self, dsn: str, handlers: list[ItemsChangesHandler], check_interval: float
+    ):
+        self._dsn = dsn
+        self._handlers = handlers
+        self._check_interval = check_interval
+        self._changes: asyncio.Queue[Optional[list[str]]] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []  # type: ignore
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._listen(), name="items-changes-listener"),
+            asyncio.create_task(self._handle(), name="items-changes-handler"),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _on_notification(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        self._changes.put_nowait(json.loads(payload)["ids"])
+
+    async def _handle(self) -> None:
+        while True:
+            item_ids = await self._changes.get()
+            for handler in self._handlers:
+                try:
+                    await handler(item_ids)
+                except Exception:
+                    logger.exception("Handler of items changes failed")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                await self._listen_connection()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Listener of items changes failed, reconnecting")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _listen_connection(self) -> None:
+        connection: asyncpg.Connection = await asyncpg.connect(self._dsn)
+        try:
+            is_closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: is_closed.set())
+            await connection.add_listener(ITEMS_CHANGES_CHANNEL, self._on_notification)
+            self._changes.put_nowait(None)
+
+            while not is_closed.is_set():
+                try:
+                    await asyncio.wait_for(is_closed.wait(), timeout=self._check_interval)
+                except asyncio.TimeoutError:
+                    # broken connection is noticed only when something is sent
+                    await connection.execute("SELECT 1", timeout=self._check_interval)
+        finally:
+            connection.terminate()
+
+
+items_changes_listener: Optional[ItemsChangesListener] = None
+
+
+async def items_changes_listener_start(
+    dsn: str, handlers: list[ItemsChangesHandler], check_interval: float
+) -> None:
+    global items_changes_listener
+    items_changes_listener = ItemsChangesListener(
+        dsn=dsn, handlers=handlers, check_interval=check_interval
+    )
+    items_changes_listener.start()
+
+
+async def items_changes_listener_stop() -> None:
+    global items_changes_listener
+    if items_changes_listener is not None:
+        await items_changes_listener.stop()
+        items_changes_listener = None
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+import databases
+
+from app.core.config import get_app_settings
+from app.core.metrics import Histogram, collectors, header_lines, histogram_lines
+from app.errors import DatabaseBusy
+from app.schemas import PoolsStats, PoolStats
+
+logger = logging.getLogger(__name__)
+
+# seconds between changes of adaptive limit
+ADJUST_INTERVAL = 1.0
+IMPORTS_GROUP = "imports"
+
+# group of endpoints which current context takes connections for, see MonitoredPool
+_connections_group: ContextVar[Optional[str]] = ContextVar(
+    "connections_group", default=None
+)
+monitored_pools: dict[str, "MonitoredPool"] = {}
+
+
+class ConnectionsGate:
+    """
+    Semaphore of connections with limit which can be changed while it's held,
+    waiters are let in by order of arrival
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> bool:
+        """
+        returns whether it had to wait, raises asyncio.TimeoutError after timeout
+        """
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException:
+            if not waiter.cancelled():
+                # connection was given right before cancellation
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        return True
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._wake()
+
+    def set_limit(self, limit: int) -> None:
+        self.limit = limit
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_use < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_use += 1
+                waiter.set_result(None)
+
+
+class MonitoredPool:
+    """
+    Stands for asyncpg pool of databases.Database: connections are given through
+    ConnectionsGate, so time of waiting for them, time they are held
+    and saturation of pool are measured whatever backend sends queries.
+
+    Adaptive limit is changed once per ADJUST_INTERVAL by acquires of the interval.
+    Connections of group, see use_imports_connections, are also limited
+    by gate of group, so the group can't take the whole pool.
+    """
+
+    def __init__(
+        self,
+        pool: Any,
+        acquire_timeout: float,
+        adaptive: bool,
+        target_wait: float,
+        groups_limits: dict[str, int],
+    ) -> None:
+        self._pool = pool
+        self.min_size: int = pool.get_min_size()
+        self.max_size: int = pool.get_max_size()
+        self.acquire_timeout = acquire_timeout
+        self.adaptive = adaptive
+        self.target_wait = target_wait
+        self.gate = ConnectionsGate(self.min_size if adaptive else self.max_size)
+        self.groups_gates = {
+            group: ConnectionsGate(limit) for group, limit in groups_limits.items()
+        }
+        self.acquire_wait = Histogram()
+        self.checkout = Histogram()
+        self.timeouts = 0
+        # connection: (time it was taken, gate of its group)
+        self._checkouts: dict[Any, tuple[float, Optional[ConnectionsGate]]] = {}
+
+        self._interval_start = time.perf_counter()
+        self._interval_acquires = 0
+        self._interval_waited = 0
+        self._interval_wait = 0.0
+        self._interval_peak = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pool, name)
+
+    def get_size(self) -> int:
+        size: int = self._pool.get_size()
+        return size
+
+    def get_idle_size(self) -> int:
+        idle_size: int = self._pool.get_idle_size()
+        return idle_size
+
+    async def acquire(self, *, timeout: Optional[float] = None) -> Any:
+        group = _connections_group.get()
+        group_gate = self.groups_gates.get(group) if group is not None else None
+        start = time.perf_counter()
+        deadline = start + self.acquire_timeout
+        try:
+            if group_gate is not None:
+                await group_gate.acquire(timeout=self.acquire_timeout)
+            try:
+                waited = await self.gate.acquire(timeout=deadline - time.perf_counter())
+                try:
+                    connection = await self._pool.acquire(
+                        timeout=max(deadline - time.perf_counter(), 0)
+                    )
+                except BaseException:
+                    self.gate.release()
+                    raise
+            except BaseException:
+                if group_gate is not None:
+                    group_gate.release()
+                raise
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise DatabaseBusy(timeout=self.acquire_timeout)
+
+        now = time.perf_counter()
+        self.acquire_wait.observe(now - start)
+        self._checkouts[connection] = (now, group_gate)
+        if self.adaptive:
+            self._interval_acquires += 1
+            self._interval_waited += waited
+            self._interval_wait += now - start
+            self._interval_peak = max(self._interval_peak, self.gate.in_use)
+            if now - self._interval_start >= ADJUST_INTERVAL:
+                self._adjust_limit(now)
+        return connection
+
+    async def release(self, connection: Any, *, timeout: Optional[float] = None) -> None:
+        taken_at, group_gate = self._checkouts.pop(connection)
+        try:
+            await self._pool.release(connection, timeout=timeout)
+        finally:
+            self.checkout.observe(time.perf_counter() - taken_at)
+            self.gate.release()
+            if group_gate is not None:
+                group_gate.release()
+
+    def _adjust_limit(self, now: float) -> None:
+        """
+        Limit grows by quarter while requests wait at gate longer than target,
+        it shrinks by one connection when nobody waited and some were never used
+        """
+        limit = self.gate.limit
+        mean_wait = self._interval_wait / self._interval_acquires
+        if self._interval_waited and mean_wait > self.target_wait:
+            limit = min(limit + max(limit // 4, 1), self.max_size)
+        elif not self._interval_waited and self._interval_peak < limit:
+            limit = max(limit - 1, self.min_size)
+        if limit != self.gate.limit:
+            logger.info("Limit of pool connections is changed to %s", limit)
+            self.gate.set_limit(limit)
+
+        self._interval_start = now
+        self._interval_acquires = 0
+        self._interval_waited = 0
+        self._interval_wait = 0.0
+        self._interval_peak = self.gate.in_use
+
+    def get_stats(self) -> PoolStats:
+        return PoolStats(
+            size=self.get_size(),
+            idle=self.get_idle_size(),
+            in_use=self.gate.in_use,
+            limit=self.gate.limit,
+            waiting=self.gate.waiting,
+            timeouts=self.timeouts,
+            acquire_wait=self.acquire_wait.get_stats(),
+            checkout=self.checkout.get_stats(),
+        )
+
+
+def monitor_pool(
+    name: str, database: databases.Database, groups_limits: dict[str, int]
+) -> None:
+    """
+    Must be called after database is connected, pool of sqlite is not monitored
+    """
+    # pool of databases backend isn't public, but it's the only place to meet
+    # connections of both backends of db_backend setting
+    backend = database._backend
+    pool = getattr(backend, "_pool", None)
+    if pool is None or isinstance(pool, MonitoredPool):
+        return
+    settings = get_app_settings()
+    monitored_pool = MonitoredPool(
+        pool,
+        acquire_timeout=settings.db_pool_acquire_timeout,
+        adaptive=settings.db_pool_adaptive,
+        target_wait=settings.db_pool_target_wait,
+        groups_limits={group: limit for group, limit in groups_limits.items() if limit},
+    )
+    backend._pool = monitored_pool
+    monitored_pools[name] = monitored_pool
+
+
+def unmonitor_pool(name: str) -> None:
+    monitored_pools.pop(name, None)
+
+
+def get_pools_stats() -> PoolsStats:
+    return PoolsStats(
+        **{name: pool.get_stats() for name, pool in monitored_pools.items()}
+    )
+
+
+POOL_GAUGES: dict[str, tuple[str, Callable[[MonitoredPool], int]]] = {
+    "db_pool_size": ("Connections of pool", lambda pool: pool.get_size()),
+    "db_pool_idle": ("Idle connections of pool", lambda pool: pool.get_idle_size()),
+    "db_pool_in_use": ("Connections taken from pool", lambda pool: pool.gate.in_use),
+    "db_pool_limit": ("Connections which can be taken", lambda pool: pool.gate.limit),
+    "db_pool_waiting": (
+        "Requests waiting for connection",
+        lambda pool: pool.gate.waiting,
+    ),
+}
+
+
+def _collect_pools() -> Iterator[str]:
+    """
+    metrics of monitored pools by their names, see render_metrics
+    """
+    for name, (documentation, get_value) in POOL_GAUGES.items():
+        yield from header_lines(name, documentation, "gauge")
+        for pool_name, pool in monitored_pools.items():
+            yield f'{name}{{pool="{pool_name}"}} {get_value(pool)}'
+    yield from header_lines(
+        "db_pool_timeouts_total", "Requests not given connection in time", "counter"
+    )
+    for pool_name, pool in monitored_pools.items():
+        yield f'db_pool_timeouts_total{{pool="{pool_name}"}} {pool.timeouts}'
+    for name, documentation, attribute in (
+        (
+            "db_pool_acquire_wait_seconds",
+            "Time of waiting for connection",
+            "acquire_wait",
+        ),
+        ("db_pool_checkout_seconds", "Time connection is held", "checkout"),
+    ):
+        yield from header_lines(name, documentation, "histogram")
+        for pool_name, pool in monitored_pools.items():
+            yield from histogram_lines(
+                name, ("pool",), (pool_name,), getattr(pool, attribute)
+            )
+
+
+collectors.append(_collect_pools)
+
+
+async def use_imports_connections() -> AsyncIterator[None]:
+    """
+    Dependency of endpoints which import items: they wait for lock of tree
+    holding connections, so their number is limited by imports_max_connections
+    """
+    token = _connections_group.set(IMPORTS_GROUP)
+    try:
+        yield
+    finally:
+        _connections_group.reset(token)
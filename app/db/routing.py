@@ -0,0 +1,101 @@
+import logging
+import time
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+import databases
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.core.changes import committed_items_changes_handlers
+from app.core.config import get_app_settings
+from app.db.base import database, db_options
+from app.db.pool import monitor_pool, unmonitor_pool
+
+logger = logging.getLogger(__name__)
+
+# cookie of client which changed items, its reads go to database till it expires
+PRIMARY_COOKIE = "read_primary"
+
+# replica of database, see use_read_database
+read_database: Optional[databases.Database] = None
+# database of queries of current context
+_current_database: ContextVar[databases.Database] = ContextVar(
+    "current_database", default=database
+)
+# monotonic time of the latest change of items known to this worker
+_last_change_at = float("-inf")
+
+
+def get_database() -> databases.Database:
+    """
+    database which queries of current context are sent to:
+    read_database inside endpoints using use_read_database, database otherwise
+    """
+    return _current_database.get()
+
+
+async def use_read_database(request: Request) -> AsyncIterator[None]:
+    """
+    Dependency of endpoints which only read items: their queries go to read_database,
+    unless client changed items recently, see pin_to_database. Changes are seen
+    by read_database later, so reads of other clients can be older for a while.
+    """
+    if read_database is None or PRIMARY_COOKIE in request.cookies:
+        yield
+        return
+    token = _current_database.set(read_database)
+    try:
+        yield
+    finally:
+        _current_database.reset(token)
+
+
+async def pin_to_database(response: Response) -> None:
+    """
+    Dependency of endpoints which change items: client reads from database
+    till read_database replays the change, so it sees its own writes
+    """
+    if read_database is not None:
+        response.set_cookie(
+            PRIMARY_COOKIE, "1", max_age=get_app_settings().read_your_writes_seconds
+        )
+
+
+def can_cache_reads() -> bool:
+    """
+    Responses read from read_database are cached only when it had time to replay
+    the latest change, otherwise old response could be cached after invalidation
+    """
+    if get_database() is database:
+        return True
+    lag = get_app_settings().read_your_writes_seconds
+    return time.monotonic() - _last_change_at >= lag
+
+
+async def read_database_note_changes(item_ids: Optional[list[str]]) -> None:
+    """
+    handler of changes of items, see ItemsChangesHandler
+    """
+    global _last_change_at
+    _last_change_at = time.monotonic()
+
+
+async def read_database_connect(url: Optional[str]) -> None:
+    global read_database
+    if not url or read_database is not None:
+        return
+    logger.info("Connecting to read database")
+    read_database = databases.Database(url, **db_options)
+    await read_database.connect()
+    monitor_pool("read_database", read_database, {})
+    committed_items_changes_handlers.append(read_database_note_changes)
+
+
+async def read_database_close() -> None:
+    global read_database
+    if read_database is not None:
+        committed_items_changes_handlers.remove(read_database_note_changes)
+        unmonitor_pool("read_database")
+        await read_database.disconnect()
+        read_database = None
@@ -17,8 +17,43 @@ class NodeNotFound(HTTPException):
         self.detail = f"Node with id={node_id} not found"
 
 
+class ImportJobNotFound(HTTPException):
+    status_code: int = 404
+
+    def __init__(self, job_id: int) -> None:
+        self.detail = f"Import job with id={job_id} not found"
+
+
 class InvalidUUID(HTTPException):
     status_code: int = 400
 
     def __init__(self, uuid: str) -> None:
         self.detail = f"Current {uuid=} is not valid"
+
+
+class LineTooLong(HTTPException):
+    status_code: int = 400
+
+    def __init__(self, max_line_size: int) -> None:
+        self.detail = f"Line is longer than {max_line_size} bytes"
+
+
+class TreeTooDeep(HTTPException):
+    status_code: int = 400
+
+    def __init__(self, max_depth: int, item_id: str) -> None:
+        self.detail = f"Items tree is limited to {max_depth} levels, {item_id=} is deeper"
+
+
+class DatabaseBusy(HTTPException):
+    status_code: int = 503
+
+    def __init__(self, timeout: float) -> None:
+        self.detail = f"No database connection is free in {timeout} seconds"
+
+
+class ImportJobsNotApplied(HTTPException):
+    status_code: int = 503
+
+    def __init__(self, timeout: float) -> None:
+        self.detail = f"Import jobs queued before are not applied in {timeout} seconds"
@@ -0,0 +1,90 @@
+from typing import Any, Optional
+
+import sqlalchemy as sa
+
+from app.db.backends import timed_query
+from app.db.base import database
+from app.models.import_jobs.table_schema import import_jobs_table
+from app.types import DbImportJob, ImportJobStatus
+
+
+@timed_query
+async def create_import_job(payload: dict[str, Any]) -> DbImportJob:
+    query = (
+        import_jobs_table.insert()
+        .values(status=ImportJobStatus.pending.value, payload=payload)
+        .returning(*import_jobs_table.c)
+    )
+    job = await database.fetch_one(query)
+    assert job is not None
+    return DbImportJob(**job)
+
+
+@timed_query
+async def get_import_job(job_id: int) -> Optional[DbImportJob]:
+    query = sa.select(*[import_jobs_table.c]).where(import_jobs_table.c.id == job_id)
+    job = await database.fetch_one(query)
+    if not job:
+        return None
+    return DbImportJob(**job)
+
+
+@timed_query
+async def get_next_import_job() -> Optional[DbImportJob]:
+    """
+    returns the oldest job which is not finished yet,
+    job could be left running if worker was stopped in the middle of it
+    """
+    query = (
+        sa.select(*[import_jobs_table.c])
+        .where(
+            import_jobs_table.c.status.in_(
+                (ImportJobStatus.pending.value, ImportJobStatus.running.value)
+            )
+        )
+        .order_by(import_jobs_table.c.id)
+        .limit(1)
+    )
+    job = await database.fetch_one(query)
+    if not job:
+        return None
+    return DbImportJob(**job)
+
+
+@timed_query
+async def get_unfinished_import_jobs_ids() -> tuple[Optional[int], Optional[int]]:
+    """
+    the first and the last ids of jobs which are not finished yet, see get_next_import_job
+    """
+    query = sa.select(
+        sa.func.min(import_jobs_table.c.id), sa.func.max(import_jobs_table.c.id)
+    ).where(
+        import_jobs_table.c.status.in_(
+            (ImportJobStatus.pending.value, ImportJobStatus.running.value)
+        )
+    )
+    row = await database.fetch_one(query)
+    assert row is not None
+    return row[0], row[1]
+
+
+@timed_query
+async def start_import_job(job_id: int) -> None:
+    query = (
+        import_jobs_table.update()
+        .where(import_jobs_table.c.id == job_id)
+        .values(status=ImportJobStatus.running.value, started_at=sa.func.now())
+    )
+    await database.execute(query)
+
+
+@timed_query
+async def finish_import_job(
+    job_id: int, status: ImportJobStatus, error: Optional[str] = None
+) -> None:
+    query = (
+        import_jobs_table.update()
+        .where(import_jobs_table.c.id == job_id)
+        .values(status=status.value, error=error, finished_at=sa.func.now())
+    )
+    await database.execute(query)
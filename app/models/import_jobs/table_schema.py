@@ -0,0 +1,22 @@
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.db.base import metadata
+
+import_jobs_table = sa.Table(
+    "import_jobs",
+    metadata,
+    # jobs are applied in order of ids
+    sa.Column("id", sa.BigInteger(), primary_key=True, autoincrement=True),
+    sa.Column("status", sa.String(length=8), nullable=False, index=True),
+    sa.Column("payload", postgresql.JSONB(), nullable=False),
+    sa.Column("error", sa.String(), nullable=True),
+    sa.Column(
+        "created_at",
+        postgresql.TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=sa.func.now(),
+    ),
+    sa.Column("started_at", postgresql.TIMESTAMP(timezone=True), nullable=True),
+    sa.Column("finished_at", postgresql.TIMESTAMP(timezone=True), nullable=True),
+)
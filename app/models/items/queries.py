@@ -1,37 +1,107 @@
 import json
 from datetime import datetime
-from typing import Iterable, Optional
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Collection,
+    Iterable,
+    Optional,
+    Tuple,
+)
 
 import sqlalchemy as sa
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.sql.functions import count
+from sqlalchemy.dialects.postgresql import ARRAY, UUID, Insert, insert
 
+from app.core.cache import nodes_cache
+from app.core.changes import writing_items
+from app.db.backends import (
+    compile_query,
+    execute,
+    fetch_row,
+    fetch_rows,
+    fetch_val,
+    insert_from_arrays,
+    iterate_rows,
+    timed_query,
+)
 from app.db.base import database
-from app.models.items.table_schema import items_table
-from app.types import DbItem, DbItemWithAddInfo, ImportItemToDb
+from app.db.copy import copy_to_temp_table
+from app.models.items.table_schema import (
+    ITEMS_VERSION_SEQUENCE,
+    PATH_SEPARATOR,
+    PATH_UPPER_BOUND,
+    items_table,
+)
+from app.types import (
+    DbItem,
+    DbItemsTreeRow,
+    DbItemVersion,
+    DbItemWithAddInfo,
+    ImportItemToDb,
+    ItemType,
+)
 
+# channel of notifications about committed changes of items, see notify_items_changed
+ITEMS_CHANGES_CHANNEL = "items_changes"
+# payload of notification is limited by 8000 bytes
+ITEM_IDS_PER_NOTIFICATION = 150
+MAX_NOTIFIED_ITEM_IDS = 10_000
 
+# key of postgres advisory lock which serializes changes of items tree
+ITEMS_TREE_LOCK_KEY = 2022_06_01
+
+
+@timed_query
+async def lock_items_tree() -> None:
+    """
+    Take lock of items tree till the end of current transaction.
+    Import reads materialized paths and writes new ones computed from them,
+    so concurrent import must not move ancestors in between.
+    """
+    query = "SELECT pg_advisory_xact_lock(:key);"
+    await execute(query, values={"key": ITEMS_TREE_LOCK_KEY})
+
+
+@timed_query
 async def get_items_tree_with_additional_info(
     start_node_uuid: str,
 ) -> Optional[DbItemWithAddInfo]:
     """
     check example of response in app/examples/db_item_with_add_info.json
     """
-    query = (
-        """
-        WITH RECURSIVE c AS (
-            SELECT *, 0 as lvl
-            FROM   items
-            WHERE  items.id = '%s'
-                UNION ALL
-            SELECT items.*, c.lvl + 1
+    json_tree = await get_items_tree_json(start_node_uuid)
+    if not json_tree or not (_tree := json.loads(json_tree)):
+        return None
+    tree: DbItemWithAddInfo = _tree
+    return tree
+
+
+@timed_query
+async def get_items_tree_json(start_node_uuid: str) -> Optional[str]:
+    """
+    same as get_items_tree_with_additional_info, but tree is not parsed.
+    Id is bound, not formatted into query: text of query is the same for all items,
+    so it's prepared once per connection and then taken from statement cache of asyncpg
+    """
+    query = """
+        WITH RECURSIVE root AS (
+            SELECT path, array_length(string_to_array(path, '.'), 1) AS depth
             FROM   items
-            JOIN   c ON items.parent_id = c.id
+            WHERE  items.id = :start_node_uuid
+        ),
+        c AS (
+            -- start node and all its descendants, see items.path
+            SELECT
+                items.*,
+                array_length(string_to_array(items.path, '.'), 1) - root.depth as lvl
+            FROM   items, root
+            WHERE  items.path >= root.path AND items.path < root.path || '/'
         ),
         maxlvl AS (SELECT max(lvl) maxlvl FROM c),
         j AS (
                 SELECT
-                    c.*, 0 as total_price, 0 as total_offer_count,
+                    c.*,
                     CASE
                         WHEN c.type = 'OFFER' THEN null
                     ELSE
@@ -42,30 +112,9 @@ async def get_items_tree_with_additional_info(
             UNION ALL
                 -- c - current parent
                 -- j - child of parent
+                -- total_price and total_offer_count are stored in items
                 SELECT
                     (c).*,
-                    CASE
-                        WHEN (
-                            select s[1] from array_agg((j).type) -- first child
-                        s) = 'OFFER' THEN
-                            (SELECT SUM(s) FROM UNNEST(array_agg((j).price)) s)::integer
-                        ELSE
-                            (
-                                SELECT SUM(s) FROM UNNEST(array_agg((j).total_price)) s
-                            )::integer
-                    END as total_price,
-
-                    CASE
-                        WHEN (
-                            select s[1] from array_agg((j).type) -- first child
-                        s) = 'OFFER' THEN
-                            (SELECT array_length(array_agg((j).price), 1))::integer
-                        ELSE
-                            (
-                                SELECT SUM(s) FROM UNNEST(array_agg((j).total_offer_count)
-                            ) s)::integer
-                    END as total_offer_count,
-
                     array_to_json(
                         array_agg(j) || array(
                             SELECT r FROM (
@@ -94,15 +143,304 @@ async def get_items_tree_with_additional_info(
         FROM   maxlvl, j
         WHERE  lvl = 0;
     """
-        % start_node_uuid
+    json_tree: Optional[str] = await fetch_val(
+        query, values={"start_node_uuid": start_node_uuid}
     )
-    fetched_data = await database.fetch_all(query)
-    if not fetched_data or not (_tree := json.loads(fetched_data[0].json_tree)):
-        return None
-    tree: DbItemWithAddInfo = _tree
-    return tree
+    return json_tree
+
+
+def _select_items_tree_rows() -> sa.sql.Select:
+    return sa.select(
+        sa.cast(items_table.c.id, sa.Text),
+        sa.cast(items_table.c.parent_id, sa.Text),
+        items_table.c.type,
+        items_table.c.price,
+        items_table.c.name,
+        items_table.c.date,
+        items_table.c.total_price,
+        items_table.c.total_offer_count,
+        items_table.c.version,
+    )
+
+
+def _select_subtree_rows() -> sa.sql.Select:
+    root_path = (
+        sa.select(items_table.c.path)
+        .where(items_table.c.id == sa.bindparam("start_node_uuid"))
+        .scalar_subquery()
+    )
+    return _select_items_tree_rows().where(
+        items_table.c.path >= root_path,
+        items_table.c.path < root_path.concat(PATH_UPPER_BOUND),
+    )
+
+
+# queries built by SQLAlchemy are compiled once, see compile_query
+_item_ids_param = sa.any_(sa.cast(sa.bindparam("item_ids"), ARRAY(UUID())))
+SUBTREE_ROWS_QUERY = compile_query(_select_subtree_rows().order_by(items_table.c.path))
+ALL_ITEMS_TREE_ROWS_QUERY = compile_query(
+    _select_items_tree_rows().order_by(items_table.c.path)
+)
+ITEM_TREE_ROW_QUERY = compile_query(
+    _select_items_tree_rows().where(items_table.c.id == sa.bindparam("item_id"))
+)
+ITEMS_TREE_ROWS_BY_IDS_QUERY = compile_query(
+    _select_items_tree_rows()
+    .where(items_table.c.id == _item_ids_param)
+    .order_by(items_table.c.path)
+)
+ITEM_VERSION_QUERY = compile_query(
+    sa.select(items_table.c.version, items_table.c.date).where(
+        items_table.c.id == sa.bindparam("item_id")
+    )
+)
+ITEM_PATH_QUERY = compile_query(
+    sa.select(items_table.c.path).where(items_table.c.id == sa.bindparam("item_id"))
+)
+ITEM_ID_QUERY = compile_query(
+    sa.select(items_table.c.id).where(items_table.c.id == sa.bindparam("item_id"))
+)
+# columns in order of fields of DbItem
+ITEMS_QUERY = compile_query(
+    sa.select(
+        sa.cast(items_table.c.id, sa.Text),
+        items_table.c.name,
+        items_table.c.type,
+        items_table.c.date,
+        items_table.c.price,
+        sa.cast(items_table.c.parent_id, sa.Text),
+        items_table.c.total_price,
+        items_table.c.total_offer_count,
+        items_table.c.path,
+        items_table.c.version,
+    ).where(items_table.c.id == _item_ids_param)
+)
+ITEM_IDS_QUERY = compile_query(
+    sa.select(sa.cast(items_table.c.id, sa.Text)).where(
+        items_table.c.id == _item_ids_param
+    )
+)
+UPDATE_DATE_QUERY = compile_query(
+    items_table.update()
+    .where(items_table.c.id == _item_ids_param)
+    .values(date=sa.bindparam("new_update_date"))
+)
+
+
+def _select_changed_items_tree_rows(after: bool) -> sa.sql.Select:
+    query = (
+        _select_subtree_rows()
+        .add_columns(items_table.c.path)
+        .where(items_table.c.date > sa.bindparam("since"))
+        .order_by(items_table.c.date, items_table.c.path)
+        .limit(sa.bindparam("limit"))
+    )
+    if after:
+        query = query.where(
+            sa.tuple_(items_table.c.date, items_table.c.path)
+            > sa.tuple_(sa.bindparam("after_date"), sa.bindparam("after_path"))
+        )
+    return query
+
+
+CHANGED_ITEMS_TREE_ROWS_QUERY = compile_query(_select_changed_items_tree_rows(False))
+CHANGED_ITEMS_TREE_ROWS_AFTER_QUERY = compile_query(_select_changed_items_tree_rows(True))
+
+
+def _select_children_tree_rows(after: bool) -> sa.sql.Select:
+    parents = (
+        sa.func.unnest(sa.cast(sa.bindparam("parent_ids"), ARRAY(UUID())))
+        .table_valued("id")
+        .render_derived(name="parent")
+    )
+    children = (
+        _select_items_tree_rows()
+        .where(items_table.c.parent_id == parents.c.id)
+        .order_by(items_table.c.id)
+        # NULL is no limit
+        .limit(sa.bindparam("limit"))
+    )
+    if after:
+        children = children.where(items_table.c.id > sa.bindparam("after_id"))
+    children_lateral = children.lateral("child")
+    return sa.select(children_lateral).select_from(
+        parents.join(children_lateral, sa.true())
+    )
+
+
+CHILDREN_TREE_ROWS_QUERY = compile_query(_select_children_tree_rows(False))
+CHILDREN_TREE_ROWS_AFTER_QUERY = compile_query(_select_children_tree_rows(True))
+
+
+@timed_query
+async def get_items_tree_rows(start_node_uuid: str) -> list[DbItemsTreeRow]:
+    """
+    start node and all its descendants as flat rows, see DbItemsTreeRow.
+    Rows are ordered by path, so every item goes after its parent.
+    """
+    # plain tuples are cheaper to unpack and can be passed to process executor
+    return await fetch_rows(  # type: ignore
+        SUBTREE_ROWS_QUERY, values={"start_node_uuid": start_node_uuid}
+    )
+
+
+@timed_query
+async def get_items_trees_rows(item_ids: list[str]) -> list[DbItemsTreeRow]:
+    """
+    items and all their descendants as flat rows ordered by path, see get_items_tree_rows;
+    items inside subtrees of other items are read once with them
+    """
+    query = """
+    WITH roots AS (
+        SELECT path FROM items WHERE id = ANY(CAST(:item_ids AS uuid[]))
+    ), top_roots AS (
+        SELECT path FROM roots
+        WHERE NOT EXISTS (
+            SELECT 1 FROM roots AS outer_roots
+            WHERE roots.path > outer_roots.path
+                AND roots.path < outer_roots.path || :upper_bound
+        )
+    )
+    SELECT
+        CAST(items.id AS text), CAST(items.parent_id AS text), items.type, items.price,
+        items.name, items.date, items.total_price, items.total_offer_count,
+        items.version
+    FROM top_roots
+    JOIN items
+        ON items.path >= top_roots.path AND items.path < top_roots.path || :upper_bound
+    ORDER BY items.path;
+    """
+    return await fetch_rows(  # type: ignore
+        query, values={"item_ids": item_ids, "upper_bound": PATH_UPPER_BOUND}
+    )
+
+
+@timed_query
+async def get_item_tree_row(item_id: str) -> Optional[DbItemsTreeRow]:
+    return await fetch_row(  # type: ignore
+        ITEM_TREE_ROW_QUERY, values={"item_id": item_id}
+    )
+
+
+@timed_query
+async def get_item_version(item_id: str) -> Optional[DbItemVersion]:
+    return await fetch_row(  # type: ignore
+        ITEM_VERSION_QUERY, values={"item_id": item_id}
+    )
+
+
+@timed_query
+async def set_new_items_version(item_ids: Collection[str]) -> None:
+    """
+    Must be called by every change of items for changed items and all their ancestors,
+    versions are unique across all items and only grow
+    """
+    query = """
+    UPDATE items
+    SET version = nextval(:sequence)
+    WHERE id = ANY(CAST(:item_ids AS uuid[]));
+    """
+    await execute(
+        query, values={"item_ids": list(item_ids), "sequence": ITEMS_VERSION_SEQUENCE}
+    )
+
+
+@timed_query
+async def get_changed_items_tree_rows(
+    start_node_uuid: str,
+    since: datetime,
+    limit: int,
+    after: Optional[tuple[datetime, str]] = None,
+) -> list[tuple[DbItemsTreeRow, str]]:
+    """
+    Start node and its descendants with date later than since ordered by (date, path),
+    at most limit of them going after (date, path) of after. Rows are returned
+    with paths. Index on (date, path) reads only changed items of all tree,
+    index on path reads the whole subtree, the cheaper one is used.
+    """
+    values = {"start_node_uuid": start_node_uuid, "since": since, "limit": limit}
+    query = CHANGED_ITEMS_TREE_ROWS_QUERY
+    if after is not None:
+        values["after_date"], values["after_path"] = after
+        query = CHANGED_ITEMS_TREE_ROWS_AFTER_QUERY
+    rows = []
+    for *tree_row, path in await fetch_rows(query, values=values):
+        rows.append((tuple(tree_row), path))
+    return rows  # type: ignore
+
+
+@timed_query
+async def get_items_tree_rows_by_ids(item_ids: list[str]) -> list[DbItemsTreeRow]:
+    return await fetch_rows(  # type: ignore
+        ITEMS_TREE_ROWS_BY_IDS_QUERY, values={"item_ids": item_ids}
+    )
+
+
+@timed_query
+async def get_children_tree_rows(
+    parent_ids: list[str], limit: Optional[int] = None, after_id: Optional[str] = None
+) -> list[DbItemsTreeRow]:
+    """
+    Children of every item ordered by id, at most limit of them with id above after_id.
+    Children of all items are read by one query, which reads only returned rows
+    by index on (parent_id, id). Rows of one item go together in order of parent_ids.
+    """
+    values: dict[str, Any] = {"parent_ids": parent_ids, "limit": limit}
+    query = CHILDREN_TREE_ROWS_QUERY
+    if after_id is not None:
+        values["after_id"] = after_id
+        query = CHILDREN_TREE_ROWS_AFTER_QUERY
+    return await fetch_rows(query, values=values)  # type: ignore
+
+
+@timed_query
+async def get_items_and_ancestors_tree_rows(
+    item_ids: list[str],
+) -> list[DbItemsTreeRow]:
+    """
+    items and all their ancestors as flat rows ordered by path, see get_items_tree_rows
+    """
+    query = """
+    SELECT
+        CAST(id AS text), CAST(parent_id AS text), type, price, name, date,
+        total_price, total_offer_count, version
+    FROM items
+    WHERE id IN (
+        SELECT CAST(unnest(string_to_array(path, :separator)) AS uuid)
+        FROM items
+        WHERE id = ANY(CAST(:item_ids AS uuid[]))
+    )
+    ORDER BY path;
+    """
+    return await fetch_rows(  # type: ignore
+        query, values={"item_ids": item_ids, "separator": PATH_SEPARATOR}
+    )
+
 
+@timed_query
+async def iterate_items_tree_rows(
+    start_node_uuid: str,
+) -> AsyncGenerator[DbItemsTreeRow, None]:
+    """
+    rows of get_items_tree_rows read by cursor, they are not kept in memory together;
+    connection and transaction are held till iteration is finished
+    """
+    async for row in iterate_rows(
+        SUBTREE_ROWS_QUERY, values={"start_node_uuid": start_node_uuid}
+    ):
+        yield row  # type: ignore
 
+
+@timed_query
+async def iterate_all_items_tree_rows() -> AsyncIterator[DbItemsTreeRow]:
+    """
+    all items ordered by path, see get_items_tree_rows
+    """
+    async for row in iterate_rows(ALL_ITEMS_TREE_ROWS_QUERY):
+        yield row  # type: ignore
+
+
+@timed_query
 async def get_all_children_ids_by_item_id(item_id: str) -> list[str]:
     """
     example or query response:
@@ -118,133 +456,218 @@ async def get_all_children_ids_by_item_id(item_id: str) -> list[str]:
     ]
     or [] if there are no children
     """
-    query = (
-        """
-        WITH RECURSIVE cte AS (
-            SELECT id AS root_id, id, parent_id
-            FROM items
-            WHERE items.id = '%s'
-                UNION ALL
-            SELECT cte.root_id, items.id, items.parent_id
-            FROM items
-            JOIN cte ON items.parent_id = cte.id
-        )
+    query = """
         SELECT
             json_build_object(
-                'chidlren_ids', array_agg(id)
+                'children_ids', array_agg(children.id)
             ) as res
-        FROM cte
-        WHERE id <> root_id
-        GROUP BY root_id
+        FROM items
+        JOIN items children
+            ON children.path > items.path || '.' AND children.path < items.path || '/'
+        WHERE items.id = :item_id
+        GROUP BY items.id
     """
-        % item_id
-    )
-    fetched_data = await database.fetch_all(query)
-    if not fetched_data or not (_res := json.loads(fetched_data[0].res)):
+    fetched_data = await fetch_val(query, values={"item_id": item_id})
+    if not fetched_data or not (_res := json.loads(fetched_data)):
         return []
     res: list[str] = _res["children_ids"]
     return res
 
 
+@timed_query
 async def get_all_parent_ids_by_item_id(item_id: str) -> list[str]:
-    query = (
-        """
-    WITH RECURSIVE cte AS (
-        SELECT id AS root_id, id, parent_id
-        FROM items
-        WHERE items.id = '%s'
-            UNION ALL
-        SELECT cte.root_id, items.id, items.parent_id
-        FROM items
-        JOIN cte ON items.id = cte.parent_id
-    )
-    SELECT
-        json_build_object(
-            'parent_ids', array_agg(id)
-        ) as res
-    FROM cte
-    WHERE id <> root_id
-    GROUP BY root_id;
-    """
-        % item_id
-    )
-
-    fetched_data = await database.fetch_all(query)
-    if not fetched_data or not (_res := json.loads(fetched_data[0].res)):
+    """
+    parents are taken from materialized path, the closest parent goes first
+    """
+    path = await fetch_val(ITEM_PATH_QUERY, values={"item_id": item_id})
+    if not path:
         return []
-    res: list[str] = _res["parent_ids"]
+    res: list[str] = path.split(PATH_SEPARATOR)[-2::-1]
     return res
 
 
+@timed_query
+async def get_deepest_descendant_path(path: str) -> Optional[str]:
+    query = """
+    SELECT path FROM items
+    WHERE path > :path || '.' AND path < :path || '/'
+    ORDER BY length(path) DESC
+    LIMIT 1;
+    """
+    res: Optional[str] = await fetch_val(query, values={"path": path})
+    return res
+
+
+@timed_query
+async def update_descendants_paths(old_path: str, new_path: str) -> None:
+    """
+    Move all descendants of item from old_path to new_path
+    """
+    query = """
+    UPDATE items
+    SET path = :new_path || substr(path, length(:old_path) + 1)
+    WHERE path > :old_path || '.' AND path < :old_path || '/';
+    """
+    await execute(query, values={"old_path": old_path, "new_path": new_path})
+
+
+@timed_query
 async def update_date(item_ids: list[str], new_update_date: datetime) -> None:
-    query = (
-        items_table.update()
-        .where(items_table.c.id.in_(tuple(item_ids)))
-        .values(
-            {
-                "date": new_update_date,
-            }
-        )
+    await execute(
+        UPDATE_DATE_QUERY,
+        values={"item_ids": item_ids, "new_update_date": new_update_date},
     )
-    await database.execute(query)
 
 
-async def cascade_delete_item_by_id(item_id: str) -> None:
-    query = items_table.delete().where(items_table.c.id == item_id)
-    await database.execute(query)
+@timed_query
+async def add_to_aggregates(deltas: dict[str, Tuple[int, int]]) -> None:
+    """
+    Add signed changes to stored total_price and total_offer_count of items,
+    deltas are {item_id: (total_price delta, total_offer_count delta)}.
 
+    Rows are locked in order of ids, so concurrent imports don't deadlock
+    on common ancestors, and every change is added to the latest committed value.
+    """
+    deltas = {item_id: delta for item_id, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
 
-async def check_if_item_exists(item_id: str) -> bool:
-    query = sa.select([items_table.c.id]).where(items_table.c.id == item_id)
-    res = await database.fetch_one(query)
-    return bool(res)
+    item_ids = sorted(deltas)
+    lock_query = """
+    SELECT id FROM items WHERE id = ANY(:item_ids) ORDER BY id FOR UPDATE;
+    """
+    await fetch_rows(lock_query, values={"item_ids": item_ids})
 
+    update_query = """
+    UPDATE items
+    SET
+        total_price = items.total_price + delta.total_price,
+        total_offer_count = items.total_offer_count + delta.total_offer_count
+    FROM unnest(
+        CAST(:item_ids AS uuid[]),
+        CAST(:total_prices AS bigint[]),
+        CAST(:total_offer_counts AS bigint[])
+    ) AS delta(id, total_price, total_offer_count)
+    WHERE items.id = delta.id;
+    """
+    await execute(
+        update_query,
+        values={
+            "item_ids": item_ids,
+            "total_prices": [deltas[item_id][0] for item_id in item_ids],
+            "total_offer_counts": [deltas[item_id][1] for item_id in item_ids],
+        },
+    )
 
-async def get_items(item_ids: list[str]) -> list[DbItem]:
-    query = sa.select(*[items_table.c]).where(items_table.c.id.in_(tuple(item_ids)))
-    fetched_data = await database.fetch_all(query)
-    if not fetched_data:
-        return []
-    return [DbItem(**item) for item in fetched_data]
 
+@timed_query
+async def notify_items_changed(item_ids: Collection[str]) -> None:
+    """
+    Notify listeners of ITEMS_CHANGES_CHANNEL about changed items,
+    see ItemsChangesListener. Postgres delivers notifications only after
+    commit of current transaction, so listeners never see uncommitted changes.
 
-async def count_elements_with_ids(item_ids: list[str]) -> int:
-    query = sa.select([count(items_table.c.id)]).where(
-        items_table.c.id.in_(tuple(item_ids))
-    )
-    fetched_data = await database.fetch_one(query)
-    if not fetched_data:
-        return 0
-    res: int = fetched_data[0]
-    return res
+    Payload of notification is limited, so ids are sent by parts;
+    too many ids are replaced by one notification that everything is changed.
+    """
+    if len(item_ids) > MAX_NOTIFIED_ITEM_IDS:
+        payloads = [json.dumps({"ids": None})]
+    else:
+        ids = list(item_ids)
+        payloads = [
+            json.dumps({"ids": ids[i : i + ITEM_IDS_PER_NOTIFICATION]})
+            for i in range(0, len(ids), ITEM_IDS_PER_NOTIFICATION)
+        ]
+    query = """
+    SELECT pg_notify(:channel, payload)
+    FROM unnest(CAST(:payloads AS text[])) AS payload;
+    """
+    await execute(query, values={"channel": ITEMS_CHANGES_CHANNEL, "payloads": payloads})
 
 
-async def get_items_by_ids_and_type(item_ids: list[str], item_type: str) -> list[DbItem]:
-    query = sa.select(*[items_table.c]).where(
-        sa.and_(
-            *[
-                items_table.c.id.in_(tuple(item_ids)),
-                items_table.c.type == item_type,
-            ]
+def _delete_subtree() -> sa.sql.Delete:
+    root_path = (
+        sa.select(items_table.c.path)
+        .where(items_table.c.id == sa.bindparam("item_id"))
+        .scalar_subquery()
+    )
+    # subtree is deleted by path, so ids of all deleted items are returned
+    return (
+        items_table.delete()
+        .where(
+            items_table.c.path >= root_path,
+            items_table.c.path < root_path.concat(PATH_UPPER_BOUND),
+        )
+        .returning(
+            sa.cast(items_table.c.id, sa.Text),
+            items_table.c.path,
+            items_table.c.total_price,
+            items_table.c.total_offer_count,
         )
     )
-    fetched_data = await database.fetch_all(query)
-    if not fetched_data:
-        return []
-    return [DbItem(**item) for item in fetched_data]
 
 
+DELETE_SUBTREE_QUERY = compile_query(_delete_subtree())
+
+
+@timed_query
+async def cascade_delete_item_by_id(item_id: str) -> None:
+    async with writing_items():
+        async with database.transaction():
+            await lock_items_tree()
+            deleted_rows = await fetch_rows(
+                DELETE_SUBTREE_QUERY, values={"item_id": item_id}
+            )
+            deleted = next((row for row in deleted_rows if row[0] == item_id), None)
+            if deleted:
+                _, path, total_price, total_offer_count = deleted
+                ancestor_ids = path.split(PATH_SEPARATOR)[:-1]
+                # whole subtree is deleted, its totals are taken out of ancestors
+                await add_to_aggregates(
+                    {
+                        ancestor_id: (-total_price, -total_offer_count)
+                        for ancestor_id in ancestor_ids
+                    }
+                )
+                await set_new_items_version(ancestor_ids)
+                changed_ids = [*ancestor_ids, *(row[0] for row in deleted_rows)]
+                nodes_cache.invalidate(changed_ids)
+                await notify_items_changed(changed_ids)
+
+
+@timed_query
+async def check_if_item_exists(item_id: str) -> bool:
+    res = await fetch_val(ITEM_ID_QUERY, values={"item_id": item_id})
+    return res is not None
+
+
+@timed_query
+async def get_items(item_ids: list[str]) -> list[DbItem]:
+    fetched_data = await fetch_rows(ITEMS_QUERY, values={"item_ids": item_ids})
+    return [DbItem(*row) for row in fetched_data]
+
+
+@timed_query
 async def filter_ids_in_db(item_ids: Iterable[str]) -> list[str]:
-    query = sa.select([items_table.c.id]).where(items_table.c.id.in_(tuple(item_ids)))
-    fetched_data = await database.fetch_all(query)
-    if not fetched_data:
-        return []
-    return [str(row.id) for row in fetched_data]
+    fetched_data = await fetch_rows(ITEM_IDS_QUERY, values={"item_ids": list(item_ids)})
+    return [row[0] for row in fetched_data]
+
 
+def _on_conflict_update_items(stmt: Insert, only_changed: bool) -> Insert:
+    """
+    With only_changed rows equal to stored ones are not rewritten,
+    so they don't produce new row versions and index entries.
+    Only written rows are returned.
+    """
+    where = None
+    if only_changed:
+        where = sa.tuple_(
+            items_table.c.name, items_table.c.price, items_table.c.parent_id
+        ).is_distinct_from(
+            sa.tuple_(stmt.excluded.name, stmt.excluded.price, stmt.excluded.parent_id)
+        )
 
-async def upsert_items(items: list[ImportItemToDb]) -> None:
-    stmt = insert(items_table)
-    query = stmt.on_conflict_do_update(
+    return stmt.on_conflict_do_update(
         constraint="items_pkey",
         # The columns that should be updated on conflict
         set_={
@@ -253,6 +676,81 @@ async def upsert_items(items: list[ImportItemToDb]) -> None:
             "price": stmt.excluded.price,
             "parent_id": stmt.excluded.parent_id,
             "date": stmt.excluded.date,
+            "path": stmt.excluded.path,
+            # totals of categories are kept, changes are added after upsert
+            "total_price": sa.case(
+                (stmt.excluded.type == ItemType.offer.value, stmt.excluded.total_price),
+                else_=items_table.c.total_price,
+            ),
+            "total_offer_count": sa.case(
+                (
+                    stmt.excluded.type == ItemType.offer.value,
+                    stmt.excluded.total_offer_count,
+                ),
+                else_=items_table.c.total_offer_count,
+            ),
         },
+        where=where,
+    ).returning(
+        items_table.c.id,
+        # row is inserted if it has no previous version
+        sa.literal_column("xmax = 0").label("is_inserted"),
+    )
+
+
+IMPORT_ITEM_COLUMNS = list(ImportItemToDb.__annotations__)
+# {only_changed: query}
+UPSERT_ITEMS_QUERIES = {
+    only_changed: compile_query(
+        _on_conflict_update_items(
+            insert_from_arrays(items_table, IMPORT_ITEM_COLUMNS),
+            only_changed=only_changed,
+        )
+    )
+    for only_changed in (False, True)
+}
+
+
+@timed_query
+async def upsert_items(
+    items: list[ImportItemToDb], only_changed: bool
+) -> dict[str, bool]:
+    """
+    Returns {item_id: is_inserted} of written items.
+    All items are written by one statement: foreign key of parent_id
+    is checked at the end of statement, so order of items doesn't matter.
+    """
+    if not items:
+        return {}
+    values = {
+        column: [item[column] for item in items]  # type: ignore
+        for column in IMPORT_ITEM_COLUMNS
+    }
+    rows = await fetch_rows(UPSERT_ITEMS_QUERIES[only_changed], values=values)
+    return {str(item_id): is_inserted for item_id, is_inserted in rows}
+
+
+@timed_query
+async def bulk_upsert_items(
+    items: list[ImportItemToDb], only_changed: bool
+) -> dict[str, bool]:
+    """
+    Same as upsert_items, but for big batches:
+    rows are streamed to temporary table via COPY
+    and merged into items with one statement.
+    Must be called inside transaction.
+    """
+    staging_table = await copy_to_temp_table(
+        table_name="items_staging",
+        like_table_name=items_table.name,
+        columns=IMPORT_ITEM_COLUMNS,
+        records=(
+            [item[column] for column in IMPORT_ITEM_COLUMNS]  # type: ignore
+            for item in items
+        ),
+    )
+    query = _on_conflict_update_items(
+        insert(items_table).from_select(IMPORT_ITEM_COLUMNS, sa.select(staging_table)),
+        only_changed=only_changed,
     )
-    await database.execute_many(query=query, values=items)
+    return {str(row.id): row.is_inserted for row in await database.fetch_all(query)}
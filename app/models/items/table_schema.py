@@ -3,17 +3,43 @@ from sqlalchemy.dialects import postgresql
 
 from app.db.base import metadata
 
+# materialized path is ids of all ancestors and item itself joined by separator,
+# so descendants of item are between "<path>." and "<path>/" ("/" follows "."),
+# that's why path is compared bytewise with "C" collation
+PATH_SEPARATOR = "."
+PATH_UPPER_BOUND = "/"
+# path is 37 bytes per level and btree entry of its indexes is limited by 2704 bytes,
+# so deeper items are rejected by import, see ImportItemsManager._check_depth
+MAX_PATH_DEPTH = 64
+ITEMS_VERSION_SEQUENCE = "items_version_seq"
+
 items_table = sa.Table(
     "items",
     metadata,
     sa.Column("id", postgresql.UUID(), primary_key=True, index=True, nullable=False),
     sa.Column("name", sa.String(), nullable=False),
     sa.Column("price", sa.BigInteger(), nullable=True),
-    sa.Column("parent_id", postgresql.UUID(), nullable=True, index=True),
+    sa.Column("parent_id", postgresql.UUID(), nullable=True),
     sa.Column("type", sa.String(length=8), nullable=False),
     sa.Column("date", postgresql.TIMESTAMP(timezone=True), nullable=False),
+    # aggregates over all offers of item subtree, offer has its own price and 1
+    sa.Column("total_price", sa.BigInteger(), nullable=False, server_default="0"),
+    sa.Column("total_offer_count", sa.BigInteger(), nullable=False, server_default="0"),
+    sa.Column("path", sa.String(collation="C"), nullable=False, index=True),
+    # changed with every change of item subtree, see set_new_items_version,
+    # so it's version of the whole subtree
+    sa.Column(
+        "version",
+        sa.BigInteger(),
+        nullable=False,
+        server_default=sa.text(f"nextval('{ITEMS_VERSION_SEQUENCE}')"),
+    ),
     sa.CheckConstraint("price >= 0 or price is null", name="items_price_check_gte_0"),
     sa.UniqueConstraint("id", "parent_id", name="id_parent_id_uix"),
+    # children of item ordered by id, see get_children_tree_rows
+    sa.Index("ix_items_parent_id_id", "parent_id", "id"),
+    # items of subtree changed since date, see get_changed_items_tree_rows
+    sa.Index("ix_items_date_path", "date", "path"),
     sa.ForeignKeyConstraint(
         ["parent_id"],
         ["items.id"],
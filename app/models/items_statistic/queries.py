@@ -1,27 +1,34 @@
 import json
 import uuid
 from datetime import datetime, timedelta
+from typing import Optional
 
+import sqlalchemy as sa
 from sqlalchemy.dialects.postgresql import insert
 
+from app.db.backends import (
+    compile_query,
+    execute,
+    fetch_row,
+    fetch_val,
+    insert_from_arrays,
+    timed_query,
+)
 from app.db.base import database
+from app.db.copy import copy_to_temp_table
+from app.db.routing import get_database
 from app.models.items_statistic.table_schema import items_statistic_table
 from app.schemas import ImportItem, StatsItem, StatsItems
 from app.types import ImportStatsItemToDb
 
 
+@timed_query
 async def get_offer_stats_for_n_hours_and_date(
     date: datetime, n_hours: int = 24
 ) -> StatsItems:
     """
     stats for [date - n_hours, date]
     """
-    date_fmt = "%Y-%m-%d %H:%M:%S"
-
-    date_n_hours_ago = date - timedelta(hours=n_hours)
-    date_left = date_n_hours_ago.strftime(date_fmt)
-    date_right = date.strftime(date_fmt)
-
     query = """
     SELECT
         json_build_object(
@@ -37,33 +44,105 @@ async def get_offer_stats_for_n_hours_and_date(
         ) as res
     FROM items_statistic stats
     LEFT JOIN items on stats.id = items.id
-    WHERE stats.date >= '%s' AND stats.date <= '%s'
-    """ % (
-        date_left,
-        date_right,
-    )
-    fetched_data = await database.fetch_all(query)
+    WHERE stats.date >= :date_left AND stats.date <= :date_right
+    """
+    # window is of whole seconds
+    date_right = date.replace(microsecond=0)
+    date_left = date_right - timedelta(hours=n_hours)
+    async with get_database().transaction():
+        # query is prepared once per connection, but its generic plan expects few stats
+        # in the window and joins them with items by nested loop: it's slower than hash
+        # join when the window has most of them, so plan is built for every window
+        await execute("SET LOCAL plan_cache_mode = force_custom_plan")
+        fetched_data = await fetch_val(
+            query, values={"date_left": date_left, "date_right": date_right}
+        )
     if not fetched_data:
         return StatsItems(items=[])
 
-    _res = json.loads(fetched_data[0]["res"])
+    _res = json.loads(fetched_data)
     res: StatsItems = StatsItems.parse_obj(_res)
     return res
 
 
-async def save_import_item_to_statistic(item: ImportItem, date: datetime) -> None:
-    stmt = insert(items_statistic_table)
-    query = stmt.on_conflict_do_nothing(index_elements=["id", "parent_id", "date"])
+@timed_query
+async def get_offer_stats_version(
+    date: datetime, n_hours: int = 24
+) -> tuple[str, Optional[datetime]]:
+    """
+    Version of stats of get_offer_stats_for_n_hours_and_date and date of the latest
+    statistic in the window. Stats are changed only by import, which saves new
+    statistic and changes versions of written items, and by delete, which deletes
+    statistic: so count of statistic and the latest version of its items change too.
+    """
+    query = """
+    SELECT
+        count(*) AS count,
+        coalesce(max(items.version), 0) AS version,
+        max(stats.date) AS date
+    FROM items_statistic stats
+    LEFT JOIN items on stats.id = items.id
+    WHERE stats.date >= :date_left AND stats.date <= :date_right
+    """
+    # the same bounds as in get_offer_stats_for_n_hours_and_date
+    date_right = date.replace(microsecond=0)
+    date_left = date_right - timedelta(hours=n_hours)
+    row = await fetch_row(
+        query, values={"date_left": date_left, "date_right": date_right}
+    )
+    assert row is not None
+    count, version, stats_date = row
+    return f"{count}-{version}", stats_date
 
+
+STATS_ITEM_COLUMNS = list(ImportStatsItemToDb.__annotations__)
+SAVE_STATS_ITEMS_QUERY = compile_query(
+    insert_from_arrays(items_statistic_table, STATS_ITEM_COLUMNS).on_conflict_do_nothing(
+        index_elements=["id", "parent_id", "date"]
+    )
+)
+
+
+@timed_query
+async def save_import_item_to_statistic(item: ImportItem, date: datetime) -> None:
     values = dict(date=date, parent_id=item.parentId, **item.dict())
     values.pop("parentId")
-    values["stat_id"] = uuid.uuid4()
+    values["stat_id"] = str(uuid.uuid4())
 
-    await database.execute(query, values=values)
+    await save_import_items_to_statistic(items=[values])  # type: ignore
 
 
+@timed_query
 async def save_import_items_to_statistic(items: list[ImportStatsItemToDb]) -> None:
-    stmt = insert(items_statistic_table)
-    query = stmt.on_conflict_do_nothing(index_elements=["id", "parent_id", "date"])
+    """
+    all items are saved by one query, see insert_from_arrays
+    """
+    if not items:
+        return
+    values = {
+        column: [item[column] for item in items]  # type: ignore
+        for column in STATS_ITEM_COLUMNS
+    }
+    await execute(SAVE_STATS_ITEMS_QUERY, values=values)
+
 
-    await database.execute_many(query=query, values=items)
+@timed_query
+async def bulk_save_import_items_to_statistic(items: list[ImportStatsItemToDb]) -> None:
+    """
+    Same as save_import_items_to_statistic, but rows are streamed
+    via COPY and inserted with one statement. Must be called inside transaction.
+    """
+    staging_table = await copy_to_temp_table(
+        table_name="items_statistic_staging",
+        like_table_name=items_statistic_table.name,
+        columns=STATS_ITEM_COLUMNS,
+        records=(
+            [item[column] for column in STATS_ITEM_COLUMNS]  # type: ignore
+            for item in items
+        ),
+    )
+    stmt = insert(items_statistic_table).from_select(
+        STATS_ITEM_COLUMNS, sa.select(staging_table)
+    )
+    query = stmt.on_conflict_do_nothing(index_elements=["id", "parent_id", "date"])
+    await database.execute(query)
@@ -6,7 +6,7 @@ from uuid import UUID
 from fastapi import HTTPException
 from pydantic import BaseModel, root_validator, validator
 
-from app.types import ItemType
+from app.types import ImportJobStatus, ItemType
 
 
 @dataclass
@@ -45,7 +45,7 @@ class ImportItem(BaseModel):
         if parent_id and id == parent_id:
             raise ValueError(f"id can't be equal to parentId: {id}, {parent_id}")
 
-    @root_validator
+    @root_validator(skip_on_failure=True)
     def validate_item(
         cls, values: dict[str, Union[UUID, str, ItemType, int, None]]
     ) -> dict[str, Union[UUID, str, ItemType, int, None]]:
@@ -74,6 +74,32 @@ class ImportItemsIn(BaseModel):
         return items
 
 
+class ImportOut(BaseModel):
+    inserted: int
+    updated: int
+    unchanged: int
+
+
+class ImportChunkOut(BaseModel):
+    chunk: int
+    imported: int
+    deferred: int
+
+
+class StreamImportOut(BaseModel):
+    imported: int
+    chunks: list[ImportChunkOut]
+
+
+class ImportJobOut(BaseModel):
+    id: int
+    status: ImportJobStatus
+    error: Optional[str] = None
+    createdAt: datetime
+    startedAt: Optional[datetime] = None
+    finishedAt: Optional[datetime] = None
+
+
 class SaleStatsDateIn(BaseModel):
     date: str
 
@@ -98,3 +124,44 @@ class StatsItem(BaseModel):
 
 class StatsItems(BaseModel):
     items: list[StatsItem]
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    items: int
+    bytes: int
+
+
+class SharedCacheStats(BaseModel):
+    hits: int
+    misses: int
+
+
+class CachesStats(BaseModel):
+    nodes: CacheStats
+    shared: Optional[SharedCacheStats] = None
+
+
+class HistogramStats(BaseModel):
+    # cumulative counts by upper bounds of buckets
+    buckets: dict[str, int]
+    count: int
+    sum: float
+
+
+class PoolStats(BaseModel):
+    size: int
+    idle: int
+    in_use: int
+    limit: int
+    waiting: int
+    timeouts: int
+    # seconds
+    acquire_wait: HistogramStats
+    checkout: HistogramStats
+
+
+class PoolsStats(BaseModel):
+    database: Optional[PoolStats] = None
+    read_database: Optional[PoolStats] = None
@@ -3,7 +3,7 @@ from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import Optional, TypedDict
+from typing import Any, Optional, TypedDict
 
 
 class ItemType(str, Enum):
@@ -11,6 +11,13 @@ class ItemType(str, Enum):
     category = "CATEGORY"
 
 
+class ImportJobStatus(str, Enum):
+    pending = "PENDING"
+    running = "RUNNING"
+    done = "DONE"
+    failed = "FAILED"
+
+
 class DbItemWithAddInfo(TypedDict):
     id: str
     date: str
@@ -37,6 +44,25 @@ class ItemsOut(TypedDict):
     children: Optional[list["ItemsOut"]]  # type: ignore
 
 
+class NodesBatchEntryOut(TypedDict):
+    id: str
+    # null if item is not found, error tells it
+    node: Optional[ItemsOut]
+    error: Optional[str]
+
+
+class ItemsChangesOut(TypedDict):
+    # changed items and their ancestors without children
+    items: list[ItemsOut]
+    ancestors: list[ItemsOut]
+    nextCursor: Optional[str]
+
+
+class PagedItemsOut(ItemsOut, total=False):
+    # id of the last child, the next page of children goes after it
+    childrenCursor: str
+
+
 @dataclass
 class DbItem:
     id: str
@@ -45,6 +71,18 @@ class DbItem:
     date: str
     price: Optional[int] = None
     parent_id: Optional[str] = None
+    total_price: int = 0
+    total_offer_count: int = 0
+    path: str = ""
+    version: int = 0
+
+
+# id, parent_id, type, price, name, date, total_price, total_offer_count, version
+DbItemsTreeRow = tuple[
+    str, Optional[str], str, Optional[int], str, datetime, int, int, int
+]
+# version, date
+DbItemVersion = tuple[int, datetime]
 
 
 class ImportItemToDb(TypedDict):
@@ -54,6 +92,9 @@ class ImportItemToDb(TypedDict):
     type: str
     parent_id: Optional[str]
     price: Optional[int]
+    total_price: int
+    total_offer_count: int
+    path: str
 
 
 class ImportStatsItemToDb(TypedDict):
@@ -64,3 +105,14 @@ class ImportStatsItemToDb(TypedDict):
     parent_id: Optional[str]
     type: str
     date: datetime
+
+
+@dataclass
+class DbImportJob:
+    id: int
+    status: ImportJobStatus
+    payload: dict[str, Any]
+    error: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
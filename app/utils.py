@@ -1,5 +1,8 @@
+from typing import AsyncIterator
 from uuid import UUID
 
+from app.errors import LineTooLong
+
 
 def is_valid_uuid(uuid_to_test: str, version: int = 4) -> bool:
     """
@@ -20,3 +23,30 @@ def is_valid_uuid(uuid_to_test: str, version: int = 4) -> bool:
     except ValueError:
         return False
     return str(uuid_obj) == uuid_to_test
+
+
+async def iter_lines(
+    chunks: AsyncIterator[bytes], max_line_size: int
+) -> AsyncIterator[bytes]:
+    """
+    Split stream of bytes into lines without reading the whole stream.
+    Only new bytes are searched for line ends, so a long line isn't rescanned
+    with every chunk, and lines longer than max_line_size bytes raise LineTooLong
+    instead of being buffered whole.
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        start = 0
+        scan_from = len(buffer)
+        buffer += chunk
+        while (end := buffer.find(b"\n", scan_from)) != -1:
+            if end - start > max_line_size:
+                raise LineTooLong(max_line_size=max_line_size)
+            yield bytes(buffer[start:end])
+            start = scan_from = end + 1
+        del buffer[:start]
+        if len(buffer) > max_line_size:
+            raise LineTooLong(max_line_size=max_line_size)
+
+    if buffer:
+        yield bytes(buffer)
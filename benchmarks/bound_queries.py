@@ -0,0 +1,198 @@
+"""
+Time of raw SQL queries with values formatted into text and bound as parameters.
+
+    PYTHONPATH=. python benchmarks/bound_queries.py [repeats]
+
+Formatted query has new text for every value: postgres parses and plans it every
+time and asyncpg prepares it with an extra round trip. Bound query is prepared
+once per connection and taken from statement cache of asyncpg, postgres can switch
+it to generic plan after 5 executions.
+Planning time is taken from EXPLAIN ANALYZE of formatted query and of EXECUTE
+of prepared statement, on one connection. get_offer_stats_for_n_hours_and_date
+forces custom plan for every window, so only parsing and round trip are saved for it.
+
+Tree is root with 500 categories of 10 offers: values are more than the statement
+cache of asyncpg keeps (100), so formatted queries are never reused.
+Uses database from DATABASE_URL, created items are deleted at the end.
+"""
+import asyncio
+import json
+import re
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+from httpx import AsyncClient
+
+from app.db.base import database
+from app.db.events import close_db_connection, connect_to_db
+from app.models.items.queries import get_all_children_ids_by_item_id, get_items_tree_json
+from app.models.items_statistic.queries import get_offer_stats_for_n_hours_and_date
+from benchmarks.nodes_engines import UPDATE_DATE, _category, _offers
+from main import app
+
+CATEGORIES = 500
+# statistic of every window has all 5000 offers, so it's slow to call for every category
+STATS_WINDOWS = 200
+# executions of prepared statement before the generic plan is considered
+CUSTOM_PLANS = 5
+PARAMETER = re.compile(r"(?<!:):(\w+)")
+
+Query = tuple[str, dict[str, Any]]
+Calls = tuple[Callable[..., Awaitable[Any]], list[Any]]
+
+
+@contextmanager
+def _patched_fetch_all(
+    wrapper: Callable[
+        [Callable[..., Awaitable[Any]], str, dict[str, Any]], Awaitable[Any]
+    ]
+) -> Iterator[None]:
+    fetch_all = database.fetch_all
+
+    async def patched_fetch_all(
+        query: str, values: Optional[dict[str, Any]] = None
+    ) -> Any:
+        return await wrapper(fetch_all, query, values or {})
+
+    database.fetch_all = patched_fetch_all
+    try:
+        yield
+    finally:
+        del database.fetch_all
+
+
+async def _get_query(func: Callable[..., Awaitable[Any]], arg: Any) -> Query:
+    """
+    query and values which func sends to database
+    """
+    queries: list[Query] = []
+
+    async def recording(
+        fetch_all: Callable[..., Awaitable[Any]], query: str, values: dict[str, Any]
+    ) -> Any:
+        queries.append((query, values))
+        return await fetch_all(query, values)
+
+    with _patched_fetch_all(recording):
+        await func(arg)
+    return queries[0]
+
+
+def _format(query: str, values: dict[str, Any]) -> str:
+    return PARAMETER.sub(lambda match: f"'{values[match[1]]}'", query)
+
+
+async def _planning_time(raw_connection: Any, query: str) -> float:
+    plan = await raw_connection.fetchval(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+    planning_time: float = json.loads(plan)[0]["Planning Time"]
+    return planning_time
+
+
+async def _get_planning_times(queries: list[Query]) -> tuple[float, float]:
+    """
+    average planning time of formatted and of prepared query, ms
+    """
+    query, values = queries[0]
+    names = list(values)
+    numbered = PARAMETER.sub(lambda match: f"${names.index(match[1]) + 1}", query)
+
+    def _execute(values: dict[str, Any]) -> str:
+        return "EXECUTE bench_query({})".format(
+            ", ".join(f"'{values[name]}'" for name in names)
+        )
+
+    async with database.connection() as connection:
+        raw_connection = connection.raw_connection
+        formatted = [
+            await _planning_time(raw_connection, _format(query, values))
+            for query, values in queries
+        ]
+        await raw_connection.execute(f"PREPARE bench_query AS {numbered}")
+        try:
+            for _, values in queries[:CUSTOM_PLANS]:
+                await raw_connection.execute(_execute(values))
+            prepared = [
+                await _planning_time(raw_connection, _execute(values))
+                for _, values in queries
+            ]
+        finally:
+            await raw_connection.execute("DEALLOCATE bench_query")
+    return sum(formatted) / len(formatted), sum(prepared) / len(prepared)
+
+
+async def _get_time(
+    func: Callable[..., Awaitable[Any]], args: list[Any], repeats: int, formatted: bool
+) -> float:
+    """
+    average time of queries of call, ms: parsing of results by func is left out
+    """
+    total = 0.0
+
+    async def timing(
+        fetch_all: Callable[..., Awaitable[Any]], query: str, values: dict[str, Any]
+    ) -> Any:
+        nonlocal total
+        start = time.perf_counter()
+        try:
+            if formatted:
+                return await fetch_all(_format(query, values))
+            return await fetch_all(query, values)
+        finally:
+            total += time.perf_counter() - start
+
+    with _patched_fetch_all(timing):
+        for _ in range(repeats):
+            for arg in args:
+                await func(arg)
+    return total / (repeats * len(args)) * 1000
+
+
+async def main(repeats: int) -> None:
+    await connect_to_db()
+
+    async with AsyncClient(app=app, base_url="http://bench", timeout=600) as http_cli:
+        root = _category(None)
+        categories = [_category(root["id"]) for _ in range(CATEGORIES)]
+        items = [root]
+        for category in categories:
+            items += [category, *_offers(category["id"], 10)]
+        resp = await http_cli.post(
+            "/imports", json={"items": items, "updateDate": UPDATE_DATE}
+        )
+        assert resp.status_code == 200, resp.text
+
+        stats_date = datetime(2022, 2, 1, 12, tzinfo=timezone.utc)
+        category_ids = [category["id"] for category in categories]
+        benchmarks: dict[str, Calls] = {
+            "get_items_tree_json": (get_items_tree_json, category_ids),
+            "get_all_children_ids_by_item_id": (
+                get_all_children_ids_by_item_id,
+                category_ids,
+            ),
+            "get_offer_stats_for_n_hours_and_date": (
+                get_offer_stats_for_n_hours_and_date,
+                [stats_date + timedelta(seconds=i) for i in range(STATS_WINDOWS)],
+            ),
+        }
+        for name, (func, args) in benchmarks.items():
+            queries = [await _get_query(func, arg) for arg in args]
+            formatted_planning, prepared_planning = await _get_planning_times(queries)
+            formatted_time = await _get_time(func, args, repeats, formatted=True)
+            bound_time = await _get_time(func, args, repeats, formatted=False)
+            print(
+                f"{name}:\n"
+                f"    planning  formatted {formatted_planning:6.3f}ms, "
+                f"prepared {prepared_planning:6.3f}ms\n"
+                f"    query     formatted {formatted_time:6.3f}ms, "
+                f"bound    {bound_time:6.3f}ms"
+            )
+
+        await http_cli.delete(f"/delete/{root['id']}")
+    await close_db_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(repeats=int(sys.argv[1]) if len(sys.argv) > 1 else 3))
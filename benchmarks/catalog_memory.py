@@ -0,0 +1,61 @@
+"""
+Memory taken by ItemsCatalog per item.
+
+    PYTHONPATH=. python benchmarks/catalog_memory.py [items]
+
+Catalog is filled with synthetic rows without database:
+categories of 100 offers with names of 20 chars and dates of 10 imports.
+"""
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from app.api.items.catalog import ItemsCatalog
+from app.types import DbItemsTreeRow, ItemType
+
+OFFERS_PER_CATEGORY = 100
+NAME_LENGTH = 20
+
+
+def _get_rows(count: int) -> list[DbItemsTreeRow]:
+    dates = [
+        datetime(2022, 2, 1, tzinfo=timezone.utc) + timedelta(days=i) for i in range(10)
+    ]
+    rows: list[DbItemsTreeRow] = []
+    category_id = None
+    for i in range(count):
+        item_id = str(uuid.uuid4())
+        name = f"{i:0{NAME_LENGTH}}"
+        date = dates[i % len(dates)]
+        if i % (OFFERS_PER_CATEGORY + 1) == 0:
+            rows.append(
+                (item_id, None, ItemType.category.value, None, name, date, 0, 0, i)
+            )
+            category_id = item_id
+        else:
+            rows.append(
+                (item_id, category_id, ItemType.offer.value, i, name, date, i, 1, i)
+            )
+    return rows
+
+
+def main(count: int) -> None:
+    rows = _get_rows(count)
+    tracemalloc.start()
+    catalog = ItemsCatalog(max_items=count)
+    for row in rows:
+        catalog._upsert(row)
+    # ids and names are shared with rows, but catalog keeps them alive alone
+    size, _ = tracemalloc.get_traced_memory()
+    strings_size = sum(sys.getsizeof(row[0]) + sys.getsizeof(row[4]) for row in rows)
+    tracemalloc.stop()
+
+    per_item = (size + strings_size) / count
+    print(
+        f"{len(catalog)} items: {per_item:.0f} bytes/item, {per_item:.0f} MB per million"
+    )
+
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
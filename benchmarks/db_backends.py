@@ -0,0 +1,110 @@
+"""
+Time of query functions for every backend of db_backend setting, see fetch_rows.
+
+    PYTHONPATH=. python benchmarks/db_backends.py [repeats]
+
+Tree is root with 100 categories of 100 offers. Queries are the same for both
+backends, so difference is overhead of sending query and decoding its rows.
+Upsert rewrites offers of category equal to stored ones, so nothing is written.
+Uses database from DATABASE_URL, created items are deleted at the end.
+"""
+import asyncio
+import sys
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable
+
+from httpx import AsyncClient
+
+from app.core.config import get_app_settings
+from app.core.settings.api import DbBackends
+from app.db.events import close_db_connection, connect_to_db
+from app.models.items.queries import (
+    check_if_item_exists,
+    get_children_tree_rows,
+    get_item_tree_row,
+    get_item_version,
+    get_items,
+    get_items_tree_rows,
+    upsert_items,
+)
+from app.types import ImportItemToDb
+from benchmarks.nodes_engines import UPDATE_DATE, _category, _offers
+from main import app
+
+
+async def _get_time(call: Callable[[], Awaitable[Any]], repeats: int) -> float:
+    """
+    average time of call, ms
+    """
+    await call()  # statements are prepared by the first call
+    start = time.perf_counter()
+    for _ in range(repeats):
+        await call()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+async def main(repeats: int) -> None:
+    await connect_to_db()
+    settings = get_app_settings()
+
+    async with AsyncClient(app=app, base_url="http://bench", timeout=600) as http_cli:
+        root = _category(None)
+        items = [root]
+        for _ in range(100):
+            category = _category(root["id"])
+            items += [category, *_offers(category["id"], 100)]
+        resp = await http_cli.post(
+            "/imports", json={"items": items, "updateDate": UPDATE_DATE}
+        )
+        assert resp.status_code == 200, resp.text
+
+        category_id = items[1]["id"]
+        offers = [
+            ImportItemToDb(
+                id=item.id,
+                date=item.date,  # type: ignore
+                name=item.name,
+                type=item.type,
+                parent_id=item.parent_id,
+                price=item.price,
+                total_price=item.total_price,
+                total_offer_count=item.total_offer_count,
+                path=item.path,
+            )
+            for item in await get_items([item["id"] for item in items[2:102]])
+        ]
+        calls: dict[str, Callable[[], Awaitable[Any]]] = {
+            "check_if_item_exists": partial(check_if_item_exists, category_id),
+            "get_item_version": partial(get_item_version, category_id),
+            "get_item_tree_row": partial(get_item_tree_row, category_id),
+            "get_children_tree_rows, 10 rows": partial(
+                get_children_tree_rows, [category_id], limit=10
+            ),
+            "get_items_tree_rows, 101 rows": partial(get_items_tree_rows, category_id),
+            f"get_items_tree_rows, {len(items)} rows": partial(
+                get_items_tree_rows, root["id"]
+            ),
+            "upsert_items, 100 unchanged rows": partial(
+                upsert_items, offers, only_changed=True
+            ),
+        }
+
+        db_backend = settings.db_backend
+        print(f"{'':35} " + " ".join(f"{backend.value:>10}" for backend in DbBackends))
+        try:
+            for name, call in calls.items():
+                times = []
+                for backend in DbBackends:
+                    settings.db_backend = backend
+                    times.append(await _get_time(call, repeats))
+                print(f"{name:35} " + " ".join(f"{t:8.3f}ms" for t in times))
+        finally:
+            settings.db_backend = db_backend
+
+        await http_cli.delete(f"/delete/{root['id']}")
+    await close_db_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(repeats=int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,98 @@
+"""
+Time of /nodes response for every engine, see NodesEngines.
+
+    PYTHONPATH=. python benchmarks/nodes_engines.py [repeats]
+
+wide: root with 100 categories of 200 offers each
+deep: chain of 60 categories with 100 offers at every level
+Uses database from DATABASE_URL, created items are deleted at the end.
+"""
+import asyncio
+import sys
+import time
+import uuid
+from typing import Any
+
+from httpx import AsyncClient
+
+from app.core.config import get_app_settings
+from app.core.settings.api import NodesEngines
+from app.db.events import close_db_connection, connect_to_db
+from main import app
+
+UPDATE_DATE = "2022-02-01T12:00:00.000Z"
+
+
+def _category(parent_id: "str | None") -> dict[str, Any]:
+    return {
+        "type": "CATEGORY",
+        "name": "c",
+        "id": str(uuid.uuid4()),
+        "parentId": parent_id,
+    }
+
+
+def _offers(parent_id: str, count: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "type": "OFFER",
+            "name": "o",
+            "id": str(uuid.uuid4()),
+            "parentId": parent_id,
+            "price": i,
+        }
+        for i in range(count)
+    ]
+
+
+def _get_wide_tree() -> list[dict[str, Any]]:
+    root = _category(None)
+    items = [root]
+    for _ in range(100):
+        category = _category(root["id"])
+        items += [category, *_offers(category["id"], 200)]
+    return items
+
+
+def _get_deep_tree() -> list[dict[str, Any]]:
+    # length of materialized path is limited by size of btree index entry
+    items = [_category(None)]
+    for _ in range(59):
+        items.append(_category(items[-1]["id"]))
+    categories = list(items)
+    for category in categories:
+        items += _offers(category["id"], 100)
+    return items
+
+
+async def main(repeats: int) -> None:
+    await connect_to_db()
+    settings = get_app_settings()
+    # tree is built in place to measure engine itself
+    settings.cpu_executor_min_tree_bytes = settings.cpu_executor_min_tree_items = 1 << 62
+
+    async with AsyncClient(app=app, base_url="http://bench", timeout=600) as http_cli:
+        for tree_name, items in (("wide", _get_wide_tree()), ("deep", _get_deep_tree())):
+            root_id = items[0]["id"]
+            resp = await http_cli.post(
+                "/imports", json={"items": items, "updateDate": UPDATE_DATE}
+            )
+            assert resp.status_code == 200, resp.text
+
+            for engine in NodesEngines:
+                settings.nodes_engine = engine
+                await http_cli.get(f"/nodes/{root_id}")  # warm up
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    resp = await http_cli.get(f"/nodes/{root_id}")
+                    assert resp.status_code == 200
+                avg = (time.perf_counter() - start) / repeats * 1000
+                name = f"{tree_name} ({len(items)} items), {engine.value:>6}"
+                print(f"{name}: {avg:8.1f}ms")
+
+            await http_cli.delete(f"/delete/{root_id}")
+    await close_db_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(repeats=int(sys.argv[1]) if len(sys.argv) > 1 else 10))
@@ -0,0 +1,114 @@
+"""
+Latency of /nodes while big import is running, for every type of cpu executor.
+
+    PYTHONPATH=. python benchmarks/nodes_latency_under_import.py [import_items]
+
+Requests are sent to the app in the same process and event loop, so time which
+import spends on event loop is added to latency of /nodes directly.
+Uses database from DATABASE_URL, created items are deleted at the end.
+"""
+import asyncio
+import contextvars
+import json
+import statistics
+import sys
+import time
+import uuid
+from typing import Any
+
+from httpx import AsyncClient
+
+from app.core.config import get_app_settings
+from app.core.executor import cpu_executor_close, cpu_executor_init
+from app.core.settings.api import ExecutorTypes
+from app.db.events import close_db_connection, connect_to_db
+from main import app
+
+UPDATE_DATE = "2022-02-01T12:00:00.000Z"
+
+
+def _get_import_body(offers_count: int) -> tuple[str, bytes]:
+    root_id = str(uuid.uuid4())
+    items: list[dict[str, Any]] = [
+        {"type": "CATEGORY", "name": "root", "id": root_id, "parentId": None}
+    ]
+    items += [
+        {
+            "type": "OFFER",
+            "name": f"offer {i}",
+            "id": str(uuid.uuid4()),
+            "parentId": root_id,
+            "price": i,
+        }
+        for i in range(offers_count)
+    ]
+    return root_id, json.dumps({"items": items, "updateDate": UPDATE_DATE}).encode()
+
+
+async def _measure(http_cli: AsyncClient, nodes_id: str, import_items: int) -> None:
+    big_root_id, big_body = _get_import_body(import_items)
+    latencies: list[float] = []
+    is_importing = True
+
+    async def get_nodes() -> None:
+        while is_importing:
+            start = time.perf_counter()
+            resp = await http_cli.get(f"/nodes/{nodes_id}")
+            assert resp.status_code == 200
+            latencies.append(time.perf_counter() - start)
+
+    # like requests of real server, every task gets its own database connection
+    readers = [
+        contextvars.Context().run(asyncio.create_task, get_nodes()) for _ in range(4)
+    ]
+    start = time.perf_counter()
+    resp = await http_cli.post(
+        "/imports", content=big_body, headers={"Content-Type": "application/json"}
+    )
+    import_time = time.perf_counter() - start
+    is_importing = False
+    await asyncio.gather(*readers)
+    assert resp.status_code == 200, resp.text
+    await http_cli.delete(f"/delete/{big_root_id}")
+
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{get_app_settings().cpu_executor_type.value:>8}: import {import_time:6.2f}s, "
+        f"/nodes requests {len(latencies):5}, p50 {p50 * 1000:7.1f}ms, "
+        f"p99 {p99 * 1000:7.1f}ms, max {latencies[-1] * 1000:7.1f}ms"
+    )
+
+
+async def main(import_items: int) -> None:
+    await connect_to_db()
+    settings = get_app_settings()
+    settings.cpu_executor_min_import_items = 1000
+    settings.cpu_executor_min_tree_bytes = 100_000
+
+    async with AsyncClient(app=app, base_url="http://bench", timeout=600) as http_cli:
+        # tree of 1000 offers, big enough to be parsed in executor
+        nodes_id, body = _get_import_body(1000)
+        resp = await http_cli.post(
+            "/imports", content=body, headers={"Content-Type": "application/json"}
+        )
+        assert resp.status_code == 200, resp.text
+
+        for executor_type in ExecutorTypes:
+            settings.cpu_executor_type = executor_type
+            await cpu_executor_init(
+                executor_type=executor_type,
+                workers_count=settings.cpu_executor_workers_count,
+            )
+            try:
+                await _measure(http_cli, nodes_id, import_items)
+            finally:
+                await cpu_executor_close()
+
+        await http_cli.delete(f"/delete/{nodes_id}")
+    await close_db_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(import_items=int(sys.argv[1]) if len(sys.argv) > 1 else 50_000))
@@ -0,0 +1,97 @@
+"""
+Peak memory of app while /nodes of root is sent, for python and stream engines.
+
+    PYTHONPATH=. python benchmarks/nodes_memory.py [offers per category...]
+
+Trees are root with 100 categories of given number of offers.
+App is called directly and chunks of response are dropped, so only memory of app
+is measured: ASGI transport of httpx would keep the whole body.
+Uses database from DATABASE_URL, created items are deleted at the end.
+"""
+import asyncio
+import sys
+import tracemalloc
+from typing import Any
+
+from httpx import AsyncClient
+
+from app.core.config import get_app_settings
+from app.core.settings.api import NodesEngines
+from app.db.events import close_db_connection, connect_to_db
+from benchmarks.nodes_engines import UPDATE_DATE, _category, _offers
+from main import app
+
+
+async def _get_body_size(path: str) -> int:
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "server": ("bench", 80),
+        "client": ("bench", 1),
+    }
+    size = 0
+    requested = False
+
+    async def receive() -> dict[str, Any]:
+        nonlocal requested
+        if requested:
+            # client stays connected till response is sent
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict[str, Any]) -> None:
+        nonlocal size
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return size
+
+
+async def main(offers_counts: list[int]) -> None:
+    await connect_to_db()
+    settings = get_app_settings()
+    settings.cpu_executor_min_tree_bytes = settings.cpu_executor_min_tree_items = 1 << 62
+
+    async with AsyncClient(app=app, base_url="http://bench", timeout=600) as http_cli:
+        for offers_count in offers_counts:
+            root = _category(None)
+            items = [root]
+            for _ in range(100):
+                category = _category(root["id"])
+                items += [category, *_offers(category["id"], offers_count)]
+            for i in range(0, len(items), 10_000):
+                resp = await http_cli.post(
+                    "/imports",
+                    json={"items": items[i : i + 10_000], "updateDate": UPDATE_DATE},
+                )
+                assert resp.status_code == 200, resp.text
+            del items
+
+            for engine in (NodesEngines.python, NodesEngines.stream):
+                settings.nodes_engine = engine
+                tracemalloc.start()
+                size = await _get_body_size(f"/nodes/{root['id']}")
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(
+                    f"{offers_count * 100 + 101} items, {size >> 20} MB of JSON, "
+                    f"{engine.value:>6}: peak {peak / (1 << 20):8.1f} MB"
+                )
+
+            await http_cli.delete(f"/delete/{root['id']}")
+    await close_db_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(arg) for arg in sys.argv[1:]] or [100, 1000]))
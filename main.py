@@ -5,6 +5,7 @@ from app.api.descriptions import API_description
 from app.api.routes import api_router, statistic_api_router
 from app.core.config import get_app_settings
 from app.core.events import create_start_app_handler, create_stop_app_handler
+from app.core.metrics import MetricsMiddleware
 
 
 def get_application() -> FastAPI:
@@ -21,6 +22,8 @@ def get_application() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    # added last, so it's the outermost and measures other middlewares too
+    application.add_middleware(MetricsMiddleware)
 
     application.add_event_handler(
         "startup",
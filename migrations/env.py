@@ -6,6 +6,7 @@ from alembic import context
 from sqlalchemy import engine_from_config, pool
 
 from app.db.base import metadata
+from app.models.import_jobs.table_schema import import_jobs_table
 from app.models.items.table_schema import items_table
 from app.models.items_statistic.table_schema import items_statistic_table
 
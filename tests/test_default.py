@@ -12,6 +12,9 @@ import pytest
 from fastapi import FastAPI
 from httpx import AsyncClient
 
+from app.core.config import get_app_settings
+from app.core.settings.api import DbBackends
+
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -257,8 +260,60 @@ async def test_default_tests(app: FastAPI):
     async with AsyncClient(app=app, base_url="http://test", timeout=60) as http_cli:
         await _test_import(http_cli)
         await asyncio.sleep(0.5)
-        # await _test_nodes(http_cli)
-        # await asyncio.sleep(0.5)
-        # await _test_sales(http_cli)
-        # await asyncio.sleep(0.5)
+        await _test_nodes(http_cli)
+        await asyncio.sleep(0.5)
+        await _test_sales(http_cli)
+        await asyncio.sleep(0.5)
+        await _test_delete(http_cli)
+
+
+@pytest.mark.asyncio
+async def test_default_tests_with_asyncpg_backend(app: FastAPI):
+    settings = get_app_settings()
+    db_backend = settings.db_backend
+    settings.db_backend = DbBackends.asyncpg
+    try:
+        async with AsyncClient(app=app, base_url="http://test", timeout=60) as http_cli:
+            await _test_import(http_cli)
+            await _test_nodes(http_cli)
+            await _test_sales(http_cli)
+            await _test_delete(http_cli)
+    finally:
+        settings.db_backend = db_backend
+
+
+@pytest.mark.asyncio
+async def test_metrics_of_default_tests(app: FastAPI):
+    async with AsyncClient(app=app, base_url="http://test", timeout=60) as http_cli:
+        await _test_import(http_cli)
+        await _test_nodes(http_cli)
+        await _test_sales(http_cli)
         await _test_delete(http_cli)
+
+        resp = await http_cli.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    samples = {}
+    for line in resp.text.splitlines():
+        if not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            samples[sample] = float(value)
+
+    nodes = 'method="GET",route="/nodes/{id}"'
+    assert samples[f"http_request_duration_seconds_count{{{nodes}}}"] >= 2
+    assert (
+        samples[f'http_request_duration_seconds_bucket{{{nodes},le="+Inf"}}']
+        == samples[f"http_request_duration_seconds_count{{{nodes}}}"]
+    )
+    assert samples[f'http_responses_total{{{nodes},status="404"}}'] >= 1
+    assert samples[f"http_response_bytes_total{{{nodes}}}"] > 0
+    imports = 'method="POST",route="/imports"'
+    assert samples[f"http_request_bytes_total{{{imports}}}"] > 0
+    # the request of metrics itself
+    assert samples["http_requests_in_flight"] == 1
+
+    assert samples['db_query_duration_seconds_count{function="get_item_version"}'] >= 2
+    assert samples['db_query_rows_total{function="get_item_version"}'] >= 1
+    assert samples['db_query_rows_total{function="upsert_items"}'] > 1
+    assert samples['db_pool_size{pool="database"}'] >= 1
@@ -0,0 +1,647 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.api.items.jobs import import_jobs_workers_start, import_jobs_workers_stop
+from app.core.config import get_app_settings
+from app.core.executor import cpu_executor_close, cpu_executor_init
+from app.core.settings.api import ExecutorTypes
+from app.db.pool import IMPORTS_GROUP, monitored_pools
+from app.models.items.table_schema import MAX_PATH_DEPTH
+
+
+def _category(item_id: str, parent_id: "str | None") -> dict:
+    return {"type": "CATEGORY", "name": item_id, "id": item_id, "parentId": parent_id}
+
+
+def _offer(item_id: str, parent_id: "str | None", price: int) -> dict:
+    return {
+        "type": "OFFER",
+        "name": item_id,
+        "id": item_id,
+        "parentId": parent_id,
+        "price": price,
+    }
+
+
+def _children(node: dict) -> dict:
+    return {child["id"]: child for child in node["children"]}
+
+
+def _sort_children(node: dict) -> dict:
+    if node["children"]:
+        node["children"] = sorted(
+            (_sort_children(child) for child in node["children"]),
+            key=lambda child: child["id"],
+        )
+    return node
+
+
+@pytest.mark.asyncio
+async def test_import_deep_batch_in_reverse_order(app: FastAPI):
+    ids = [str(uuid.uuid4()) for _ in range(20)]
+    items = [
+        _category(item_id, ids[i - 1] if i else None) for i, item_id in enumerate(ids)
+    ]
+    offer_id = str(uuid.uuid4())
+    items.append(
+        {
+            "type": "OFFER",
+            "name": "offer",
+            "id": offer_id,
+            "parentId": ids[-1],
+            "price": 10,
+        }
+    )
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports",
+            json={"items": items[::-1], "updateDate": "2022-02-01T12:00:00.000Z"},
+        )
+        assert resp.status_code == 200, resp.text
+
+        resp = await http_cli.get(f"/nodes/{ids[0]}")
+        assert resp.status_code == 200
+        node = resp.json()
+        for item_id in ids:
+            assert node["id"] == item_id
+            assert node["price"] == 10
+            node = node["children"][0]
+        assert node["id"] == offer_id
+
+        resp = await http_cli.delete(f"/delete/{ids[0]}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_import_moves_subtrees(app: FastAPI):
+    a, b, c, d, f, g = (str(uuid.uuid4()) for _ in range(6))
+    o1, o2, o3, o4 = (str(uuid.uuid4()) for _ in range(4))
+    # a -> b -> c -> f, d is empty
+    items = [
+        _category(a, None),
+        _category(b, a),
+        _category(c, b),
+        _category(f, c),
+        _category(g, b),
+        _category(d, None),
+        _offer(o1, c, 100),
+        _offer(o2, b, 200),
+        _offer(o3, f, 300),
+        _offer(o4, g, 400),
+    ]
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports", json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"}
+        )
+        assert resp.status_code == 200, resp.text
+
+        # b with its subtree goes to d, while c goes out of b back to a
+        resp = await http_cli.post(
+            "/imports",
+            json={
+                "items": [_category(c, a), _category(b, d)],
+                "updateDate": "2022-02-02T12:00:00.000Z",
+            },
+        )
+        assert resp.status_code == 200, resp.text
+
+        resp = await http_cli.get(f"/nodes/{a}")
+        assert resp.status_code == 200
+        node_a = resp.json()
+        assert node_a["price"] == (100 + 300) // 2
+        assert set(_children(node_a)) == {c}
+        node_c = _children(node_a)[c]
+        assert node_c["price"] == (100 + 300) // 2
+        assert set(_children(node_c)) == {f, o1}
+        assert _children(_children(node_c)[f])[o3]["price"] == 300
+
+        resp = await http_cli.get(f"/nodes/{d}")
+        assert resp.status_code == 200
+        node_d = resp.json()
+        assert node_d["price"] == (200 + 400) // 2
+        assert set(_children(node_d)) == {b}
+
+        resp = await http_cli.get(f"/nodes/{b}")
+        assert resp.status_code == 200
+        node_b = resp.json()
+        assert node_b["price"] == (200 + 400) // 2
+        assert set(_children(node_b)) == {g, o2}
+        assert _children(node_b)[g]["price"] == 400
+
+        for item_id in (a, d):
+            resp = await http_cli.delete(f"/delete/{item_id}")
+            assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_import_with_offer_as_parent_is_rejected(app: FastAPI):
+    offer_id = str(uuid.uuid4())
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        # parent offer is in the same batch
+        resp = await http_cli.post(
+            "/imports",
+            json={
+                "items": [
+                    _offer(offer_id, None, 1),
+                    _category(str(uuid.uuid4()), offer_id),
+                ],
+                "updateDate": "2022-02-01T12:00:00.000Z",
+            },
+        )
+        assert resp.status_code == 400
+
+
+async def _import_and_get_nodes_and_sales(http_cli: AsyncClient) -> list:
+    """
+    imports the same tree with new ids, re-imports part of it
+    and returns /nodes and /sales with ids replaced by their positions
+    """
+    ids = [str(uuid.uuid4()) for _ in range(5)]
+    root, cat, o1, o2, o3 = ids
+    batches = [
+        [
+            _category(root, None),
+            _category(cat, root),
+            _offer(o1, cat, 100),
+            _offer(o2, root, 50),
+        ],
+        # conflicts with items from the first batch
+        [
+            {**_category(cat, root), "name": "renamed"},
+            _offer(o1, cat, 300),
+            _offer(o2, cat, 50),
+            _offer(o3, root, 7),
+        ],
+    ]
+    dates = ["2029-12-25T12:00:00.000Z", "2030-01-02T12:00:00.000Z"]
+    for items, date in zip(batches, dates):
+        resp = await http_cli.post("/imports", json={"items": items, "updateDate": date})
+        assert resp.status_code == 200, resp.text
+
+    resp = await http_cli.get(f"/nodes/{root}")
+    assert resp.status_code == 200
+    nodes = resp.json()
+    resp = await http_cli.get("/sales", params={"date": dates[1]})
+    assert resp.status_code == 200
+    sales = [item for item in resp.json()["items"] if item["id"] in ids]
+
+    resp = await http_cli.delete(f"/delete/{root}")
+    assert resp.status_code == 200
+
+    res = json.dumps([nodes, sales])
+    for i, item_id in enumerate(ids):
+        res = res.replace(item_id, str(i))
+    nodes, sales = json.loads(res)
+    return [_sort_children(nodes), sorted(sales, key=lambda item: item["id"])]
+
+
+@pytest.mark.asyncio
+async def test_bulk_import_is_same_as_regular(app: FastAPI):
+    settings = get_app_settings()
+    bulk_import_min_items = settings.bulk_import_min_items
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        regular = await _import_and_get_nodes_and_sales(http_cli)
+        settings.bulk_import_min_items = 1
+        try:
+            bulk = await _import_and_get_nodes_and_sales(http_cli)
+        finally:
+            settings.bulk_import_min_items = bulk_import_min_items
+
+    assert regular[0]["price"] == (300 + 50 + 7) // 3
+    assert len(regular[1]) == 3
+    assert bulk == regular
+
+
+@pytest.mark.asyncio
+async def test_unchanged_items_are_skipped(app: FastAPI):
+    root_id, o1, o2 = (str(uuid.uuid4()) for _ in range(3))
+    items = [_category(root_id, None), _offer(o1, root_id, 10), _offer(o2, root_id, 20)]
+    settings = get_app_settings()
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports", json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"}
+        )
+        assert resp.json() == {"inserted": 3, "updated": 0, "unchanged": 0}
+
+        settings.skip_unchanged_items = True
+        try:
+            resp = await http_cli.post(
+                "/imports",
+                json={"items": items, "updateDate": "2022-02-02T12:00:00.000Z"},
+            )
+            assert resp.json() == {"inserted": 0, "updated": 0, "unchanged": 3}
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["date"] == "2022-02-01T12:00:00.000Z"
+
+            items[1] = _offer(o1, root_id, 30)
+            resp = await http_cli.post(
+                "/imports",
+                json={"items": items, "updateDate": "2022-02-03T12:00:00.000Z"},
+            )
+            assert resp.json() == {"inserted": 0, "updated": 1, "unchanged": 2}
+        finally:
+            settings.skip_unchanged_items = False
+
+        resp = await http_cli.get(f"/nodes/{root_id}")
+        node = resp.json()
+        # date of root follows changed offer
+        assert node["date"] == "2022-02-03T12:00:00.000Z"
+        assert node["price"] == (30 + 20) // 2
+        assert _children(node)[o2]["date"] == "2022-02-01T12:00:00.000Z"
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_import_and_nodes_in_process_executor(app: FastAPI):
+    root_id, offer_id = str(uuid.uuid4()), str(uuid.uuid4())
+    items = [_category(root_id, None), _offer(offer_id, root_id, 10)]
+    settings = get_app_settings()
+    min_sizes = (
+        settings.cpu_executor_min_import_items,
+        settings.cpu_executor_min_tree_bytes,
+    )
+
+    await cpu_executor_init(executor_type=ExecutorTypes.process, workers_count=1)
+    settings.cpu_executor_min_import_items = settings.cpu_executor_min_tree_bytes = 0
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as http_cli:
+            resp = await http_cli.post(
+                "/imports",
+                json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"},
+            )
+            assert resp.status_code == 200, resp.text
+
+            resp = await http_cli.post(
+                "/imports",
+                json={
+                    "items": [{**items[1], "price": -1}],
+                    "updateDate": "2022-02-01T12:00:00.000Z",
+                },
+            )
+            assert resp.status_code == 400, resp.text
+
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.status_code == 200
+            assert resp.json()["price"] == 10
+            assert resp.json()["children"][0]["id"] == offer_id
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+    finally:
+        (
+            settings.cpu_executor_min_import_items,
+            settings.cpu_executor_min_tree_bytes,
+        ) = min_sizes
+        await cpu_executor_close()
+
+
+@pytest.mark.asyncio
+async def test_import_with_cycle_is_rejected(app: FastAPI):
+    root_id, child_id = str(uuid.uuid4()), str(uuid.uuid4())
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports",
+            json={
+                "items": [_category(root_id, None), _category(child_id, root_id)],
+                "updateDate": "2022-02-01T12:00:00.000Z",
+            },
+        )
+        assert resp.status_code == 200, resp.text
+
+        # root is moved under its own child
+        resp = await http_cli.post(
+            "/imports",
+            json={
+                "items": [_category(root_id, child_id)],
+                "updateDate": "2022-02-02T12:00:00.000Z",
+            },
+        )
+        assert resp.status_code == 400
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_stream_import_defers_items_until_parent_is_imported(app: FastAPI):
+    root_id, child_id = str(uuid.uuid4()), str(uuid.uuid4())
+    offer_ids = [str(uuid.uuid4()) for _ in range(2)]
+    items = [
+        _category(child_id, root_id),
+        _offer(offer_ids[0], child_id, 3),
+        _category(root_id, None),
+        _offer(offer_ids[1], child_id, 3),
+    ]
+    body = "\n".join(json.dumps(item) for item in items)
+    params = {"updateDate": "2022-02-01T12:00:00.000Z", "chunkSize": 2}
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports/stream", params=params, content=body.encode()
+        )
+        assert resp.status_code == 200, resp.text
+        assert resp.json()["imported"] == len(items)
+        assert [chunk["deferred"] for chunk in resp.json()["chunks"]] == [2, 0]
+
+        resp = await http_cli.get(f"/nodes/{root_id}")
+        assert resp.status_code == 200
+        assert resp.json()["price"] == 3
+        assert len(resp.json()["children"][0]["children"]) == len(offer_ids)
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
+
+        # root goes last, so more than chunkSize items wait for it
+        items.insert(2, _offer(str(uuid.uuid4()), child_id, 3))
+        body = "\n".join(json.dumps(item) for item in items[:3] + items[4:] + items[3:4])
+        resp = await http_cli.post(
+            "/imports/stream", params=params, content=body.encode()
+        )
+        assert resp.status_code == 400, resp.text
+        assert resp.json()["detail"]["imported"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_import_error_reports_committed_chunks(app: FastAPI):
+    root_id = str(uuid.uuid4())
+    lines = [json.dumps(_category(root_id, None)), json.dumps({"name": "no id"})]
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports/stream",
+            params={"updateDate": "2022-02-01T12:00:00.000Z", "chunkSize": 1},
+            content="\n".join(lines).encode(),
+        )
+        assert resp.status_code == 400, resp.text
+        detail = resp.json()["detail"]
+        assert "line 2" in detail["message"]
+        assert detail["imported"] == 1
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_stream_import_rejects_too_long_line(app: FastAPI, monkeypatch):
+    root_id = str(uuid.uuid4())
+    line = json.dumps(_category(root_id, None))
+    monkeypatch.setattr(get_app_settings(), "stream_import_max_line_size", len(line))
+
+    async def chunks(body: bytes, size: int):
+        for start in range(0, len(body), size):
+            yield body[start : start + size]
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        params = {"updateDate": "2022-02-01T12:00:00.000Z", "chunkSize": 1}
+        # line is split between chunks, the longest allowed line is imported
+        resp = await http_cli.post(
+            "/imports/stream",
+            params=params,
+            content=chunks(f"\n{line}\n\n".encode(), 7),
+        )
+        assert resp.status_code == 200, resp.text
+        assert resp.json()["imported"] == 1
+
+        # line without end is rejected once it's longer than limit
+        resp = await http_cli.post(
+            "/imports/stream",
+            params=params,
+            content=chunks(f"{line}\n{line} ".encode() + b" " * 10**6, 1000),
+        )
+        assert resp.status_code == 400, resp.text
+        detail = resp.json()["detail"]
+        assert detail["message"] == f"Line is longer than {len(line)} bytes, line 2"
+        assert detail["imported"] == 1
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_import_rejects_too_deep_tree(app: FastAPI):
+    chain_ids = [str(uuid.uuid4()) for _ in range(MAX_PATH_DEPTH)]
+    moved_id, moved_child_id = str(uuid.uuid4()), str(uuid.uuid4())
+    update_date = "2022-02-01T12:00:00.000Z"
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        # the deepest allowed path fits into indexes of items
+        resp = await http_cli.post(
+            "/imports",
+            json={
+                "items": [
+                    _category(item_id, parent_id)
+                    for item_id, parent_id in zip(chain_ids, [None, *chain_ids])
+                ],
+                "updateDate": update_date,
+            },
+        )
+        assert resp.status_code == 200, resp.text
+
+        resp = await http_cli.post(
+            "/imports",
+            json={
+                "items": [_offer(str(uuid.uuid4()), chain_ids[-1], 100)],
+                "updateDate": update_date,
+            },
+        )
+        assert resp.status_code == 400, resp.text
+        assert f"limited to {MAX_PATH_DEPTH} levels" in resp.json()["detail"]
+
+        # moved category takes its children deeper
+        resp = await http_cli.post(
+            "/imports",
+            json={
+                "items": [_category(moved_id, None), _category(moved_child_id, moved_id)],
+                "updateDate": update_date,
+            },
+        )
+        assert resp.status_code == 200, resp.text
+        resp = await http_cli.post(
+            "/imports",
+            json={"items": [_category(moved_id, chain_ids[-2])], "updateDate": update_date},
+        )
+        assert resp.status_code == 400, resp.text
+        assert moved_child_id in resp.json()["detail"]
+
+        resp = await http_cli.get(f"/nodes/{moved_id}")
+        assert resp.json()["parentId"] is None
+        for item_id in (chain_ids[0], moved_id):
+            resp = await http_cli.delete(f"/delete/{item_id}")
+            assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_async_imports_are_applied_in_submission_order(app: FastAPI):
+    root_id, child_id = str(uuid.uuid4()), str(uuid.uuid4())
+    batches = [
+        [_category(root_id, None)],
+        # depends on previous job
+        [_category(child_id, root_id)],
+        # parent doesn't exist
+        [_category(str(uuid.uuid4()), str(uuid.uuid4()))],
+    ]
+
+    await import_jobs_workers_start(workers_count=2, poll_interval=0.05)
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as http_cli:
+            job_ids = []
+            for items in batches:
+                resp = await http_cli.post(
+                    "/imports",
+                    params={"async": "true"},
+                    json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"},
+                )
+                assert resp.status_code == 202, resp.text
+                job_ids.append(resp.json()["id"])
+
+            statuses = []
+            for job_id in job_ids:
+                for _ in range(100):
+                    resp = await http_cli.get(f"/imports/{job_id}")
+                    assert resp.status_code == 200
+                    if resp.json()["status"] in ("DONE", "FAILED"):
+                        break
+                    await asyncio.sleep(0.05)
+                statuses.append(resp.json()["status"])
+            assert statuses == ["DONE", "DONE", "FAILED"]
+            assert resp.json()["error"]
+
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["children"][0]["id"] == child_id
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+    finally:
+        await import_jobs_workers_stop()
+
+
+@pytest.mark.asyncio
+async def test_sync_import_is_applied_after_queued_jobs(app: FastAPI, monkeypatch):
+    root_id, child_id, offer_id = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    monkeypatch.setattr(get_app_settings(), "import_jobs_wait_timeout", 0.2)
+    monkeypatch.setattr(get_app_settings(), "import_jobs_poll_interval", 0.05)
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports",
+            params={"async": "true"},
+            json={
+                "items": [_category(root_id, None)],
+                "updateDate": "2022-02-01T12:00:00.000Z",
+            },
+        )
+        assert resp.status_code == 202, resp.text
+        job_id = resp.json()["id"]
+        child_import = {
+            "items": [_category(child_id, root_id)],
+            "updateDate": "2022-02-02T12:00:00.000Z",
+        }
+
+        # there are no workers, synchronous import doesn't apply the job itself
+        resp = await http_cli.post("/imports", json=child_import)
+        assert resp.status_code == 503, resp.text
+        resp = await http_cli.get(f"/imports/{job_id}")
+        assert resp.json()["status"] == "PENDING"
+
+        await import_jobs_workers_start(workers_count=1, poll_interval=0.05)
+        try:
+            resp = await http_cli.post("/imports", json=child_import)
+            assert resp.status_code == 200, resp.text
+            resp = await http_cli.get(f"/imports/{job_id}")
+            assert resp.json()["status"] == "DONE"
+
+            # failed synchronous import doesn't undo job applied before it
+            resp = await http_cli.post(
+                "/imports",
+                params={"async": "true"},
+                json={
+                    "items": [_offer(offer_id, child_id, 100)],
+                    "updateDate": "2022-02-03T12:00:00.000Z",
+                },
+            )
+            assert resp.status_code == 202, resp.text
+            job_id = resp.json()["id"]
+            resp = await http_cli.post(
+                "/imports",
+                json={
+                    "items": [_category(str(uuid.uuid4()), str(uuid.uuid4()))],
+                    "updateDate": "2022-02-04T12:00:00.000Z",
+                },
+            )
+            assert resp.status_code == 400, resp.text
+            resp = await http_cli.get(f"/imports/{job_id}")
+            assert resp.json()["status"] == "DONE"
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["price"] == 100
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+        finally:
+            await import_jobs_workers_stop()
+
+
+@pytest.mark.asyncio
+async def test_imports_connections_cap_leaves_pool_to_nodes(app: FastAPI):
+    pool = monitored_pools["database"]
+    imports_gate = pool.groups_gates[IMPORTS_GROUP]
+    root_id = str(uuid.uuid4())
+    import_body = {
+        "items": [_category(root_id, None)],
+        "updateDate": "2022-02-01T12:00:00.000Z",
+    }
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        # connections of imports are taken by others
+        for _ in range(imports_gate.limit):
+            await imports_gate.acquire(timeout=1)
+        try:
+            importing = asyncio.create_task(http_cli.post("/imports", json=import_body))
+            await asyncio.sleep(0.1)
+            assert not importing.done()
+            assert imports_gate.waiting == 1
+
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.status_code == 404
+        finally:
+            for _ in range(imports_gate.limit):
+                imports_gate.release()
+        resp = await importing
+        assert resp.status_code == 200, resp.text
+
+        resp = await http_cli.get("/db/pool/stats")
+        assert resp.status_code == 200, resp.text
+        stats = resp.json()["database"]
+        assert stats["in_use"] == 0
+        assert stats["acquire_wait"]["buckets"]["+Inf"] == stats["acquire_wait"]["count"]
+        assert stats["acquire_wait"]["sum"] >= 0.1
+
+        # import fails when connection isn't given in time
+        acquire_timeout = pool.acquire_timeout
+        pool.acquire_timeout = 0.1
+        for _ in range(imports_gate.limit):
+            await imports_gate.acquire(timeout=1)
+        try:
+            resp = await http_cli.post("/imports", json=import_body)
+            assert resp.status_code == 503
+        finally:
+            pool.acquire_timeout = acquire_timeout
+            for _ in range(imports_gate.limit):
+                imports_gate.release()
+        resp = await http_cli.get("/db/pool/stats")
+        assert resp.json()["database"]["timeouts"] == stats["timeouts"] + 1
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
@@ -0,0 +1,648 @@
+import asyncio
+import uuid
+from typing import Callable, Optional
+
+import pytest
+from alembic.command import upgrade
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.api.items.catalog import (
+    get_items_catalog,
+    items_catalog_apply_changes,
+    items_catalog_close,
+    items_catalog_init,
+)
+from app.api.items.handlers import StreamedSQLItems
+from app.core.cache import nodes_cache, nodes_cache_close, nodes_cache_init
+from app.core.config import get_app_settings
+from app.core.settings.api import NodesEngines
+from app.core.shared_cache import (
+    IN_MEMORY_URL,
+    SharedCache,
+    get_shared_cache,
+    shared_cache_close,
+    shared_cache_init,
+)
+from app.db.base import database
+from app.db.listener import ItemsChangesListener
+from app.db.routing import PRIMARY_COOKIE, read_database_close, read_database_connect
+from app.models.items.queries import get_items_trees_rows
+from tests.test_imports import _category, _offer, _sort_children
+
+
+@pytest.mark.asyncio
+async def test_nodes_engines_return_same_tree(app: FastAPI, monkeypatch):
+    root_id, cat_id, empty_cat_id, empty_sub_id, o1, o2, o3 = (
+        str(uuid.uuid4()) for _ in range(7)
+    )
+    items = [
+        _category(root_id, None),
+        _category(cat_id, root_id),
+        _category(empty_cat_id, root_id),
+        _category(empty_sub_id, empty_cat_id),
+        _offer(o1, root_id, 100),
+        _offer(o2, cat_id, 15),
+        _offer(o3, cat_id, 0),
+    ]
+    settings = get_app_settings()
+    nodes_engine = settings.nodes_engine
+
+    # every node is sent in its own chunk
+    monkeypatch.setattr(StreamedSQLItems, "chunk_size", 1)
+    await items_catalog_init(max_items=1_000_000)
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports", json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"}
+        )
+        assert resp.status_code == 200, resp.text
+
+        nodes_by_engine = {}
+        bodies_by_engine = {}
+        try:
+            for engine in NodesEngines:
+                settings.nodes_engine = engine
+                responses = [
+                    await http_cli.get(f"/nodes/{node_id}")
+                    for node_id in (root_id, cat_id, empty_cat_id, o1)
+                ]
+                nodes_by_engine[engine] = [_sort_children(r.json()) for r in responses]
+                bodies_by_engine[engine] = [r.content for r in responses]
+                resp = await http_cli.get(f"/nodes/{uuid.uuid4()}")
+                assert resp.status_code == 404
+        finally:
+            settings.nodes_engine = nodes_engine
+            await items_catalog_close()
+
+        assert nodes_by_engine[NodesEngines.python] == nodes_by_engine[NodesEngines.sql]
+        assert nodes_by_engine[NodesEngines.catalog] == nodes_by_engine[NodesEngines.sql]
+        assert (
+            bodies_by_engine[NodesEngines.stream] == bodies_by_engine[NodesEngines.python]
+        )
+        root, cat, empty_cat, offer = nodes_by_engine[NodesEngines.python]
+        assert root["price"] == (100 + 15 + 0) // 3
+        assert cat["price"] == (15 + 0) // 2
+        assert empty_cat["price"] is None
+        assert empty_cat["children"][0]["children"] == []
+        assert offer == {
+            "id": o1,
+            "name": o1,
+            "type": "OFFER",
+            "parentId": root_id,
+            "date": "2022-02-01T12:00:00.000Z",
+            "price": 100,
+            "children": None,
+        }
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_nodes_depth_and_children_pages(app: FastAPI):
+    root_id, cat_id, sub_id, *offer_ids = (str(uuid.uuid4()) for _ in range(7))
+    items = [
+        _category(root_id, None),
+        _category(cat_id, root_id),
+        _category(sub_id, cat_id),
+        *(_offer(offer_id, cat_id, 10) for offer_id in offer_ids[:3]),
+        *(_offer(offer_id, sub_id, 40) for offer_id in offer_ids[3:]),
+    ]
+    cat_children_ids = sorted([sub_id, *offer_ids[:3]])
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports", json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"}
+        )
+        assert resp.status_code == 200, resp.text
+
+        resp = await http_cli.get(f"/nodes/{root_id}", params={"depth": 0})
+        assert resp.json()["children"] is None
+        assert resp.json()["price"] == (3 * 10 + 40) // 4
+
+        resp = await http_cli.get(f"/nodes/{root_id}", params={"depth": 1, "limit": 2})
+        root = resp.json()
+        assert "childrenCursor" not in root
+        (cat,) = root["children"]
+        assert cat["id"] == cat_id
+        assert cat["children"] is None
+        assert cat["price"] == root["price"]
+
+        pages = []
+        cursor = None
+        while True:
+            params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+            cat = (await http_cli.get(f"/nodes/{cat_id}", params=params)).json()
+            pages.append([child["id"] for child in cat["children"]])
+            if "childrenCursor" not in cat:
+                break
+            cursor = cat["childrenCursor"]
+            assert cursor == pages[-1][-1]
+        assert pages == [cat_children_ids[:3], cat_children_ids[3:]]
+        # limit applies to every level, 3 children of subcategory fit in a page
+        cat = (await http_cli.get(f"/nodes/{cat_id}", params={"limit": 4})).json()
+        (sub,) = (child for child in cat["children"] if child["id"] == sub_id)
+        assert sorted(child["id"] for child in sub["children"]) == sorted(offer_ids[3:])
+        assert "childrenCursor" not in sub
+
+        full_tree = (await http_cli.get(f"/nodes/{root_id}")).json()
+        unlimited = (await http_cli.get(f"/nodes/{root_id}", params={"depth": 10})).json()
+        assert _sort_children(unlimited) == _sort_children(full_tree)
+
+        resp = await http_cli.get(f"/nodes/{root_id}", params={"limit": 0})
+        assert resp.status_code == 422
+        resp = await http_cli.get(f"/nodes/{uuid.uuid4()}", params={"depth": 1})
+        assert resp.status_code == 404
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_nodes_batch(app: FastAPI):
+    root_id, cat_id, other_root_id, o1, o2, o3 = (str(uuid.uuid4()) for _ in range(6))
+    missing_id = str(uuid.uuid4())
+    items = [
+        _category(root_id, None),
+        _category(cat_id, root_id),
+        _category(other_root_id, None),
+        _offer(o1, root_id, 100),
+        _offer(o2, cat_id, 15),
+        _offer(o3, other_root_id, 7),
+    ]
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        resp = await http_cli.post(
+            "/imports", json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"}
+        )
+        assert resp.status_code == 200, resp.text
+
+        ids = [cat_id, root_id, missing_id, other_root_id, o2, cat_id]
+        resp = await http_cli.post("/nodes", json={"ids": ids})
+        assert resp.status_code == 200, resp.text
+        entries = resp.json()["items"]
+        assert [entry["id"] for entry in entries] == ids[:-1]
+        for entry in entries:
+            resp = await http_cli.get(f"/nodes/{entry['id']}")
+            if entry["id"] == missing_id:
+                assert entry["node"] is None
+                assert entry["error"] == resp.json()["detail"]
+            else:
+                assert _sort_children(entry["node"]) == _sort_children(resp.json())
+                assert entry["error"] is None
+
+        # subtree of category is read with subtree of root
+        rows = await get_items_trees_rows([root_id, cat_id, o2])
+        assert sorted(row[0] for row in rows) == sorted([root_id, cat_id, o1, o2])
+
+        resp = await http_cli.post("/nodes", json={"ids": [root_id] * 101})
+        assert resp.status_code == 400
+
+        for item_id in (root_id, other_root_id):
+            resp = await http_cli.delete(f"/delete/{item_id}")
+            assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_nodes_changes_since_date(app: FastAPI):
+    root_id, cat_id, sub_id, o1, o2 = (str(uuid.uuid4()) for _ in range(5))
+    dates = [f"2022-02-0{day}T12:00:00.000Z" for day in (1, 2, 3)]
+    imports = [
+        [
+            _category(root_id, None),
+            _category(cat_id, root_id),
+            _category(sub_id, cat_id),
+            _offer(o1, sub_id, 10),
+            _offer(o2, cat_id, 20),
+        ],
+        # category is renamed, its ancestors keep their dates
+        [{**_category(sub_id, cat_id), "name": "renamed"}],
+        # all ancestors of offer get new date
+        [_offer(o2, cat_id, 40)],
+    ]
+
+    async with AsyncClient(app=app, base_url="http://test") as http_cli:
+        for items, date in zip(imports, dates):
+            resp = await http_cli.post(
+                "/imports", json={"items": items, "updateDate": date}
+            )
+            assert resp.status_code == 200, resp.text
+
+        resp = await http_cli.get(
+            f"/nodes/{root_id}/changes", params={"since": dates[0], "limit": 1}
+        )
+        changes = resp.json()
+        assert [item["id"] for item in changes["items"]] == [sub_id]
+        assert changes["items"][0]["name"] == "renamed"
+        assert sorted(item["id"] for item in changes["ancestors"]) == sorted(
+            [root_id, cat_id]
+        )
+        assert changes["nextCursor"] is not None
+
+        changed_ids = []
+        params = {"since": dates[0], "limit": 2, "cursor": changes["nextCursor"]}
+        while True:
+            changes = (
+                await http_cli.get(f"/nodes/{root_id}/changes", params=params)
+            ).json()
+            changed_ids += [item["id"] for item in changes["items"]]
+            if changes["nextCursor"] is None:
+                break
+            params["cursor"] = changes["nextCursor"]
+        assert sorted(changed_ids) == sorted([root_id, cat_id, o2])
+
+        resp = await http_cli.get(f"/nodes/{cat_id}/changes", params={"since": dates[1]})
+        changes = resp.json()
+        assert sorted(item["id"] for item in changes["items"]) == sorted([cat_id, o2])
+        assert changes["ancestors"] == []
+        cat = next(item for item in changes["items"] if item["id"] == cat_id)
+        assert cat["price"] == (10 + 40) // 2
+        assert cat["children"] is None
+
+        resp = await http_cli.get(f"/nodes/{root_id}/changes", params={"since": dates[2]})
+        assert resp.json() == {"items": [], "ancestors": [], "nextCursor": None}
+
+        resp = await http_cli.get(
+            f"/nodes/{root_id}/changes", params={"since": dates[0], "cursor": "x"}
+        )
+        assert resp.status_code == 400
+        resp = await http_cli.get(
+            f"/nodes/{uuid.uuid4()}/changes", params={"since": dates[0]}
+        )
+        assert resp.status_code == 404
+
+        resp = await http_cli.delete(f"/delete/{root_id}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_catalog_follows_committed_changes(app: FastAPI):
+    root_id, cat_id, other_cat_id, o1, o2 = (str(uuid.uuid4()) for _ in range(5))
+    items = [
+        _category(root_id, None),
+        _category(cat_id, root_id),
+        _category(other_cat_id, root_id),
+        _offer(o1, cat_id, 10),
+        _offer(o2, other_cat_id, 20),
+    ]
+    settings = get_app_settings()
+    nodes_engine = settings.nodes_engine
+
+    async def get_nodes_by_engines(http_cli: AsyncClient, node_id: str) -> list:
+        nodes = []
+        for engine in (NodesEngines.catalog, NodesEngines.python):
+            settings.nodes_engine = engine
+            resp = await http_cli.get(f"/nodes/{node_id}")
+            nodes.append(_sort_children(resp.json()))
+        return nodes
+
+    await items_catalog_init(max_items=1_000_000)
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as http_cli:
+            resp = await http_cli.post(
+                "/imports",
+                json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"},
+            )
+            assert resp.status_code == 200, resp.text
+
+            # category is moved, offer is changed
+            resp = await http_cli.post(
+                "/imports",
+                json={
+                    "items": [_category(cat_id, other_cat_id), _offer(o2, root_id, 40)],
+                    "updateDate": "2022-02-02T12:00:00.000Z",
+                },
+            )
+            assert resp.status_code == 200, resp.text
+            catalog_nodes, db_nodes = await get_nodes_by_engines(http_cli, root_id)
+            assert catalog_nodes == db_nodes
+            assert catalog_nodes["price"] == (10 + 40) // 2
+
+            resp = await http_cli.delete(f"/delete/{cat_id}")
+            assert resp.status_code == 200
+            catalog_nodes, db_nodes = await get_nodes_by_engines(http_cli, root_id)
+            assert catalog_nodes == db_nodes
+            assert o1 not in get_items_catalog()  # type: ignore
+
+            # catalog is reloaded when changes could be lost
+            catalog = get_items_catalog()
+            await items_catalog_apply_changes(None)
+            assert get_items_catalog() is not catalog
+            catalog_nodes, db_nodes = await get_nodes_by_engines(http_cli, root_id)
+            assert catalog_nodes == db_nodes
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+            settings.nodes_engine = NodesEngines.catalog
+            resp = await http_cli.get(f"/nodes/{o2}")
+            assert resp.status_code == 404
+    finally:
+        settings.nodes_engine = nodes_engine
+        await items_catalog_close()
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_of_nodes_and_sales(app: FastAPI):
+    root_id, cat_id, o1, o2 = (str(uuid.uuid4()) for _ in range(4))
+    items = [
+        _category(root_id, None),
+        _category(cat_id, root_id),
+        _offer(o1, cat_id, 10),
+        _offer(o2, cat_id, 20),
+    ]
+    update_date = "2022-02-01T12:00:00.000Z"
+    settings = get_app_settings()
+    nodes_engine = settings.nodes_engine
+
+    async def assert_not_modified(url: str, etag: str) -> None:
+        resp = await http_cli.get(url, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.headers["etag"] == etag
+        assert not resp.content
+
+    await nodes_cache_init(max_items=100, max_bytes=1 << 20)
+    await items_catalog_init(max_items=1_000_000)
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as http_cli:
+            resp = await http_cli.post(
+                "/imports", json={"items": items, "updateDate": update_date}
+            )
+            assert resp.status_code == 200, resp.text
+
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            etag = resp.headers["etag"]
+            assert resp.headers["last-modified"] == "Tue, 01 Feb 2022 12:00:00 GMT"
+            await assert_not_modified(f"/nodes/{root_id}", etag)
+            # response is cached now
+            await assert_not_modified(f"/nodes/{root_id}", etag)
+            await assert_not_modified(f"/nodes/{root_id}?depth=1", etag)
+            settings.nodes_engine = NodesEngines.catalog
+            await assert_not_modified(f"/nodes/{root_id}", etag)
+
+            # date of root is the same, but the tree isn't
+            resp = await http_cli.post(
+                "/imports",
+                json={"items": [_offer(o1, cat_id, 30)], "updateDate": update_date},
+            )
+            assert resp.status_code == 200, resp.text
+            resp = await http_cli.get(
+                f"/nodes/{root_id}", headers={"If-None-Match": etag}
+            )
+            assert resp.status_code == 200
+            assert resp.headers["etag"] != etag
+            assert resp.json()["price"] == (30 + 20) // 2
+            etag = resp.headers["etag"]
+            settings.nodes_engine = nodes_engine
+
+            resp = await http_cli.get("/sales", params={"date": update_date})
+            sales_etag = resp.headers["etag"]
+            assert resp.headers["last-modified"] == "Tue, 01 Feb 2022 12:00:00 GMT"
+            await assert_not_modified(f"/sales?date={update_date}", sales_etag)
+
+            resp = await http_cli.delete(f"/delete/{o2}")
+            assert resp.status_code == 200
+            for url, old_etag in ((f"/nodes/{root_id}", etag), ("/sales", sales_etag)):
+                resp = await http_cli.get(
+                    url, params={"date": update_date}, headers={"If-None-Match": old_etag}
+                )
+                assert resp.status_code == 200
+                assert resp.headers["etag"] != old_etag
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+    finally:
+        settings.nodes_engine = nodes_engine
+        await items_catalog_close()
+        await nodes_cache_close()
+
+
+@pytest.mark.asyncio
+async def test_nodes_cache_invalidates_changed_items_only(app: FastAPI):
+    root_id, cat_id, other_cat_id, o1, o2 = (str(uuid.uuid4()) for _ in range(5))
+    items = [
+        _category(root_id, None),
+        _category(cat_id, root_id),
+        _category(other_cat_id, root_id),
+        _offer(o1, cat_id, 10),
+        _offer(o2, other_cat_id, 20),
+    ]
+
+    await nodes_cache_init(max_items=100, max_bytes=1 << 20)
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as http_cli:
+            resp = await http_cli.post(
+                "/imports",
+                json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"},
+            )
+            assert resp.status_code == 200, resp.text
+
+            for node_id in (root_id, cat_id, other_cat_id, o1):
+                resp = await http_cli.get(f"/nodes/{node_id}")
+                assert resp.status_code == 200
+            hits = nodes_cache.hits
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["price"] == 15
+            assert nodes_cache.hits == hits + 1
+
+            resp = await http_cli.post(
+                "/imports",
+                json={
+                    "items": [_offer(o1, cat_id, 30)],
+                    "updateDate": "2022-02-02T12:00:00.000Z",
+                },
+            )
+            assert resp.status_code == 200, resp.text
+
+            hits, misses = nodes_cache.hits, nodes_cache.misses
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["price"] == 25
+            resp = await http_cli.get(f"/nodes/{o1}")
+            assert resp.json()["price"] == 30
+            resp = await http_cli.get(f"/nodes/{other_cat_id}")
+            assert resp.json()["date"] == "2022-02-01T12:00:00.000Z"
+            assert (nodes_cache.hits, nodes_cache.misses) == (hits + 1, misses + 2)
+
+            resp = await http_cli.delete(f"/delete/{cat_id}")
+            assert resp.status_code == 200
+            resp = await http_cli.get(f"/nodes/{o1}")
+            assert resp.status_code == 404
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["price"] == 20
+
+            resp = await http_cli.get("/cache/stats")
+            assert resp.json()["nodes"]["hits"] == nodes_cache.hits
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+    finally:
+        await nodes_cache_close()
+
+
+@pytest.mark.asyncio
+async def test_shared_cache_is_invalidated_by_other_worker(app: FastAPI):
+    root_id, cat_id, o1 = (str(uuid.uuid4()) for _ in range(3))
+    items = [_category(root_id, None), _category(cat_id, root_id), _offer(o1, cat_id, 10)]
+    sales_date = "2022-02-01T13:00:00.000Z"
+
+    await nodes_cache_init(max_items=100, max_bytes=1 << 20)
+    await shared_cache_init(redis_url=IN_MEMORY_URL, ttl=60)
+    shared_cache = get_shared_cache()
+    assert shared_cache is not None
+    # another worker with the same redis
+    other_worker = SharedCache(redis=shared_cache._redis, ttl=60)
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as http_cli:
+            resp = await http_cli.post(
+                "/imports",
+                json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"},
+            )
+            assert resp.status_code == 200, resp.text
+
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["price"] == 10
+            sales = (await http_cli.get("/sales", params={"date": sales_date})).json()
+
+            # local cache of this worker is empty, response is taken from shared one
+            nodes_cache.clear()
+            hits = shared_cache.hits
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["price"] == 10
+            resp = await http_cli.get("/sales", params={"date": sales_date})
+            assert resp.json() == sales
+            assert shared_cache.hits == hits + 2
+
+            # change made by another worker drops local and shared entries
+            await other_worker.invalidate_items({root_id})
+            await asyncio.sleep(0.1)
+            assert nodes_cache.get_stats().items == 0
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert shared_cache.hits == hits + 2
+
+            resp = await http_cli.post(
+                "/imports",
+                json={
+                    "items": [_offer(o1, cat_id, 30)],
+                    "updateDate": "2022-02-01T12:30:00.000Z",
+                },
+            )
+            assert resp.status_code == 200, resp.text
+            nodes_cache.clear()
+            resp = await http_cli.get(f"/nodes/{root_id}")
+            assert resp.json()["price"] == 30
+            resp = await http_cli.get("/sales", params={"date": sales_date})
+            assert resp.json()["items"][0]["price"] == 30
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+    finally:
+        await shared_cache_close()
+        await nodes_cache_close()
+
+
+async def _wait_for(changes: list, is_expected: Callable[[list], bool]) -> None:
+    for _ in range(100):
+        if is_expected(changes):
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"Unexpected changes: {changes}")
+
+
+@pytest.mark.asyncio
+async def test_items_changes_are_listened_after_reconnect(app: FastAPI):
+    root_id, cat_id, o1 = (str(uuid.uuid4()) for _ in range(3))
+    items = [_category(root_id, None), _category(cat_id, root_id), _offer(o1, cat_id, 10)]
+    changes: list = []
+
+    async def on_changes(item_ids: Optional[list[str]]) -> None:
+        changes.append(set(item_ids) if item_ids is not None else None)
+
+    listener = ItemsChangesListener(
+        dsn=str(get_app_settings().database_url),
+        handlers=[on_changes],
+        check_interval=0.1,
+    )
+    listener.start()
+    try:
+        await _wait_for(changes, lambda changes: changes == [None])
+        async with AsyncClient(app=app, base_url="http://test") as http_cli:
+            resp = await http_cli.post(
+                "/imports",
+                json={"items": items, "updateDate": "2022-02-01T12:00:00.000Z"},
+            )
+            assert resp.status_code == 200, resp.text
+            await _wait_for(changes, lambda changes: len(changes) == 2)
+            assert changes[1] == {root_id, cat_id, o1}
+
+            # rejected import is rolled back, so nothing is sent
+            resp = await http_cli.post(
+                "/imports",
+                json={
+                    "items": [_offer(o1, cat_id, 20), _category(cat_id, o1)],
+                    "updateDate": "2022-02-01T12:00:00.000Z",
+                },
+            )
+            assert resp.status_code == 400
+
+            await database.execute(
+                """
+                SELECT pg_terminate_backend(pid) FROM pg_stat_activity
+                WHERE query LIKE 'LISTEN%'
+                """
+            )
+            await _wait_for(changes, lambda changes: len(changes) == 3)
+            assert changes[2] is None
+
+            resp = await http_cli.delete(f"/delete/{cat_id}")
+            assert resp.status_code == 200
+            await _wait_for(changes, lambda changes: len(changes) == 4)
+            assert changes[3] == {root_id, cat_id, o1}
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+    finally:
+        await listener.stop()
+
+
+@pytest.mark.asyncio
+async def test_reads_of_replica_after_own_writes(
+    app: FastAPI, postgres, alembic_config, monkeypatch
+):
+    # empty database plays replica which hasn't replayed anything yet,
+    # migrations take url from settings
+    settings = get_app_settings()
+    with monkeypatch.context() as patch:
+        patch.setattr(settings, "database_url", postgres)
+        upgrade(alembic_config, "head")
+    read_your_writes_seconds = settings.read_your_writes_seconds
+    settings.read_your_writes_seconds = 1
+    await read_database_connect(postgres)
+    root_id = str(uuid.uuid4())
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as http_cli:
+            resp = await http_cli.post(
+                "/imports",
+                json={
+                    "items": [_category(root_id, None)],
+                    "updateDate": "2022-02-01T12:00:00.000Z",
+                },
+            )
+            assert resp.status_code == 200, resp.text
+            assert PRIMARY_COOKIE in resp.cookies
+
+            # client which imported item reads it from primary
+            resp = await http_cli.get(f"/nodes/{root_id}?depth=1")
+            assert resp.status_code == 200, resp.text
+            async with AsyncClient(app=app, base_url="http://test") as other_cli:
+                resp = await other_cli.get(f"/nodes/{root_id}?depth=1")
+                assert resp.status_code == 404
+
+            # pin expires, replica is expected to have the item by then
+            await asyncio.sleep(1.5)
+            resp = await http_cli.get(f"/nodes/{root_id}?depth=1")
+            assert resp.status_code == 404
+
+            resp = await http_cli.delete(f"/delete/{root_id}")
+            assert resp.status_code == 200
+    finally:
+        settings.read_your_writes_seconds = read_your_writes_seconds
+        await read_database_close()